@@ -0,0 +1,419 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import resource
+import sys
+import time
+from multiprocessing import Process
+from utils.framing import *
+from utils.transport import *
+from utils.event_loop import *
+from typing import Any, Optional
+
+
+BENCH_MARKER: str = "bench "
+WHISPER_MARKER: str = " шепчет вам: "
+USERS_ONLINE_MARKER: str = "Пользователи онлайн:"
+
+
+class LatencySamples:
+    def __init__(self, capacity: int = 100_000) -> None:
+        self.__samples: list[float] = []
+        self.__capacity: int = capacity
+        self.count: int = 0
+
+
+    def add(self, value: float) -> None:
+        self.count += 1
+        if len(self.__samples) < self.__capacity:
+            self.__samples.append(value)
+            return
+        index = random.randrange(self.count)
+        if index < self.__capacity:
+            self.__samples[index] = value
+
+
+    def summary(self) -> dict[str, Optional[float]]:
+        samples = sorted(self.__samples)
+        if not samples:
+            return {"count": 0, "mean": None, "p50": None, "p99": None, "p999": None, "max": None}
+
+        def percentile(q: float) -> float:
+            return round(samples[min(len(samples) - 1, int(q * len(samples)))], 3)
+
+        return {
+            "count": self.count,
+            "mean": round(sum(samples) / len(samples), 3),
+            "p50": percentile(0.5),
+            "p99": percentile(0.99),
+            "p999": percentile(0.999),
+            "max": round(samples[-1], 3)
+        }
+
+
+def process_tree_rss(pid: int) -> Optional[int]:
+    try:
+        children: dict[int, list[int]] = {}
+        for entry in os.listdir("/proc"):
+            if not entry.isdigit():
+                continue
+            try:
+                with open(f"/proc/{entry}/stat", "r") as file:
+                    ppid = int(file.read().rpartition(")")[2].split()[1])
+            except (OSError, ValueError, IndexError):
+                continue
+            children.setdefault(ppid, []).append(int(entry))
+        rss, stack = 0, [pid]
+        while stack:
+            current = stack.pop()
+            stack.extend(children.get(current, ()))
+            try:
+                with open(f"/proc/{current}/status", "r") as file:
+                    for line in file:
+                        if line.startswith("VmRSS:"):
+                            rss += int(line.split()[1]) * 1024
+                            break
+            except OSError:
+                continue
+        return rss
+    except OSError:
+        return None
+
+
+class BenchmarkClient:
+    def __init__(self, benchmark: "Benchmark", username: str, servername: str) -> None:
+        self.__benchmark: Benchmark = benchmark
+        self.username: str = username
+        self.servername: str = servername
+        self.__connection: Optional[FramedConnection] = None
+        self.__reader: Optional[asyncio.Task] = None
+        self.__users_online_sent: list[int] = []
+
+
+    async def __open(self, host: str, port: int) -> FramedConnection:
+        loop = asyncio.get_event_loop()
+        _, connection = await loop.create_connection(FramedConnection, host, port)
+        return connection
+
+
+    async def __recv_text(self, prefix: str) -> str:
+        while True:
+            frame = await self.__connection.recv_frame()
+            if frame is None:
+                raise ConnectionError("Соединение разорвано сервером")
+            text = frame[1].decode("utf-8")
+            if text.startswith(prefix):
+                return text
+
+
+    async def __recv_control(self) -> str:
+        while True:
+            frame = await self.__connection.recv_frame()
+            if frame is None:
+                raise ConnectionError("Соединение разорвано сервером")
+            if frame[0] == FRAME_CONTROL:
+                return frame[1].decode("utf-8")
+
+
+    async def __join(self) -> None:
+        self.__connection = await self.__open(*self.__benchmark.master_addr)
+        await self.__connection.send_message(f"/connect {self.servername}".encode("utf-8"))
+        response = await self.__recv_control()
+        if response == "connection_approved":
+            await self.__connection.send_message("ready_for_connection".encode("utf-8"), FRAME_CONTROL)
+            response = await self.__recv_control()
+            host, _, port = response.partition(" ")
+            if not port.isdigit():
+                raise ConnectionError(f"Не удалось подключиться к серверу {self.servername}: {response}")
+            self.__connection.close()
+            self.__connection = await self.__open(host, int(port))
+        elif response != "connection_handed_over":
+            raise ConnectionError(f"Не удалось подключиться к серверу {self.servername}: {response}")
+
+
+    async def __authenticate(self) -> None:
+        await self.__recv_text("Введите имя пользователя")
+        await self.__connection.send_message(self.username.encode("utf-8"))
+        frame = await self.__connection.recv_frame()
+        if frame is None:
+            raise ConnectionError("Соединение разорвано сервером")
+        await self.__connection.send_message(self.__benchmark.password.encode("utf-8"))
+        text = await self.__recv_text("")
+        while not text.startswith("Вы подключились"):
+            if text.startswith("Вы ввели неправильный пароль"):
+                raise PermissionError(f"Неверный пароль для пользователя {self.username}")
+            text = await self.__recv_text("")
+
+
+    async def connect(self) -> float:
+        started_at = time.perf_counter()
+        await self.__join()
+        await self.__authenticate()
+        self.__reader = asyncio.create_task(self.__read())
+        return (time.perf_counter() - started_at) * 1000
+
+
+    async def __read(self) -> None:
+        while True:
+            frame = await self.__connection.recv_frame()
+            if frame is None:
+                return
+            received_at = time.perf_counter_ns()
+            text = frame[1].decode("utf-8", "replace")
+            if text.startswith(USERS_ONLINE_MARKER) and self.__users_online_sent:
+                self.__benchmark.users_online_latency.add((received_at - self.__users_online_sent.pop(0)) / 1e6)
+                continue
+            head, marker, sent_at = text.rpartition(BENCH_MARKER)
+            if not marker or not sent_at.isdigit():
+                continue
+            latency = (received_at - int(sent_at)) / 1e6
+            if WHISPER_MARKER in head:
+                self.__benchmark.whisper_latency.add(latency)
+            else:
+                self.__benchmark.broadcast_latency.add(latency)
+            self.__benchmark.messages_received += 1
+
+
+    async def chat(self, peers: list["BenchmarkClient"], deadline: float) -> None:
+        options = self.__benchmark.options
+        interval = 1 / options.rate
+        await asyncio.sleep(random.uniform(0, interval))
+        while time.monotonic() < deadline:
+            roll = random.random()
+            if roll < options.users_online_ratio:
+                self.__users_online_sent.append(time.perf_counter_ns())
+                await self.__connection.send_message("/users_online".encode("utf-8"))
+            elif roll < options.users_online_ratio + options.whisper_ratio and len(peers) > 1:
+                receiver = random.choice(peers)
+                while receiver is self:
+                    receiver = random.choice(peers)
+                await self.__connection.send_message(
+                    f"/whisper {receiver.username} {BENCH_MARKER}{time.perf_counter_ns()}".encode("utf-8"))
+                self.__benchmark.messages_sent += 1
+            else:
+                await self.__connection.send_message(f"{BENCH_MARKER}{time.perf_counter_ns()}".encode("utf-8"))
+                self.__benchmark.messages_sent += 1
+            await asyncio.sleep(random.expovariate(options.rate))
+
+
+    def close(self) -> None:
+        if self.__reader is not None:
+            self.__reader.cancel()
+        if self.__connection is not None:
+            self.__connection.close()
+
+
+class Benchmark:
+    def __init__(self, options: argparse.Namespace) -> None:
+        self.options: argparse.Namespace = options
+        self.master_addr: tuple[str, int] = options.host, options.port
+        self.password: str = options.password
+        self.connect_latency: LatencySamples = LatencySamples()
+        self.broadcast_latency: LatencySamples = LatencySamples()
+        self.whisper_latency: LatencySamples = LatencySamples()
+        self.users_online_latency: LatencySamples = LatencySamples()
+        self.messages_sent: int = 0
+        self.messages_received: int = 0
+        self.__connect_failures: dict[str, int] = {}
+        self.__clients: list[BenchmarkClient] = []
+
+
+    async def __ensure_room(self, servername: str, port: int) -> None:
+        loop = asyncio.get_event_loop()
+        _, connection = await loop.create_connection(FramedConnection, *self.master_addr)
+        try:
+            await connection.send_message("/start_server".encode("utf-8"))
+            for answer in (servername, self.options.room_host, str(port)):
+                while True:
+                    message = await connection.recv_message()
+                    if message is None:
+                        raise ConnectionError("Соединение разорвано сервером")
+                    text = message.decode("utf-8")
+                    if text.startswith("Сервер с заданным именем уже существует"):
+                        return
+                    if text.startswith("Придумайте"):
+                        break
+                await connection.send_message(answer.encode("utf-8"))
+            while True:
+                message = await connection.recv_message()
+                text = "" if message is None else message.decode("utf-8")
+                if message is None or text.startswith("Данные хост + порт уже заняты"):
+                    raise RuntimeError(f"Не удалось создать сервер {servername} на порту {port}")
+                if text.startswith("Сервер успешно создан"):
+                    return
+        finally:
+            connection.close()
+
+
+    async def __connect_client(self, client: BenchmarkClient, semaphore: asyncio.Semaphore) -> None:
+        async with semaphore:
+            try:
+                self.connect_latency.add(await asyncio.wait_for(client.connect(), self.options.connect_timeout))
+                self.__clients.append(client)
+            except Exception as e:
+                reason = type(e).__name__
+                self.__connect_failures[reason] = self.__connect_failures.get(reason, 0) + 1
+                client.close()
+
+
+    async def run(self) -> dict[str, Any]:
+        options = self.options
+        rooms = [f"{options.room_prefix}{i}" for i in range(options.rooms)]
+        for i, servername in enumerate(rooms):
+            await self.__ensure_room(servername, options.room_base_port + i)
+
+        rss_before = process_tree_rss(options.server_pid) if options.server_pid else None
+        semaphore = asyncio.Semaphore(options.connect_concurrency)
+        clients = [BenchmarkClient(self, f"{options.user_prefix}{i}", rooms[i % len(rooms)])
+                   for i in range(options.clients)]
+        connect_started_at = time.perf_counter()
+        await asyncio.gather(*(self.__connect_client(client, semaphore) for client in clients))
+        connect_duration = time.perf_counter() - connect_started_at
+        print(f"Подключено клиентов: {len(self.__clients)} из {options.clients} за {connect_duration:.2f} с")
+        rss_after = process_tree_rss(options.server_pid) if options.server_pid else None
+
+        peers: dict[str, list[BenchmarkClient]] = {}
+        for client in self.__clients:
+            peers.setdefault(client.servername, []).append(client)
+        chat_started_at = time.monotonic()
+        deadline = chat_started_at + options.duration
+        results = await asyncio.gather(*(client.chat(peers[client.servername], deadline)
+                                         for client in self.__clients), return_exceptions=True)
+        chat_duration = time.monotonic() - chat_started_at
+        await asyncio.sleep(options.drain)
+        rss_peak = process_tree_rss(options.server_pid) if options.server_pid else None
+        for client in self.__clients:
+            client.close()
+
+        connected = len(self.__clients)
+        return {
+            "started_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "config": {key: value for key, value in vars(options).items() if key not in ("password", "baseline")},
+            "clients_connected": connected,
+            "connect_failures": self.__connect_failures,
+            "chat_failures": sum(isinstance(result, Exception) for result in results),
+            "connect_duration_s": round(connect_duration, 3),
+            "chat_duration_s": round(chat_duration, 3),
+            "connect_latency_ms": self.connect_latency.summary(),
+            "broadcast_latency_ms": self.broadcast_latency.summary(),
+            "whisper_latency_ms": self.whisper_latency.summary(),
+            "users_online_latency_ms": self.users_online_latency.summary(),
+            "messages_sent": self.messages_sent,
+            "messages_received": self.messages_received,
+            "sent_per_sec": round(self.messages_sent / chat_duration, 1) if chat_duration else None,
+            "received_per_sec": round(self.messages_received / chat_duration, 1) if chat_duration else None,
+            "rss_bytes": {
+                "before": rss_before,
+                "connected": rss_after,
+                "after_chat": rss_peak,
+                "per_connection": (rss_after - rss_before) // connected
+                if rss_before is not None and rss_after is not None and connected else None
+            }
+        }
+
+
+REGRESSION_CHECKS: tuple[tuple[str, str, bool], ...] = (
+    ("connect_latency_ms", "p99", False),
+    ("broadcast_latency_ms", "p50", False),
+    ("broadcast_latency_ms", "p99", False),
+    ("whisper_latency_ms", "p99", False),
+    ("received_per_sec", "", True),
+)
+
+
+def compare_with_baseline(result: dict[str, Any], baseline: dict[str, Any], max_regression: float) -> bool:
+    passed = True
+    for section, key, higher_is_better in REGRESSION_CHECKS:
+        current = result.get(section)
+        previous = baseline.get(section)
+        if key:
+            current = None if current is None else current.get(key)
+            previous = None if previous is None else previous.get(key)
+        if not current or not previous:
+            continue
+        change = (current - previous) / previous
+        regressed = -change > max_regression if higher_is_better else change > max_regression
+        passed = passed and not regressed
+        name = f"{section}.{key}" if key else section
+        print(f"{name}: {previous} -> {current} ({change:+.1%}){' РЕГРЕССИЯ' if regressed else ''}")
+    return passed
+
+
+def raise_open_files_limit() -> None:
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+
+def run_spawned_master(host: str, port: int, room_workers: int, fd_passing: bool, loop_impl: str) -> None:
+    from master_server import MasterServer
+    master = MasterServer(host, port, room_workers=room_workers, fd_passing=fd_passing, loop_impl=loop_impl,
+                          storage_config={"backend": "memory"}, per_ip_rate=None)
+    run_event_loop(master.run_master_server(), loop_impl)
+
+
+def parse_args(argv: Optional[list[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Нагрузочное тестирование MasterServer и комнат")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--spawn", action="store_true",
+                        help="запустить MasterServer с хранилищем в памяти в отдельном процессе")
+    parser.add_argument("--room-workers", type=int, default=None)
+    parser.add_argument("--fd-passing", action="store_true")
+    parser.add_argument("--server-pid", type=int, default=None,
+                        help="PID мастер-сервера для измерения RSS (вместе с дочерними процессами)")
+    parser.add_argument("--clients", type=int, default=200)
+    parser.add_argument("--rooms", type=int, default=1)
+    parser.add_argument("--room-prefix", default="benchroom")
+    parser.add_argument("--room-host", default="127.0.0.1")
+    parser.add_argument("--room-base-port", type=int, default=9100)
+    parser.add_argument("--user-prefix", default="benchuser")
+    parser.add_argument("--password", default="benchpassword")
+    parser.add_argument("--connect-concurrency", type=int, default=64)
+    parser.add_argument("--connect-timeout", type=float, default=30)
+    parser.add_argument("--rate", type=float, default=0.5, help="сообщений в секунду на клиента")
+    parser.add_argument("--whisper-ratio", type=float, default=0.1)
+    parser.add_argument("--users-online-ratio", type=float, default=0.01)
+    parser.add_argument("--duration", type=float, default=30)
+    parser.add_argument("--drain", type=float, default=2)
+    parser.add_argument("--loop", choices=EVENT_LOOP_IMPLEMENTATIONS, default="auto")
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument("--baseline", default=None, help="JSON с результатами прошлого запуска для сравнения")
+    parser.add_argument("--max-regression", type=float, default=0.2)
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    options = parse_args(argv)
+    raise_open_files_limit()
+    master: Optional[Process] = None
+    if options.spawn:
+        master = Process(target=run_spawned_master,
+                         args=(options.host, options.port, options.room_workers, options.fd_passing, options.loop))
+        master.start()
+        options.server_pid = options.server_pid or master.pid
+        time.sleep(1)
+    try:
+        result = run_event_loop(Benchmark(options).run(), options.loop)
+    finally:
+        if master is not None:
+            master.terminate()
+            master.join()
+
+    with open(options.output, "w") as file:
+        json.dump(result, file, indent=2, ensure_ascii=False)
+    print(json.dumps(result, indent=2, ensure_ascii=False))
+    print(f"Результаты сохранены в {options.output}")
+
+    if options.baseline:
+        with open(options.baseline, "r") as file:
+            baseline = json.load(file)
+        if not compare_with_baseline(result, baseline, options.max_regression):
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
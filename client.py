@@ -1,11 +1,12 @@
 import asyncio
-import socket
+from utils.framing import *
+from utils.transport import *
+from utils.event_loop import *
 from typing import Optional
 
 class Client:
     def __init__(self, host, port):
-        self.__sock: socket.socket = socket.socket()
-        self.__sock.setblocking(False)
+        self.__connection: Optional[FramedConnection] = None
         self._addr: tuple[str, int] = host, port
         self._is_connected: bool = False
         self.__receive_task: Optional[asyncio.Task] = None
@@ -13,11 +14,13 @@ class Client:
 
 
     async def __receive(self) -> None:
-        loop = asyncio.get_event_loop()
-
         while self._is_connected:
-            message = await loop.sock_recv(self.__sock, 1024)
-            print(message.decode("utf-8"))
+            frame = await self.__connection.recv_frame()
+            if frame is None:
+                print("Соединение с сервером разорвано")
+                self._is_connected = False
+                break
+            print(frame[1].decode("utf-8"))
 
 
     async def __send(self) -> None:
@@ -41,26 +44,33 @@ class Client:
                     self.__receive_task = asyncio.create_task(self.__receive())
                     continue
                 servername = response.split(" ")[1]
-                await loop.sock_sendall(self.__sock, (command + " " + servername).encode("utf-8"))
-                server_response = (await loop.sock_recv(self.__sock, 1024)).decode("utf-8")
+                await self.__connection.send_message((command + " " + servername).encode("utf-8"))
+                frame_type, server_response = await self.__connection.recv_frame()
+                while frame_type != FRAME_CONTROL:
+                    print(server_response.decode("utf-8"))
+                    frame_type, server_response = await self.__connection.recv_frame()
+                server_response = server_response.decode("utf-8")
 
                 if server_response == "connection_approved":
                     print("Выполняется подключение к серверу...")
-                    await loop.sock_sendall(self.__sock, "ready_for_connection".encode("utf-8"))
-                    server_response = (await loop.sock_recv(self.__sock, 1024)).decode("utf-8")
+                    await self.__connection.send_message("ready_for_connection".encode("utf-8"), FRAME_CONTROL)
+                    server_response = await self.__connection.recv_text()
                     host, port = server_response.split(" ")
                     port = int(port)
-                    self.__sock.close()
-                    self.__sock = socket.socket()
-                    self.__sock.setblocking(False)
+                    self.__connection.close()
                     self._addr = host, port
                     await self.connect()
+                elif server_response == "connection_handed_over":
+                    print("Вы подключены к серверу")
+                    self.__receive_task = asyncio.create_task(self.__receive())
+                    continue
                 else:
                     self.__receive_task = asyncio.create_task(self.__receive())
-                    print("Такой сервер не существует")
+                    print("Такой сервер не существует" if server_response == "server_is_not_exist"
+                          else server_response)
 
                     continue
-            await loop.sock_sendall(self.__sock, response.encode("utf-8"))
+            await self.__connection.send_message(response.encode("utf-8"))
 
 
     async def connect(self) -> None:
@@ -71,7 +81,7 @@ class Client:
             self.__send_task.cancel()
 
         loop = asyncio.get_event_loop()
-        await loop.sock_connect(self.__sock, self._addr)
+        _, self.__connection = await loop.create_connection(FramedConnection, *self._addr)
         self._is_connected = True
         self.__receive_task = asyncio.create_task(self.__receive())
         self.__send_task = asyncio.create_task(self.__send())
@@ -85,10 +95,10 @@ class Client:
             self._is_connected = False
             for task in (self.__receive_task, self.__send_task):
                 task.cancel()
-            self.__sock.close()
+            self.__connection.close()
 
 
 
 if __name__ == "__main__":
     client = Client("127.0.0.1", 8000)
-    asyncio.run(client.connect())
+    run_event_loop(client.connect())
@@ -1,10 +1,19 @@
 CREATE TABLE IF NOT EXISTS users_list(
     username VARCHAR(64) PRIMARY KEY,
-    password VARCHAR(64) NOT NULL
+    password VARCHAR(256) NOT NULL
 );
 CREATE TABLE IF NOT EXISTS servers_list(
     servername VARCHAR(128) PRIMARY KEY,
     host VARCHAR(16)  NOT NULL,
     port INTEGER NOT NULL,
     UNIQUE (host, port)
-);
\ No newline at end of file
+);
+CREATE TABLE IF NOT EXISTS offline_whispers(
+    id BIGSERIAL PRIMARY KEY,
+    receiver VARCHAR(64) NOT NULL,
+    sent_at DOUBLE PRECISION NOT NULL,
+    sender VARCHAR(64) NOT NULL,
+    message TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS offline_whispers_receiver ON offline_whispers(receiver);
+CREATE INDEX IF NOT EXISTS offline_whispers_sent_at ON offline_whispers(sent_at);
@@ -1,2 +1,8 @@
 from database_handling.psql_requests import *
+from database_handling.statements import *
 from database_handling.execute_requests import *
+from database_handling.storage import *
+from database_handling.message_log import *
+from database_handling.routing_table import *
+from database_handling.broker import *
+from database_handling.mailbox import *
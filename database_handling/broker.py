@@ -0,0 +1,173 @@
+import asyncio
+import json
+import os
+import tempfile
+from database_handling.storage import Storage, StorageError
+from typing import Any, Optional
+from utils.structured_logging import get_logger
+from utils.framing import FrameError
+from utils.transport import FrameBatcher, FramedConnection
+
+
+log = get_logger(__name__)
+
+BROKER_METHODS: frozenset[str] = frozenset({
+    "get_password_by_username",
+    "add_user",
+    "update_password",
+    "get_servers",
+    "check_if_server_exists",
+    "add_server",
+    "add_whispers",
+    "pop_whispers",
+    "delete_expired_whispers"
+})
+
+
+def default_broker_path() -> str:
+    return os.path.join(tempfile.gettempdir(), f"simplechat-storage-{os.getpid()}.sock")
+
+
+class StorageBroker:
+    def __init__(self, storage: Storage, path: Optional[str] = None) -> None:
+        self.__storage: Storage = storage
+        self.path: str = path or default_broker_path()
+        self.__server: Optional[asyncio.AbstractServer] = None
+
+
+    async def __handle(self, replies: FrameBatcher, request_id: int, method: str, args: list[Any]) -> None:
+        if method not in BROKER_METHODS:
+            replies.add([request_id, False, f"unknown method {method}"])
+            return
+        try:
+            replies.add([request_id, True, await getattr(self.__storage, method)(*args)])
+        except (StorageError, ConnectionError, TypeError, FrameError) as e:
+            replies.add([request_id, False, str(e)])
+        except Exception as e:
+            log.exception("Непредвиденная ошибка хранилища в %s: %s", method, e)
+            replies.add([request_id, False, str(e)])
+
+
+    async def __serve_connection(self, connection: FramedConnection) -> None:
+        replies = FrameBatcher(connection)
+        while (frame := await connection.recv_frame()) is not None:
+            try:
+                requests = json.loads(frame[1])
+            except ValueError:
+                connection.close()
+                return
+            for request_id, method, args in requests:
+                asyncio.create_task(self.__handle(replies, request_id, method, args))
+
+
+    async def start(self) -> None:
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        loop = asyncio.get_event_loop()
+        self.__server = await loop.create_unix_server(lambda: FramedConnection(self.__serve_connection), self.path)
+
+
+    async def close(self) -> None:
+        if self.__server is not None:
+            self.__server.close()
+            await self.__server.wait_closed()
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+
+class BrokerStorage(Storage):
+    def __init__(self, path: str, timeout: float = 30) -> None:
+        self.__path: str = path
+        self.__timeout: float = timeout
+        self.__connection: Optional[FramedConnection] = None
+        self.__requests: Optional[FrameBatcher] = None
+        self.__connect_lock: asyncio.Lock = asyncio.Lock()
+        self.__pending: dict[int, asyncio.Future] = {}
+        self.__next_request_id: int = 0
+
+
+    async def __read_replies(self, connection: FramedConnection) -> None:
+        while (frame := await connection.recv_frame()) is not None:
+            for request_id, ok, result in json.loads(frame[1]):
+                future = self.__pending.pop(request_id, None)
+                if future is None or future.done():
+                    continue
+                if ok:
+                    future.set_result(result)
+                else:
+                    future.set_exception(StorageError(result))
+        self.__connection = None
+        for future in self.__pending.values():
+            if not future.done():
+                future.set_exception(ConnectionError("Соединение с брокером хранилища разорвано"))
+        self.__pending.clear()
+
+
+    async def __connect(self) -> None:
+        async with self.__connect_lock:
+            if self.__connection is not None:
+                return
+            loop = asyncio.get_event_loop()
+            try:
+                _, connection = await loop.create_unix_connection(FramedConnection, self.__path)
+            except OSError as e:
+                raise ConnectionError(f"Не удалось подключиться к брокеру хранилища {self.__path}: {e}")
+            self.__connection = connection
+            self.__requests = FrameBatcher(connection)
+            asyncio.create_task(self.__read_replies(connection))
+
+
+    async def __request(self, method: str, *args: Any) -> Any:
+        if self.__connection is None:
+            await self.__connect()
+        request_id = self.__next_request_id
+        self.__next_request_id += 1
+        future = asyncio.get_event_loop().create_future()
+        self.__pending[request_id] = future
+        self.__requests.add([request_id, method, list(args)])
+        try:
+            return await asyncio.wait_for(future, self.__timeout)
+        finally:
+            self.__pending.pop(request_id, None)
+
+
+    async def close(self) -> None:
+        if self.__connection is not None:
+            self.__connection.close()
+
+
+    async def get_password_by_username(self, username: str) -> Optional[str]:
+        return await self.__request("get_password_by_username", username)
+
+
+    async def add_user(self, username: str, password: str) -> None:
+        await self.__request("add_user", username, password)
+
+
+    async def update_password(self, username: str, password: str) -> None:
+        await self.__request("update_password", username, password)
+
+
+    async def get_servers(self) -> dict[str, tuple[str, int]]:
+        servers = await self.__request("get_servers")
+        return {servername: (host, port) for servername, (host, port) in servers.items()}
+
+
+    async def check_if_server_exists(self, servername: str) -> bool:
+        return await self.__request("check_if_server_exists", servername)
+
+
+    async def add_server(self, servername: str, host: str, port: int) -> None:
+        await self.__request("add_server", servername, host, port)
+
+
+    async def add_whispers(self, whispers: list[tuple[str, float, str, str]], max_pending: int) -> None:
+        await self.__request("add_whispers", whispers, max_pending)
+
+
+    async def pop_whispers(self, username: str, expires_before: float) -> list[tuple[float, str, str]]:
+        return [tuple(whisper) for whisper in await self.__request("pop_whispers", username, expires_before)]
+
+
+    async def delete_expired_whispers(self, expires_before: float) -> None:
+        await self.__request("delete_expired_whispers", expires_before)
@@ -1,45 +1,57 @@
+from database_handling.psql_requests import *
+from database_handling.statements import *
 from asyncpg import Pool
 from typing import Optional
-from database_handling.psql_requests import *
 
 
+get_password_by_username_stmt: Statement = declare_statement("get_password_by_username",
+                                                             get_password_by_username_req)
+add_user_stmt: Statement = declare_statement("add_user", add_user_to_table_req)
+update_password_stmt: Statement = declare_statement("update_password", update_password_req)
+get_servers_stmt: Statement = declare_statement("get_servers", get_servers_req)
+check_if_server_exists_stmt: Statement = declare_statement("check_if_server_exists", check_if_server_exists_req)
+add_server_to_table_stmt: Statement = declare_statement("add_server_to_table", add_server_to_table_req)
+add_whisper_stmt: Statement = declare_statement("add_whisper", add_whisper_req)
+pop_whispers_stmt: Statement = declare_statement("pop_whispers", pop_whispers_req)
+delete_expired_whispers_stmt: Statement = declare_statement("delete_expired_whispers", delete_expired_whispers_req)
+
 
 async def add_user(pool: Pool, username: str, password:str) -> None:
-    async with pool.acquire() as psql_connection:
-        await psql_connection.execute(add_user_to_table_req(username, password))
+    await run_statement(pool, add_user_stmt, "fetch", username, password)
+
+
+async def update_password(pool: Pool, username: str, password: str) -> None:
+    await run_statement(pool, update_password_stmt, "fetch", username, password)
 
 
 async def get_password_by_username(pool: Pool, username: str) -> Optional[str]:
-    async with pool.acquire() as psql_connection:
-        return await psql_connection.fetchval(get_password_by_username_req(username))
+    return await run_statement(pool, get_password_by_username_stmt, "fetchval", username)
 
 
-async def get_server_list(pool: Pool) -> list[str]:
-    async with pool.acquire() as psql_connection:
-        server_list = (await psql_connection.fetch(get_server_list_req))
-    if server_list:
-        server_list = [i["servername"] for i in server_list]
-    else:
-        server_list = ["Нет доступных серверов"]
-    return server_list
+async def check_if_server_exists(pool: Pool, servername: str) -> bool:
+    return (await run_statement(pool, check_if_server_exists_stmt, "fetchrow", servername)) is not None
 
 
-async def get_host_port(pool: Pool, servername: str) -> Optional[tuple[str, int]]:
-    async with pool.acquire() as psql_connection:
-        resp = await psql_connection.fetchrow(get_host_port_req(servername))
-    if resp:
-        host, port = resp["host"], resp["port"]
-        if host == "localhost":
-            host = "127.0.0.1"
-        return host, port
-    return None
+async def add_server_to_table(pool: Pool, servername: str, host: str, port: int) -> None:
+    await run_statement(pool, add_server_to_table_stmt, "fetch", servername, host, port)
 
 
-async def check_if_server_exists(pool: Pool, servername: str) -> bool:
-    async with pool.acquire() as psql_connection:
-        return (await psql_connection.fetchrow(check_if_server_exists_req(servername))) is not None
+async def get_servers(pool: Pool) -> dict[str, tuple[str, int]]:
+    rows = await run_statement(pool, get_servers_stmt, "fetch")
+    return {row["servername"]: ("127.0.0.1" if row["host"] == "localhost" else row["host"], row["port"])
+            for row in rows}
 
 
-async def add_server_to_table(pool: Pool, servername: str, host: str, port: int) -> None:
-    async with pool.acquire() as psql_connection:
-        await psql_connection.execute(add_server_to_table_req(servername, host, port))
+async def add_whispers(pool: Pool, whispers: list[tuple[str, float, str, str]], max_pending: int) -> None:
+    await run_statement(pool, add_whisper_stmt, "executemany",
+                        [(receiver, sent_at, sender, message, max_pending)
+                         for receiver, sent_at, sender, message in whispers])
+
+
+async def pop_whispers(pool: Pool, username: str, expires_before: float) -> list[tuple[float, str, str]]:
+    rows = await run_statement(pool, pop_whispers_stmt, "fetch", username, expires_before)
+    return [(row["sent_at"], row["sender"], row["message"]) for row in rows]
+
+
+async def delete_expired_whispers(pool: Pool, expires_before: float) -> None:
+    await run_statement(pool, delete_expired_whispers_stmt, "execute", expires_before)
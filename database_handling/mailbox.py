@@ -0,0 +1,73 @@
+import asyncio
+import time
+from database_handling.storage import Storage, StorageError
+from typing import Optional
+from utils.metrics import metrics
+from utils.structured_logging import get_logger
+
+
+log = get_logger(__name__)
+
+whispers_queued = metrics.counter("chat_offline_whispers_queued_total", "Whispers stored for offline users")
+whispers_delivered = metrics.counter("chat_offline_whispers_delivered_total", "Stored whispers delivered on login")
+whispers_lost = metrics.counter("chat_offline_whispers_lost_total", "Stored whispers that failed to persist")
+
+
+class OfflineMailbox:
+    def __init__(self, storage: Storage, max_pending: int = 100, ttl: float = 7 * 24 * 3600,
+                 flush_interval: float = 0.05, purge_interval: float = 3600) -> None:
+        self.__storage: Storage = storage
+        self.max_pending: int = max_pending
+        self.__ttl: float = ttl
+        self.__flush_interval: float = flush_interval
+        self.__purge_interval: float = purge_interval
+        self.__purged_at: float = time.monotonic()
+        self.__pending: list[tuple[str, float, str, str]] = []
+        self.__flusher: Optional[asyncio.Task] = None
+
+
+    def put(self, receiver: str, sender: str, message: str) -> None:
+        self.__pending.append((receiver, time.time(), sender, message))
+        whispers_queued.inc()
+        if self.__flusher is None or self.__flusher.done():
+            self.__flusher = asyncio.create_task(self.__flush_later())
+
+
+    async def __flush_later(self) -> None:
+        await asyncio.sleep(self.__flush_interval)
+        await self.__flush()
+
+
+    async def __flush(self) -> None:
+        whispers, self.__pending = self.__pending, []
+        if whispers:
+            try:
+                await self.__storage.add_whispers(whispers, self.max_pending)
+            except (StorageError, ConnectionError, TimeoutError) as e:
+                whispers_lost.inc(len(whispers))
+                log.error("Не удалось сохранить %s сообщений для пользователей не в сети: %s", len(whispers), e)
+        if time.monotonic() - self.__purged_at >= self.__purge_interval:
+            self.__purged_at = time.monotonic()
+            try:
+                await self.__storage.delete_expired_whispers(time.time() - self.__ttl)
+            except (StorageError, ConnectionError, TimeoutError) as e:
+                log.warning("Не удалось удалить устаревшие сообщения для пользователей не в сети: %s", e)
+
+
+    async def take(self, username: str) -> list[tuple[float, str, str]]:
+        if self.__flusher is not None and not self.__flusher.done():
+            await asyncio.shield(self.__flusher)
+        expires_before = time.time() - self.__ttl
+        whispers = [(sent_at, sender, message) for receiver, sent_at, sender, message in self.__pending
+                    if receiver == username and sent_at >= expires_before]
+        if whispers:
+            self.__pending = [whisper for whisper in self.__pending if whisper[0] != username]
+        whispers = sorted(await self.__storage.pop_whispers(username, expires_before) + whispers)[-self.max_pending:]
+        whispers_delivered.inc(len(whispers))
+        return whispers
+
+
+    async def close(self) -> None:
+        if self.__flusher is not None:
+            await self.__flusher
+        await self.__flush()
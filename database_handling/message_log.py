@@ -0,0 +1,250 @@
+import asyncio
+import mmap
+import os
+import struct
+import time
+import zlib
+from array import array
+from bisect import bisect_left
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Optional
+from utils.metrics import metrics
+from utils.structured_logging import get_logger
+
+
+log = get_logger(__name__)
+
+history_appended = metrics.counter("chat_history_records_total", "Messages appended to the history log",
+                                   ("servername",))
+history_flush_duration = metrics.histogram("chat_history_flush_seconds", "Time to write and fsync a history batch",
+                                           ("servername",))
+
+RECORD_HEADER: struct.Struct = struct.Struct("!IIQdH")
+SEGMENT_SUFFIX: str = ".seg"
+
+HistoryRecord = tuple[int, float, str, str]
+
+
+def encode_record(seq: int, sent_at: float, username: str, message: str) -> bytes:
+    username_bytes = username.encode("utf-8")
+    body = username_bytes + message.encode("utf-8")
+    checksum = zlib.crc32(RECORD_HEADER.pack(0, 0, seq, sent_at, len(username_bytes))[8:] + body)
+    return RECORD_HEADER.pack(RECORD_HEADER.size + len(body), checksum, seq, sent_at, len(username_bytes)) + body
+
+
+class _Segment:
+    def __init__(self, path: str, first_seq: int) -> None:
+        self.path: str = path
+        self.first_seq: int = first_seq
+        self.offsets: array = array("Q")
+        self.timestamps: array = array("d")
+        self.size: int = 0
+        self.__map: Optional[mmap.mmap] = None
+
+
+    @property
+    def next_seq(self) -> int:
+        return self.first_seq + len(self.offsets)
+
+
+    def view(self) -> mmap.mmap:
+        if self.__map is None or len(self.__map) < self.size:
+            self.release()
+            with open(self.path, "rb") as file:
+                self.__map = mmap.mmap(file.fileno(), self.size, access=mmap.ACCESS_READ)
+        return self.__map
+
+
+    def load(self) -> None:
+        self.size = os.path.getsize(self.path)
+        if not self.size:
+            return
+        data = self.view()
+        offset = 0
+        while offset + RECORD_HEADER.size <= self.size:
+            length, checksum, seq, sent_at, username_length = RECORD_HEADER.unpack_from(data, offset)
+            if length < RECORD_HEADER.size or offset + length > self.size or seq != self.next_seq or \
+                    zlib.crc32(data[offset + 8:offset + length]) != checksum:
+                break
+            self.offsets.append(offset)
+            self.timestamps.append(sent_at)
+            offset += length
+        if offset != self.size:
+            log.warning("История %s повреждена после смещения %s, хвост отброшен", self.path, offset)
+            self.release()
+            os.truncate(self.path, offset)
+            self.size = offset
+
+
+    def read(self, index: int) -> HistoryRecord:
+        data = self.view()
+        offset = self.offsets[index]
+        length, _, seq, sent_at, username_length = RECORD_HEADER.unpack_from(data, offset)
+        body = offset + RECORD_HEADER.size
+        return (seq, sent_at, data[body:body + username_length].decode("utf-8"),
+                data[body + username_length:offset + length].decode("utf-8"))
+
+
+    def release(self) -> None:
+        if self.__map is not None:
+            self.__map.close()
+            self.__map = None
+
+
+def create_history_executor() -> ThreadPoolExecutor:
+    return ThreadPoolExecutor(max_workers=1, thread_name_prefix="history")
+
+
+class MessageLog:
+    def __init__(self, path: str, servername: str = "", segment_bytes: int = 64 << 20, max_segments: int = 16,
+                 flush_interval: float = 0.05, recent_size: int = 1024,
+                 executor: Optional[ThreadPoolExecutor] = None) -> None:
+        self.path: str = path
+        self.__segment_bytes: int = segment_bytes
+        self.__max_segments: int = max_segments
+        self.__flush_interval: float = flush_interval
+        self.__segments: list[_Segment] = []
+        self.__file: Optional[Any] = None
+        self.__executor: ThreadPoolExecutor = executor or create_history_executor()
+        self.__owns_executor: bool = executor is None
+        self.__next_seq: int = 0
+        self.__pending: list[bytes] = []
+        self.__recent: deque[HistoryRecord] = deque(maxlen=recent_size)
+        self.__wakeup: Optional[asyncio.Event] = None
+        self.__flusher: Optional[asyncio.Task] = None
+        self.__appended = history_appended.labels(servername)
+        self.__flush_duration = history_flush_duration.labels(servername)
+
+
+    async def __run(self, function: Callable, *args: Any) -> Any:
+        return await asyncio.get_event_loop().run_in_executor(self.__executor, function, *args)
+
+
+    def __load(self) -> None:
+        os.makedirs(self.path, exist_ok=True)
+        for name in sorted(os.listdir(self.path)):
+            if name.endswith(SEGMENT_SUFFIX) and name[:-len(SEGMENT_SUFFIX)].isdigit():
+                segment = _Segment(os.path.join(self.path, name), int(name[:-len(SEGMENT_SUFFIX)]))
+                if self.__segments and segment.first_seq != self.__segments[-1].next_seq:
+                    log.warning("В истории %s пропущены сообщения перед %s", self.path, segment.first_seq)
+                segment.load()
+                self.__segments.append(segment)
+        if not self.__segments:
+            self.__rotate(0)
+        self.__file = open(self.__segments[-1].path, "ab")
+
+
+    def __rotate(self, first_seq: int) -> None:
+        if self.__file is not None:
+            self.__file.close()
+        path = os.path.join(self.path, f"{first_seq:020d}{SEGMENT_SUFFIX}")
+        self.__file = open(path, "ab")
+        self.__segments.append(_Segment(path, first_seq))
+        while len(self.__segments) > self.__max_segments:
+            expired = self.__segments.pop(0)
+            expired.release()
+            os.unlink(expired.path)
+
+
+    def __write(self, records: list[bytes]) -> None:
+        segment = self.__segments[-1]
+        for record in records:
+            if segment.size >= self.__segment_bytes:
+                self.__file.flush()
+                os.fsync(self.__file.fileno())
+                self.__rotate(segment.next_seq)
+                segment = self.__segments[-1]
+            self.__file.write(record)
+            segment.offsets.append(segment.size)
+            segment.timestamps.append(RECORD_HEADER.unpack_from(record)[3])
+            segment.size += len(record)
+        self.__file.flush()
+        os.fsync(self.__file.fileno())
+
+
+    def __read(self, before: int, limit: int) -> list[HistoryRecord]:
+        records: list[HistoryRecord] = []
+        for segment in reversed(self.__segments):
+            if len(records) >= limit:
+                break
+            end = min(before, segment.next_seq) - segment.first_seq
+            if end <= 0:
+                continue
+            start = max(0, end - (limit - len(records)))
+            records[:0] = [segment.read(index) for index in range(start, end)]
+        return records
+
+
+    def __seq_at(self, sent_at: float) -> int:
+        for segment in self.__segments:
+            index = bisect_left(segment.timestamps, sent_at)
+            if index < len(segment.timestamps):
+                return segment.first_seq + index
+        return self.__segments[-1].next_seq
+
+
+    async def open(self) -> None:
+        await self.__run(self.__load)
+        self.__next_seq = self.__segments[-1].next_seq
+        self.__wakeup = asyncio.Event()
+        self.__flusher = asyncio.create_task(self.__flush_forever())
+
+
+    def append(self, username: str, message: str, sent_at: Optional[float] = None) -> int:
+        seq = self.__next_seq
+        self.__next_seq += 1
+        sent_at = time.time() if sent_at is None else sent_at
+        self.__pending.append(encode_record(seq, sent_at, username, message))
+        self.__recent.append((seq, sent_at, username, message))
+        self.__appended.inc()
+        self.__wakeup.set()
+        return seq
+
+
+    async def __flush(self) -> None:
+        records, self.__pending = self.__pending, []
+        if not records:
+            return
+        with self.__flush_duration.time():
+            await self.__run(self.__write, records)
+
+
+    async def __flush_forever(self) -> None:
+        while True:
+            await self.__wakeup.wait()
+            await asyncio.sleep(self.__flush_interval)
+            self.__wakeup.clear()
+            try:
+                await self.__flush()
+            except OSError as e:
+                log.error("Не удалось записать историю сообщений %s: %s", self.path, e)
+
+
+    async def read(self, before: Optional[int] = None, limit: int = 50) -> list[HistoryRecord]:
+        before = self.__next_seq if before is None else before
+        records = await self.__run(self.__read, before, limit)
+        newest = records[-1][0] if records else -1
+        records.extend(record for record in self.__recent if newest < record[0] < before)
+        return records[-limit:]
+
+
+    async def seq_at(self, sent_at: float) -> int:
+        return await self.__run(self.__seq_at, sent_at)
+
+
+    async def close(self) -> None:
+        if self.__flusher is not None:
+            self.__flusher.cancel()
+            self.__flusher = None
+        await self.__flush()
+        await self.__run(self.__close)
+        if self.__owns_executor:
+            self.__executor.shutdown(wait=False)
+
+
+    def __close(self) -> None:
+        if self.__file is not None:
+            self.__file.close()
+        for segment in self.__segments:
+            segment.release()
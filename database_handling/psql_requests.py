@@ -1,49 +1,72 @@
-def get_password_by_username_req(username: str) -> str:
-    return \
-        f"""
-        SELECT password
-        FROM users_list
-        WHERE username = '{username}'
-        """
-
-
-def add_user_to_table_req(username: str, password: str) -> str:
-    return \
-        f"""
-        INSERT INTO users_list(username, password)
-        VALUES('{username}', '{password}');
-        """
-
-
-def get_host_port_req(servername: str) -> str:
-    return \
-        f"""
-        SELECT host, port
-        FROM servers_list
-        WHERE servername = '{servername}'
-        """
-
-
-def check_if_server_exists_req(servername: str) -> str:
-    return \
-        f"""
-        SELECT servername
-        FROM servers_list
-        WHERE servername = '{servername}'
-        """
-
-
-def add_server_to_table_req(servername: str, host: str, port: int)-> str:
-    return \
-        f"""
-        INSERT INTO servers_list(servername, host, port)
-        VALUES('{servername}', '{host}', {port});
-        """
-
-
-get_server_list_req: str=\
-    f"""
+get_password_by_username_req: str=\
+    """
+    SELECT password
+    FROM users_list
+    WHERE username = $1
+    """
+
+
+add_user_to_table_req: str=\
+    """
+    INSERT INTO users_list(username, password)
+    VALUES($1, $2);
+    """
+
+
+update_password_req: str=\
+    """
+    UPDATE users_list
+    SET password = $2
+    WHERE username = $1
+    """
+
+
+check_if_server_exists_req: str=\
+    """
     SELECT servername
     FROM servers_list
+    WHERE servername = $1
+    """
+
+
+add_server_to_table_req: str=\
+    """
+    INSERT INTO servers_list(servername, host, port)
+    VALUES($1, $2, $3);
     """
 
+
+get_servers_req: str=\
+    """
+    SELECT servername, host, port
+    FROM servers_list
+    """
+
+
+add_whisper_req: str=\
+    """
+    INSERT INTO offline_whispers(receiver, sent_at, sender, message)
+    SELECT $1::VARCHAR, $2::DOUBLE PRECISION, $3::VARCHAR, $4::TEXT
+    WHERE (SELECT count(*) FROM offline_whispers WHERE receiver = $1) < $5
+    """
+
+
+pop_whispers_req: str=\
+    """
+    WITH taken AS (
+        DELETE FROM offline_whispers
+        WHERE receiver = $1
+        RETURNING sent_at, sender, message
+    )
+    SELECT sent_at, sender, message
+    FROM taken
+    WHERE sent_at >= $2
+    ORDER BY sent_at
+    """
+
+
+delete_expired_whispers_req: str=\
+    """
+    DELETE FROM offline_whispers
+    WHERE sent_at < $1
+    """
@@ -0,0 +1,62 @@
+from typing import Optional
+from database_handling.storage import Storage
+from utils.framing import encode_frame
+
+
+class RoutingTable:
+    def __init__(self, ttl: float = 60) -> None:
+        self.__routes: dict[str, tuple[str, int]] = {}
+        self.__ttl: float = ttl
+        self.__added: Optional[dict[str, tuple[str, int]]] = None
+        self.__server_list_frame: bytes = b""
+        self.__render()
+
+
+    @property
+    def ttl(self) -> float:
+        return self.__ttl
+
+
+    def __render(self) -> None:
+        server_list = sorted(self.__routes) or ["Нет доступных серверов"]
+        self.__server_list_frame = encode_frame(("Список серверов:\n" + "\n".join(server_list)).encode("utf-8"))
+
+
+    def load(self, routes: dict[str, tuple[str, int]]) -> None:
+        if routes != self.__routes:
+            self.__routes = routes
+            self.__render()
+
+
+    async def refresh(self, storage: Storage) -> None:
+        added = self.__added = {}
+        try:
+            routes = await storage.get_servers()
+        finally:
+            if self.__added is added:
+                self.__added = None
+        self.load(routes | added)
+
+
+    def add(self, servername: str, host: str, port: int) -> None:
+        route = "127.0.0.1" if host == "localhost" else host, port
+        self.__routes[servername] = route
+        if self.__added is not None:
+            self.__added[servername] = route
+        self.__render()
+
+
+    def get(self, servername: str) -> Optional[tuple[str, int]]:
+        return self.__routes.get(servername)
+
+
+    def __contains__(self, servername: str) -> bool:
+        return servername in self.__routes
+
+
+    def __len__(self) -> int:
+        return len(self.__routes)
+
+
+    def server_list_frame(self) -> bytes:
+        return self.__server_list_frame
@@ -0,0 +1,68 @@
+import asyncpg
+import time
+from asyncpg import Pool
+from asyncpg.prepared_stmt import PreparedStatement
+from typing import Any
+from utils.metrics import metrics
+
+
+pool_wait = metrics.histogram("psql_pool_wait_seconds", "Time spent waiting for a connection from the asyncpg pool")
+statement_duration = metrics.histogram("psql_statement_duration_seconds", "Prepared statement execution time",
+                                       ("statement",))
+statement_errors = metrics.counter("psql_statement_errors_total", "Failed prepared statement runs", ("statement",))
+
+
+class Statement:
+    def __init__(self, name: str, query: str) -> None:
+        self.name: str = name
+        self.query: str = query
+        self.__duration = statement_duration.labels(name)
+        self.__errors = statement_errors.labels(name)
+
+
+    def record(self, elapsed: float, failed: bool = False) -> None:
+        self.__duration.observe(elapsed)
+        if failed:
+            self.__errors.inc()
+
+
+statements: dict[str, Statement] = {}
+
+
+def declare_statement(name: str, query: str) -> Statement:
+    if name in statements:
+        raise ValueError(f"statement {name} is already declared")
+    statements[name] = Statement(name, query)
+    return statements[name]
+
+
+class PreparedConnection(asyncpg.Connection):
+    def __init__(self, *args: Any, **kwargs: Any) -> None:
+        super().__init__(*args, **kwargs)
+        self.__prepared: dict[str, PreparedStatement] = {}
+
+
+    async def prepared(self, statement: Statement) -> PreparedStatement:
+        prepared = self.__prepared.get(statement.name)
+        if prepared is None:
+            prepared = await self.prepare(statement.query)
+            self.__prepared[statement.name] = prepared
+        return prepared
+
+
+async def create_psql_pool(**psql_params: Any) -> Pool:
+    return await asyncpg.create_pool(connection_class=PreparedConnection, **psql_params)
+
+
+async def run_statement(pool: Pool, statement: Statement, method: str, *args: Any) -> Any:
+    started = time.perf_counter()
+    failed = True
+    try:
+        async with pool.acquire() as psql_connection:
+            pool_wait.observe(time.perf_counter() - started)
+            prepared = await psql_connection.prepared(statement)
+            result = await getattr(prepared, method)(*args)
+        failed = False
+        return result
+    finally:
+        statement.record(time.perf_counter() - started, failed)
@@ -0,0 +1,300 @@
+import asyncio
+import asyncpg
+import sqlite3
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from database_handling.execute_requests import *
+from typing import Any, Callable, Optional
+
+
+class StorageError(Exception):
+    pass
+
+
+class Storage(ABC):
+    async def open(self) -> None:
+        pass
+
+
+    async def close(self) -> None:
+        pass
+
+
+    @abstractmethod
+    async def get_password_by_username(self, username: str) -> Optional[str]:
+        pass
+
+
+    @abstractmethod
+    async def add_user(self, username: str, password: str) -> None:
+        pass
+
+
+    @abstractmethod
+    async def update_password(self, username: str, password: str) -> None:
+        pass
+
+
+    @abstractmethod
+    async def get_servers(self) -> dict[str, tuple[str, int]]:
+        pass
+
+
+    @abstractmethod
+    async def check_if_server_exists(self, servername: str) -> bool:
+        pass
+
+
+    @abstractmethod
+    async def add_server(self, servername: str, host: str, port: int) -> None:
+        pass
+
+
+    @abstractmethod
+    async def add_whispers(self, whispers: list[tuple[str, float, str, str]], max_pending: int) -> None:
+        pass
+
+
+    @abstractmethod
+    async def pop_whispers(self, username: str, expires_before: float) -> list[tuple[float, str, str]]:
+        pass
+
+
+    @abstractmethod
+    async def delete_expired_whispers(self, expires_before: float) -> None:
+        pass
+
+
+class PostgresStorage(Storage):
+    def __init__(self, **psql_params: Any) -> None:
+        self.__psql_params: dict[str, Any] = psql_params
+        self.__psql_pool: Optional[asyncpg.Pool] = None
+
+
+    async def open(self) -> None:
+        try:
+            self.__psql_pool = await create_psql_pool(**self.__psql_params)
+        except (asyncpg.exceptions.PostgresError, ConnectionError, TimeoutError) as e:
+            raise StorageError(f"Failed to create pool: {e}")
+
+
+    async def close(self) -> None:
+        if self.__psql_pool is not None:
+            await self.__psql_pool.close()
+
+
+    async def __run(self, request: Callable, *args: Any) -> Any:
+        try:
+            return await request(self.__psql_pool, *args)
+        except asyncpg.PostgresError as e:
+            raise StorageError(str(e)) from e
+
+
+    async def get_password_by_username(self, username: str) -> Optional[str]:
+        return await self.__run(get_password_by_username, username)
+
+
+    async def add_user(self, username: str, password: str) -> None:
+        await self.__run(add_user, username, password)
+
+
+    async def update_password(self, username: str, password: str) -> None:
+        await self.__run(update_password, username, password)
+
+
+    async def get_servers(self) -> dict[str, tuple[str, int]]:
+        return await self.__run(get_servers)
+
+
+    async def check_if_server_exists(self, servername: str) -> bool:
+        return await self.__run(check_if_server_exists, servername)
+
+
+    async def add_server(self, servername: str, host: str, port: int) -> None:
+        await self.__run(add_server_to_table, servername, host, port)
+
+
+    async def add_whispers(self, whispers: list[tuple[str, float, str, str]], max_pending: int) -> None:
+        await self.__run(add_whispers, whispers, max_pending)
+
+
+    async def pop_whispers(self, username: str, expires_before: float) -> list[tuple[float, str, str]]:
+        return await self.__run(pop_whispers, username, expires_before)
+
+
+    async def delete_expired_whispers(self, expires_before: float) -> None:
+        await self.__run(delete_expired_whispers, expires_before)
+
+
+class MemoryStorage(Storage):
+    def __init__(self) -> None:
+        self.__users: dict[str, str] = {}
+        self.__servers: dict[str, tuple[str, int]] = {}
+        self.__whispers: dict[str, list[tuple[float, str, str]]] = {}
+
+
+    async def get_password_by_username(self, username: str) -> Optional[str]:
+        return self.__users.get(username)
+
+
+    async def add_user(self, username: str, password: str) -> None:
+        if username in self.__users:
+            raise StorageError(f"user {username} already exists")
+        self.__users[username] = password
+
+
+    async def update_password(self, username: str, password: str) -> None:
+        if username not in self.__users:
+            raise StorageError(f"user {username} does not exist")
+        self.__users[username] = password
+
+
+    async def get_servers(self) -> dict[str, tuple[str, int]]:
+        return dict(self.__servers)
+
+
+    async def check_if_server_exists(self, servername: str) -> bool:
+        return servername in self.__servers
+
+
+    async def add_server(self, servername: str, host: str, port: int) -> None:
+        if servername in self.__servers or (host, port) in self.__servers.values():
+            raise StorageError(f"server {servername} or address {host}:{port} already exists")
+        self.__servers[servername] = ("127.0.0.1" if host == "localhost" else host, port)
+
+
+    async def add_whispers(self, whispers: list[tuple[str, float, str, str]], max_pending: int) -> None:
+        for receiver, sent_at, sender, message in whispers:
+            mailbox = self.__whispers.setdefault(receiver, [])
+            if len(mailbox) < max_pending:
+                mailbox.append((sent_at, sender, message))
+
+
+    async def pop_whispers(self, username: str, expires_before: float) -> list[tuple[float, str, str]]:
+        return sorted(whisper for whisper in self.__whispers.pop(username, []) if whisper[0] >= expires_before)
+
+
+    async def delete_expired_whispers(self, expires_before: float) -> None:
+        for username in list(self.__whispers):
+            self.__whispers[username] = [whisper for whisper in self.__whispers[username]
+                                         if whisper[0] >= expires_before]
+            if not self.__whispers[username]:
+                del self.__whispers[username]
+
+
+class SqliteStorage(Storage):
+    def __init__(self, path: str = ":memory:") -> None:
+        self.__path: str = path
+        self.__connection: Optional[sqlite3.Connection] = None
+        self.__executor: ThreadPoolExecutor = ThreadPoolExecutor(max_workers=1)
+
+
+    async def __run(self, request: Callable, *args: Any) -> Any:
+        loop = asyncio.get_event_loop()
+        try:
+            return await loop.run_in_executor(self.__executor, request, *args)
+        except sqlite3.Error as e:
+            raise StorageError(str(e)) from e
+
+
+    def __open(self) -> None:
+        self.__connection = sqlite3.connect(self.__path, check_same_thread=False)
+        with open("create_tables.sql", "r") as file:
+            self.__connection.executescript(file.read())
+
+
+    async def open(self) -> None:
+        await self.__run(self.__open)
+
+
+    async def close(self) -> None:
+        if self.__connection is not None:
+            await self.__run(self.__connection.close)
+        self.__executor.shutdown(wait=False)
+
+
+    def __fetchone(self, query: str, *args: Any) -> Optional[tuple]:
+        return self.__connection.execute(query, args).fetchone()
+
+
+    def __fetchall(self, query: str, *args: Any) -> list[tuple]:
+        return self.__connection.execute(query, args).fetchall()
+
+
+    def __execute(self, query: str, *args: Any) -> None:
+        with self.__connection:
+            self.__connection.execute(query, args)
+
+
+    def __executemany(self, query: str, args: list[tuple]) -> None:
+        with self.__connection:
+            self.__connection.executemany(query, args)
+
+
+    async def get_password_by_username(self, username: str) -> Optional[str]:
+        row = await self.__run(self.__fetchone, "SELECT password FROM users_list WHERE username = ?", username)
+        return None if row is None else row[0]
+
+
+    async def add_user(self, username: str, password: str) -> None:
+        await self.__run(self.__execute, "INSERT INTO users_list(username, password) VALUES(?, ?)",
+                         username, password)
+
+
+    async def update_password(self, username: str, password: str) -> None:
+        await self.__run(self.__execute, "UPDATE users_list SET password = ? WHERE username = ?", password, username)
+
+
+    async def get_servers(self) -> dict[str, tuple[str, int]]:
+        rows = await self.__run(self.__fetchall, "SELECT servername, host, port FROM servers_list")
+        return {servername: ("127.0.0.1" if host == "localhost" else host, port) for servername, host, port in rows}
+
+
+    async def check_if_server_exists(self, servername: str) -> bool:
+        return await self.__run(self.__fetchone, "SELECT servername FROM servers_list WHERE servername = ?",
+                                servername) is not None
+
+
+    async def add_server(self, servername: str, host: str, port: int) -> None:
+        await self.__run(self.__execute, "INSERT INTO servers_list(servername, host, port) VALUES(?, ?, ?)",
+                         servername, host, port)
+
+
+    async def add_whispers(self, whispers: list[tuple[str, float, str, str]], max_pending: int) -> None:
+        await self.__run(self.__executemany,
+                         "INSERT INTO offline_whispers(receiver, sent_at, sender, message) SELECT ?1, ?2, ?3, ?4 "
+                         "WHERE (SELECT count(*) FROM offline_whispers WHERE receiver = ?1) < ?5",
+                         [(receiver, sent_at, sender, message, max_pending)
+                          for receiver, sent_at, sender, message in whispers])
+
+
+    def __pop_whispers(self, username: str, expires_before: float) -> list[tuple]:
+        with self.__connection:
+            rows = self.__connection.execute("SELECT sent_at, sender, message FROM offline_whispers "
+                                             "WHERE receiver = ? AND sent_at >= ? ORDER BY sent_at",
+                                             (username, expires_before)).fetchall()
+            self.__connection.execute("DELETE FROM offline_whispers WHERE receiver = ?", (username,))
+        return rows
+
+
+    async def pop_whispers(self, username: str, expires_before: float) -> list[tuple[float, str, str]]:
+        return await self.__run(self.__pop_whispers, username, expires_before)
+
+
+    async def delete_expired_whispers(self, expires_before: float) -> None:
+        await self.__run(self.__execute, "DELETE FROM offline_whispers WHERE sent_at < ?", expires_before)
+
+
+def create_storage(storage_config: dict[str, Any]) -> Storage:
+    storage_config = dict(storage_config)
+    backend = storage_config.pop("backend", "postgres")
+    if backend == "postgres":
+        return PostgresStorage(**storage_config)
+    if backend == "memory":
+        return MemoryStorage(**storage_config)
+    if backend == "sqlite":
+        return SqliteStorage(**storage_config)
+    if backend == "broker":
+        from database_handling.broker import BrokerStorage
+        return BrokerStorage(**storage_config)
+    raise ValueError(f"unknown storage backend: {backend}")
@@ -1,16 +1,33 @@
+import json
+import signal
 from server import *
 from utils import *
-from multiprocessing import Process
+from room_host import *
+from room_supervisor import *
 from database_handling import *
 from typing import Any, Optional
 
 
+log = get_logger(__name__)
+master_connections_accepted = metrics.counter("master_connections_accepted_total",
+                                              "Connections accepted by the master server")
+master_handovers = metrics.counter("master_handovers_total", "Connections passed to room workers", ("result",))
+
 
 class MasterServer:
     def __init__(self, host: str, port: int,
                  psql_host: str ="localhost", psql_port: int = 5432,
                  psql_user: str = "postgres", psql_password: str ="admin",
-                 psql_db: str = "userdata"):
+                 psql_db: str = "userdata", room_workers: Optional[int] = None,
+                 isolated_servers: tuple[str, ...] = (), loop_impl: str = "auto",
+                 fd_passing: bool = False, routing_ttl: float = 60,
+                 storage_config: Optional[dict[str, Any]] = None, storage_broker: bool = True,
+                 metrics_port: Optional[int] = None, federation: bool = True,
+                 handshake_timeout: Optional[float] = 30, idle_timeout: Optional[float] = 300,
+                 heartbeat_interval: Optional[float] = 30, heartbeat_timeout: float = 10,
+                 max_handshakes: int = 1024, accept_backlog: int = 128,
+                 per_ip_rate: Optional[float] = 5, per_ip_burst: float = 20,
+                 warm_workers: int = 1, health_interval: float = 5):
         if not isinstance(host, str):
             raise TypeError("host is not a string")
         if not isinstance(port, int):
@@ -21,6 +38,7 @@ class MasterServer:
         try:
             self._addr: tuple[str, int] = host, port
             self.__server: socket.socket = socket.socket()
+            self.__server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
             self.__server.bind(self._addr)
             self.__server.setblocking(False)
         except socket.error as e:
@@ -30,7 +48,8 @@ class MasterServer:
 
 
 
-        self.__psql_params: dict[str, Any] = {
+        self.__storage_config: dict[str, Any] = storage_config or {
+            "backend": "postgres",
             "host": psql_host,
             "port": psql_port,
             "user": psql_user,
@@ -41,225 +60,344 @@ class MasterServer:
             "timeout": 30,
             "command_timeout": 30
         }
-        self.__psql_pool: Optional[asyncpg.Pool] = None
-
-        self.__commands: dict[str, Callable] = {}
-        for obj in dir(self):
-            if callable(getattr(self, obj)) and hasattr(getattr(self, obj), "command_name"):
-                self.__commands[getattr(self, obj).command_name] = getattr(self, obj)
-
-        self.__running_servers: dict[str, tuple[tuple[str, int], Process]] = {}
-
-        self.__tasks: Optional[asyncio.Task]  = None
+        self.__storage: Storage = create_storage(self.__storage_config)
+
+        self.__router: CommandRouter = CommandRouter(self)
+
+        self.__storage_broker: Optional[StorageBroker] = StorageBroker(self.__storage) if storage_broker else None
+        if self.__storage_broker is not None:
+            self.__room_storage_config: dict[str, Any] = {"backend": "broker", "path": self.__storage_broker.path}
+        elif self.__storage_config.get("backend", "postgres") == "postgres":
+            self.__room_storage_config = self.__storage_config | {"min_size": 1, "max_size": 8}
+        else:
+            self.__room_storage_config = self.__storage_config
+        self.__federation_hub: Optional[FederationHub] = FederationHub() if federation else None
+        self.__isolated_servers: frozenset[str] = frozenset(isolated_servers)
+        self.__fd_passing: bool = fd_passing
+        self.__routing_table: RoutingTable = RoutingTable(routing_ttl)
+        self.__supervisor: RoomSupervisor = RoomSupervisor(self.__room_storage_config, loop_impl, fd_passing,
+                                                           self.__federation_path(),
+                                                           room_workers or os.cpu_count() or 1, warm_workers,
+                                                           health_interval)
+
+        self.__handshake_timeout: Optional[float] = handshake_timeout
+        self.__idle_timeout: Optional[float] = idle_timeout
+        self.__heartbeat_interval: Optional[float] = heartbeat_interval
+        self.__heartbeat_timeout: float = heartbeat_timeout
+
+        self.__admission: AdmissionController = AdmissionController(max_handshakes, per_ip_rate, per_ip_burst)
+        self.__accept_backlog: int = accept_backlog
+        self.__sessions: set[asyncio.Task] = set()
+        self.__restart_task: Optional[asyncio.Task] = None
+        self.__metrics_endpoint: Optional[MetricsEndpoint] = None if metrics_port is None else \
+            MetricsEndpoint(self.__render_metrics, host, metrics_port)
 
 
     @command("/help")
-    async def __help(self, connection: socket.socket) -> None:
-        loop = asyncio.get_event_loop()
+    async def __help(self, connection: FramedConnection) -> None:
         try:
-            await loop.sock_sendall(connection, ("Список доступных команд:\n" +
-                                             ("\n".join(i for i in self.__commands.keys()))).encode("utf-8"))
+            await connection.send_message(("Список доступных команд:\n" +
+                                           "\n".join(self.__router.usages)).encode("utf-8"))
         except Exception as e:
-            print(f"Произошла ошибка {e} при попытке отослать список доступных команд пользователю {connection}")
+            log.error("Произошла ошибка %s при попытке отослать список доступных команд пользователю %s", e,
+                      connection)
 
 
     @command("/server_list")
-    async def __get_server_list(self, connection: socket.socket) -> None:
-        loop = asyncio.get_event_loop()
+    async def __get_server_list(self, connection: FramedConnection) -> None:
         try:
-            server_list = await get_server_list(self.__psql_pool)
-        except (asyncpg.PostgresError, ConnectionError) as e:
-            print(f"Не получилось получить список серверов: {e}")
-            return
-        try:
-            await loop.sock_sendall(connection, ("Список серверов:\n" + "\n".join(server_list)).encode("utf-8"))
+            await connection.send_frames([self.__routing_table.server_list_frame()])
         except Exception as e:
-            print(f"Произошло неожиданное исключение при {e} "
-                  f"при попытке отправить список серверов пользователю {connection}")
+            log.error("Произошло неожиданное исключение при %s при попытке отправить список серверов пользователю %s",
+                      e, connection)
 
 
 
-    @command("/connect")
-    async def __connect(self, connection: socket.socket, servername: str) -> None:
-        loop = asyncio.get_event_loop()
-        if not isinstance(servername, str):
-            print(f"Ожидалось что servername - строка, текущий тип: {type(servername)}")
-            return
-        try:
-            sql_resp = await get_host_port(self.__psql_pool, servername)
-        except (asyncpg.PostgresError, ConnectionError) as e:
-            print(f"Произошла ошибка при поиске сервера в базе данных: {e}")
-            await loop.sock_sendall(connection, "Внутренняя ошибка сервера, "
-                                                "пожалуйста попробуйте позже".encode("utf-8"))
+    @command("/connect", "имя сервера")
+    async def __connect(self, connection: FramedConnection, servername: str) -> None:
+        route = self.__routing_table.get(servername)
+        if route is None:
+            await connection.send_message("server_is_not_exist".encode("utf-8"), FRAME_CONTROL)
             return
-        if sql_resp is None:
-            await loop.sock_sendall(connection, "server_is_not_exist".encode("utf-8"))
+        if self.__fd_passing and await self.__hand_over(connection, servername, *route):
             return
         try:
-            await loop.sock_sendall(connection, "connection_approved".encode("utf-8"))
+            await connection.send_message("connection_approved".encode("utf-8"), FRAME_CONTROL)
         except Exception as e:
-            print(f"Произошла ошибка {e} при попытке отослать подтверждение подключения пользователю {connection}")
+            log.error("Произошла ошибка %s при попытке отослать подтверждение подключения пользователю %s", e,
+                      connection)
             return
-        response = (await loop.sock_recv(connection, 1024)).decode("utf-8").strip()
+        response = (await connection.recv_text()).strip()
         if response != "ready_for_connection":
-            print(f"Неожиданный ответ от клиента ({connection}): {response}, ожидалось: ready_for_connection")
+            log.warning("Неожиданный ответ от клиента (%s): %s, ожидалось: ready_for_connection", connection, response)
             return
-        host, port = sql_resp
+        host, port = route
 
-        if servername not in self.__running_servers:
-            try:
-                self.__run_server(servername, host, port)
-            except Exception as e:
-                print(f"Произошла неожиданная ошибка {e} при попытке запустить сервер {servername}")
-                await loop.sock_sendall(connection, "Внутренняя ошибка сервера, "
-                                                    "пожалуйста попробуйте позже".encode("utf-8"))
-                return
         try:
-            await loop.sock_sendall(connection, (host + " " + str(port)).encode("utf-8"))
+            await self.__run_server(servername, host, port)
+        except Exception as e:
+            log.error("Произошла неожиданная ошибка %s при попытке запустить сервер %s", e, servername)
+            await connection.send_message("Внутренняя ошибка сервера, "
+                                          "пожалуйста попробуйте позже".encode("utf-8"), FRAME_CONTROL)
+            return
+        try:
+            await connection.send_message((host + " " + str(port)).encode("utf-8"), FRAME_CONTROL)
         except Exception as e:
-            print(f"Произошла ошибка {e} при попытке отослать данные для "
-                  f"подключения к серверу пользователю {connection}")
+            log.error("Произошла ошибка %s при попытке отослать данные для подключения к серверу пользователю %s", e,
+                      connection)
             return
         connection.close()
-        if self.__tasks:
-            self.__tasks.cancel()
+
+
+    async def __hand_over(self, connection: FramedConnection, servername: str, host: str, port: int) -> bool:
+        try:
+            worker = await self.__run_server(servername, host, port)
+            sock, pending = connection.detach()
+        except Exception as e:
+            log.warning("Не удалось передать соединение %s серверу %s: %s", connection, servername, e)
+            master_handovers.labels("fallback").inc()
+            return False
+        try:
+            await worker.hand_over(servername, sock, pending)
+            master_handovers.labels("ok").inc()
+        except Exception as e:
+            log.error("Произошла ошибка %s при попытке передать соединение серверу %s", e, servername)
+            master_handovers.labels("failed").inc()
+        return True
 
 
     @command("/start_server")
-    async def __start_server(self, connection: socket.socket) -> None:
-        loop = asyncio.get_event_loop()
+    async def __start_server(self, connection: FramedConnection) -> None:
         try:
-            await loop.sock_sendall(connection, "Придумайте имя сервера".encode("utf-8"))
+            await connection.send_message("Придумайте имя сервера".encode("utf-8"))
         except Exception as e:
-            print(f"Произошла ошибка {e} при попытке запустить сервер")
+            log.error("Произошла ошибка %s при попытке запустить сервер", e)
             return
         try:
-            servername = (await loop.sock_recv(connection, 1024)).decode("utf-8").strip()
+            servername = (await connection.recv_text()).strip()
             while not check_servername_validity(servername):
-                await loop.sock_sendall(connection, "Указанное имя сервера не доступно,\n"
-                                                    "попробуйте указать другое имя".encode("utf-8"))
-                servername = (await loop.sock_recv(connection, 1024)).decode("utf-8").strip()
+                await connection.send_message("Указанное имя сервера не доступно,\n"
+                                              "попробуйте указать другое имя".encode("utf-8"))
+                servername = (await connection.recv_text()).strip()
         except Exception as e:
-            print(f"Произошла ошибка {e} при попытке получить имя сервера с пользователем {connection}")
+            log.error("Произошла ошибка %s при попытке получить имя сервера с пользователем %s", e, connection)
             return
         try:
-            is_exists = await check_if_server_exists(self.__psql_pool, servername)
-        except (asyncpg.PostgresError, ConnectionError) as e:
-            print(f"Произошла ошибка {e} при попытке проверить существует ли сервер с данным именем")
+            is_exists = servername in self.__routing_table or \
+                        await self.__storage.check_if_server_exists(servername)
+        except (StorageError, ConnectionError) as e:
+            log.error("Произошла ошибка %s при попытке проверить существует ли сервер с данным именем", e)
             return
         while is_exists:
             try:
-                await loop.sock_sendall(connection, "Сервер с заданным именем уже существует,\n"
-                                                    "попробуйте ввести другое имя:".encode("utf-8"))
-                servername = (await loop.sock_recv(connection, 1024)).decode("utf-8").strip()
-                is_exists = await check_if_server_exists(self.__psql_pool, servername)
+                await connection.send_message("Сервер с заданным именем уже существует,\n"
+                                              "попробуйте ввести другое имя:".encode("utf-8"))
+                servername = (await connection.recv_text()).strip()
+                is_exists = servername in self.__routing_table or \
+                            await self.__storage.check_if_server_exists(servername)
             except Exception as e:
-                print(f"Произошла ошибка {e} при попытке создать сервер с другим именем")
+                log.error("Произошла ошибка %s при попытке создать сервер с другим именем", e)
                 return
         while True:
             try:
-                await loop.sock_sendall(connection, "Придумайте хост сервера".encode("utf-8"))
-                host = (await loop.sock_recv(connection, 1024)).decode("utf-8").strip()
-                await loop.sock_sendall(connection, "Придумайте порт сервера".encode("utf-8"))
-                port = int((await loop.sock_recv(connection, 1024)).decode("utf-8").strip())
+                await connection.send_message("Придумайте хост сервера".encode("utf-8"))
+                host = (await connection.recv_text()).strip()
+                await connection.send_message("Придумайте порт сервера".encode("utf-8"))
+                port = int((await connection.recv_text()).strip())
                 if not check_host_port_validity(host, port):
-                    await loop.sock_sendall(connection,
-                                            "Данные хост + порт уже заняты/ они не корректны".encode("utf-8"))
+                    await connection.send_message("Данные хост + порт уже заняты/ они не корректны".encode("utf-8"))
                     continue
-                await add_server_to_table(self.__psql_pool, servername, host, port)
+                await self.__storage.add_server(servername, host, port)
+                self.__routing_table.add(servername, host, port)
                 break
             except Exception as e:
-                print(f"Произошла ошибка {e} "
-                      f"при попытке создать сервер с указанными хостом и портом с пользователем {connection}")
+                log.error("Произошла ошибка %s при попытке создать сервер с указанными хостом и портом "
+                          "с пользователем %s", e, connection)
                 return
         try:
-            await loop.sock_sendall(connection, "Сервер успешно создан".encode("utf-8"))
+            await connection.send_message("Сервер успешно создан".encode("utf-8"))
         except Exception as e:
-            print(f"Произошла ошибка {e} "
-                  f"при попытке отослать сообщение об успешном создании сервера пользователю {connection}")
+            log.error("Произошла ошибка %s при попытке отослать сообщение об успешном создании сервера пользователю %s",
+                      e, connection)
         try:
-            self.__run_server(servername, host, port)
+            await self.__run_server(servername, host, port)
         except Exception as e:
-            print(f"Произошла неожиданная ошибка {e} при попытке запустить сервер {servername}")
+            log.error("Произошла неожиданная ошибка %s при попытке запустить сервер %s", e, servername)
 
 
 
-    def __run_server(self, servername: str, host: str, port: int) -> None:
-        try:
-            if servername in self.__running_servers:
-                _, process = self.__running_servers[servername]
-                if process.is_alive():
-                    print(f"Сервер: {servername} уже запущен")
-                    return
-            p = Process(target=create_server, args=(host, port, servername), daemon=True)
-            p.start()
-            if not p.is_alive():
-                raise RuntimeError("Процесс не запустился")
-            self.__running_servers[servername] = ((host, port), p)
-            print(f"Сервер {servername} запущен на {host}:{port}, PID={p.pid}")
-        except Exception as e:
-            print(f"Произошла ошибка {e} при попытке запустить сервер {servername}")
+    def __federation_path(self) -> Optional[str]:
+        return None if self.__federation_hub is None else self.__federation_hub.path
+
+
+    async def __run_server(self, servername: str, host: str, port: int) -> RoomWorker:
+        return await self.__supervisor.run_room(servername, host, port, servername in self.__isolated_servers)
+
+
+    async def restart_rooms(self) -> None:
+        log.info("Перезапуск процессов комнат без разрыва соединений")
+        await self.__supervisor.rolling_restart()
+
+
+    def __on_restart_signal(self) -> None:
+        if self.__restart_task is None or self.__restart_task.done():
+            self.__restart_task = asyncio.create_task(self.restart_rooms())
 
 
-    async def __create_pool(self) -> None:
+    async def reload_banned_words(self) -> None:
+        banned_words.reload()
+        for worker in self.__supervisor.workers:
+            try:
+                await worker.reload_banned_words()
+            except Exception as e:
+                log.warning("Не удалось обновить словарь запрещенных слов в процессе комнат PID=%s: %s", worker.pid, e)
+
+
+    async def __worker_metrics(self, worker: RoomWorker) -> list[dict[str, Any]]:
+        try:
+            return await worker.metrics()
+        except Exception as e:
+            log.warning("Не удалось получить метрики процесса комнат PID=%s: %s", worker.pid, e)
+            return []
+
+
+    async def __render_metrics(self, path: str) -> Optional[str]:
+        if path == "/rooms":
+            return json.dumps(self.__supervisor.report(), ensure_ascii=False, indent=2) + "\n"
+        workers = {worker.pid: worker for worker in self.__supervisor.workers}
+        if path.startswith("/metrics/"):
+            pid = path.removeprefix("/metrics/")
+            if not pid.isdigit() or int(pid) not in workers:
+                return None
+            return render_metrics(await self.__worker_metrics(workers[int(pid)]))
+        if path != "/metrics":
+            return None
+        snapshots = await asyncio.gather(*(self.__worker_metrics(worker) for worker in workers.values()))
+        return render_metrics(merge_snapshots([label_snapshot(metrics.snapshot(), "process", "master"),
+                                               label_snapshot(merge_snapshots(list(snapshots)), "process", "rooms")]))
+
+
+    async def __open_storage(self) -> None:
         try:
-            self.__psql_pool = await asyncpg.create_pool(**self.__psql_params)
-        except (asyncpg.exceptions.PostgresError, ConnectionError, TimeoutError) as e:
-            raise RuntimeError(f"Failed to create pool: {e}")
+            await self.__storage.open()
+        except (StorageError, ConnectionError, TimeoutError) as e:
+            raise RuntimeError(f"Failed to open storage: {e}")
 
 
-    async def __receive(self, connection: socket.socket) -> None:
-        loop = asyncio.get_event_loop()
+    async def __receive(self, connection: FramedConnection, handshake_deadline: Optional[Timer] = None) -> None:
         try:
             while True:
                 if connection.fileno() < 0:
                     break
                 try:
-                    await loop.sock_sendall(connection, "Для получения списка команд напишите /help".encode("utf-8"))
+                    await connection.send_message("Для получения списка команд напишите /help".encode("utf-8"))
                 except Exception as e:
-                    print(f"Произошла ошибка {e} "
-                          f"при попытке отослать подсказку для получения команд пользователю {connection}")
-                message = await loop.sock_recv(connection, 1024)
-                if not message:
+                    if connection.expired is None:
+                        log.error("Произошла ошибка %s при попытке отослать подсказку для получения команд "
+                                  "пользователю %s", e, connection)
+                message = await connection.recv_message()
+                if handshake_deadline is not None:
+                    handshake_deadline.cancel()
+                if message is None:
                     connection.close()
                     break
-                message = message.decode("utf-8").strip()
                 try:
-                    cmd = message.split(" ")[0]
-                    args = message.split(" ")[1:]
-                    if cmd not in self.__commands:
-                        await loop.sock_sendall(connection, "Данная команда не существует".encode("utf-8"))
+                    if not await self.__router.dispatch(message, connection):
+                        await connection.send_message("Данная команда не существует".encode("utf-8"))
                         continue
-                    if args:
-                        await self.__commands[cmd](connection, *args)
-                    else:
-                        await self.__commands[cmd](connection)
                     if connection.fileno() < 0:
                         break
+                except CommandUsageError as e:
+                    await connection.send_message(str(e).encode("utf-8"))
                 except Exception as e:
-                    print(f"Произошла ошибка {e} при попытке обработать команду пользователя {connection}")
+                    log.error("Произошла ошибка %s при попытке обработать команду пользователя %s", e, connection)
         except Exception as e:
-            print(f"Произошла ошибка {e} с пользователем {connection}")
+            if connection.expired is None:
+                log.error("Произошла ошибка %s с пользователем %s", e, connection)
             connection.close()
 
 
-    async def __connect_user(self, connection: socket.socket) -> None:
-        connection.setblocking(False)
-        await self.__receive(connection)
+    async def __connect_user(self, connection: FramedConnection) -> None:
+        master_connections_accepted.inc()
+        session = asyncio.current_task()
+        self.__sessions.add(session)
+        handshake_deadline = deadline(self.__handshake_timeout, connection, "handshake")
+        watchdog = ConnectionWatchdog(connection, self.__idle_timeout, self.__heartbeat_interval,
+                                      self.__heartbeat_timeout)
+        try:
+            await self.__receive(connection, handshake_deadline)
+            if connection.expired is not None:
+                log.info("Соединение с %s закрыто по таймауту (%s)", connection, connection.expired)
+        finally:
+            watchdog.cancel()
+            if handshake_deadline is not None:
+                handshake_deadline.cancel()
+            self.__sessions.discard(session)
+            self.__admission.release()
+
+
+    def __admit(self, connection: FramedConnection) -> bool:
+        reason = self.__admission.admit(connection.peer_host())
+        if reason is None:
+            return True
+        try:
+            connection.write_frame("Сервер перегружен, попробуйте подключиться позже".encode("utf-8")
+                                   if reason == "busy" else
+                                   "Слишком много подключений с вашего адреса, попробуйте позже".encode("utf-8"))
+        except ConnectionError:
+            pass
+        connection.close()
+        return False
+
+
+    async def __refresh_routing_table(self) -> None:
+        while True:
+            await asyncio.sleep(self.__routing_table.ttl)
+            try:
+                await self.__routing_table.refresh(self.__storage)
+            except (StorageError, ConnectionError) as e:
+                log.error("Не получилось обновить таблицу маршрутизации: %s", e)
 
 
     async def run_master_server(self) -> None:
-        self.__server.listen()
-        await self.__create_pool()
+        self.__server.listen(self.__accept_backlog)
+        await self.__open_storage()
+        if self.__storage_broker is not None:
+            await self.__storage_broker.start()
+        if self.__federation_hub is not None:
+            await self.__federation_hub.start()
+        await self.__supervisor.start()
+        await self.__routing_table.refresh(self.__storage)
+        asyncio.create_task(self.__refresh_routing_table())
+        asyncio.create_task(monitor_event_loop_lag())
+        if self.__metrics_endpoint is not None:
+            await self.__metrics_endpoint.start()
 
-        while True:
-            loop = asyncio.get_event_loop()
-            connection, client_address = await loop.sock_accept(self.__server)
-            self.__tasks = asyncio.create_task(self.__connect_user(connection))
+        loop = asyncio.get_event_loop()
+        try:
+            loop.add_signal_handler(signal.SIGHUP, self.__on_restart_signal)
+        except (NotImplementedError, RuntimeError, ValueError):
+            log.warning("Перезапуск процессов комнат по SIGHUP недоступен")
+        server = await loop.create_server(lambda: FramedConnection(self.__connect_user, admit=self.__admit),
+                                          sock=self.__server)
+        try:
+            await server.serve_forever()
+        finally:
+            for session in list(self.__sessions):
+                session.cancel()
+            await self.__supervisor.close()
+            if self.__metrics_endpoint is not None:
+                self.__metrics_endpoint.close()
+            if self.__federation_hub is not None:
+                await self.__federation_hub.close()
+            if self.__storage_broker is not None:
+                await self.__storage_broker.close()
+            await self.__storage.close()
 
 
 
 if __name__ == "__main__":
+    setup_logging()
     master = MasterServer("127.0.0.1", 8000, psql_host="localhost", psql_port=5432,
                           psql_user="postgres", psql_password="admin", psql_db="userdata")
-    asyncio.run(master.run_master_server())
+    run_event_loop(master.run_master_server())
@@ -0,0 +1,382 @@
+import asyncio
+import multiprocessing
+import os
+import time
+from multiprocessing import parent_process
+from multiprocessing.process import BaseProcess
+from multiprocessing.connection import Connection
+from server import *
+from typing import Any, Callable, Optional
+
+
+log = get_logger(__name__)
+
+_context = multiprocessing.get_context("forkserver")
+_context.set_forkserver_preload(["room_host"])
+
+
+def process_rss() -> Optional[int]:
+    try:
+        with open("/proc/self/statm", "r") as file:
+            return int(file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class RoomHost:
+    def __init__(self, control: Connection, storage_config: dict[str, Any],
+                 handover: Optional[socket.socket] = None, federation_path: Optional[str] = None) -> None:
+        self.__control: Connection = control
+        self.__handover: Optional[socket.socket] = handover
+        self.__storage: Storage = create_storage(storage_config)
+        self.__credentials: CredentialVerifier = CredentialVerifier()
+        self.__mailbox: OfflineMailbox = OfflineMailbox(self.__storage)
+        self.__history_executor: ThreadPoolExecutor = create_history_executor()
+        self.__federation: Optional[FederationClient] = None if federation_path is None else \
+            FederationClient(federation_path)
+        self.__rooms: dict[str, Server] = {}
+        self.__stopped: Optional[asyncio.Event] = None
+        self.__lag_monitor: Optional[asyncio.Task] = None
+        self.__started_at: float = time.monotonic()
+
+
+    async def __start_room(self, servername: str, host: str, port: int) -> None:
+        if servername in self.__rooms:
+            return
+        room = Server(host, port, servername, storage=self.__storage, credentials=self.__credentials,
+                      mailbox=self.__mailbox, federation=self.__federation,
+                      history_executor=self.__history_executor)
+        await room.start()
+        self.__rooms[servername] = room
+        log.info("Сервер %s запущен на %s:%s", servername, host, port, extra={"servername": servername})
+
+
+    async def __drain_room(self, servername: str, path: str, timeout: float) -> int:
+        room = self.__rooms.get(servername)
+        if room is None:
+            raise ValueError(f"Сервер {servername} не запущен")
+        loop = asyncio.get_event_loop()
+        channel = socket.socket(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+        channel.setblocking(False)
+        try:
+            deadline_at = loop.time() + timeout
+            while True:
+                try:
+                    await loop.sock_connect(channel, path)
+                    break
+                except (FileNotFoundError, ConnectionRefusedError):
+                    if loop.time() >= deadline_at:
+                        raise
+                    await asyncio.sleep(0.05)
+            del self.__rooms[servername]
+            try:
+                handed_over = await room.drain(channel)
+            except Exception:
+                await room.close()
+                raise
+        finally:
+            channel.close()
+        log.info("Сервер %s передан другому процессу, передано соединений: %s", servername, handed_over,
+                 extra={"servername": servername})
+        return handed_over
+
+
+    async def __receive_room(self, servername: str, host: str, port: int, path: str, timeout: float) -> int:
+        if servername in self.__rooms:
+            raise ValueError(f"Сервер {servername} уже запущен")
+        loop = asyncio.get_event_loop()
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+        listener.setblocking(False)
+        try:
+            if os.path.exists(path):
+                os.unlink(path)
+            listener.bind(path)
+            listener.listen(1)
+            channel, _ = await asyncio.wait_for(loop.sock_accept(listener), timeout)
+        finally:
+            listener.close()
+            if os.path.exists(path):
+                os.unlink(path)
+        with channel:
+            channel.setblocking(False)
+            received = await asyncio.wait_for(receive_all_sockets(channel), timeout)
+        if not received or received[0][1] != b"listener":
+            for sock, _ in received:
+                sock.close()
+            raise ConnectionError(f"Сервер {servername} не передал слушающий сокет")
+
+        room = Server(host, port, servername, storage=self.__storage, credentials=self.__credentials,
+                      mailbox=self.__mailbox, federation=self.__federation,
+                      history_executor=self.__history_executor, sock=received[0][0])
+        await room.start()
+        self.__rooms[servername] = room
+        for sock, payload in received[1:]:
+            try:
+                await room.adopt_session(sock, payload)
+            except Exception as e:
+                log.error("Произошла ошибка %s при попытке принять сессию на сервере %s", e, servername,
+                          extra={"servername": servername})
+                sock.close()
+        log.info("Сервер %s принят от другого процесса на %s:%s, принято соединений: %s", servername, host, port,
+                 len(received) - 1, extra={"servername": servername})
+        return len(received) - 1
+
+
+    async def __stop_room(self, servername: str) -> None:
+        room = self.__rooms.pop(servername, None)
+        if room is not None:
+            await room.close()
+            log.info("Сервер %s остановлен", servername, extra={"servername": servername})
+
+
+    def __stats(self) -> dict[str, int]:
+        return {servername: room.connections_count() for servername, room in self.__rooms.items()}
+
+
+    def __health(self) -> dict[str, Any]:
+        return {"pid": os.getpid(), "uptime": time.monotonic() - self.__started_at, "rss": process_rss(),
+                "rooms": self.__stats()}
+
+
+    async def __handle_request(self, request_id: int, command: str, *args: Any) -> None:
+        try:
+            if command == "start_room":
+                result = await self.__start_room(*args)
+            elif command == "stop_room":
+                result = await self.__stop_room(*args)
+            elif command == "drain_room":
+                result = await self.__drain_room(*args)
+            elif command == "receive_room":
+                result = await self.__receive_room(*args)
+            elif command == "stats":
+                result = self.__stats()
+            elif command == "health":
+                result = self.__health()
+            elif command == "metrics":
+                result = metrics.snapshot()
+            elif command == "reload_banned_words":
+                result = banned_words.reload()
+            else:
+                raise ValueError(f"Неизвестная команда {command}")
+            self.__control.send((request_id, True, result))
+        except Exception as e:
+            self.__control.send((request_id, False, f"{type(e).__name__}: {e}"))
+
+
+    def __on_control_readable(self) -> None:
+        try:
+            while self.__control.poll():
+                asyncio.create_task(self.__handle_request(*self.__control.recv()))
+        except (EOFError, OSError):
+            self.__stop()
+
+
+    def __stop(self) -> None:
+        loop = asyncio.get_event_loop()
+        loop.remove_reader(self.__control.fileno())
+        if parent_process() is not None:
+            loop.remove_reader(parent_process().sentinel)
+        self.__stopped.set()
+
+
+    async def __adopt(self, sock: socket.socket, payload: bytes) -> None:
+        servername, _, pending = payload.partition(b"\0")
+        room = self.__rooms.get(servername.decode("utf-8"))
+        if room is None:
+            log.warning("Получено соединение для незапущенного сервера %s", servername)
+            sock.close()
+            return
+        try:
+            await room.adopt(sock, pending)
+        except Exception as e:
+            log.error("Произошла ошибка %s при попытке принять соединение на сервере %s", e, servername)
+            sock.close()
+
+
+    def __on_handover_readable(self) -> None:
+        try:
+            for sock, payload in receive_sockets(self.__handover):
+                asyncio.create_task(self.__adopt(sock, payload))
+        except (EOFError, OSError):
+            asyncio.get_event_loop().remove_reader(self.__handover.fileno())
+
+
+    async def serve(self) -> None:
+        self.__stopped = asyncio.Event()
+        try:
+            await self.__storage.open()
+        except (StorageError, ConnectionError, TimeoutError) as e:
+            raise RuntimeError(f"Failed to open storage: {e} at room host {os.getpid()}")
+
+        if self.__federation is not None:
+            await self.__federation.open()
+        self.__lag_monitor = asyncio.create_task(monitor_event_loop_lag())
+        asyncio.get_event_loop().add_reader(self.__control.fileno(), self.__on_control_readable)
+        if parent_process() is not None:
+            asyncio.get_event_loop().add_reader(parent_process().sentinel, self.__stop)
+        if self.__handover is not None:
+            self.__handover.setblocking(False)
+            asyncio.get_event_loop().add_reader(self.__handover.fileno(), self.__on_handover_readable)
+        await self.__stopped.wait()
+        self.__lag_monitor.cancel()
+        for servername in list(self.__rooms):
+            await self.__stop_room(servername)
+        if self.__federation is not None:
+            await self.__federation.close()
+        await self.__mailbox.close()
+        await self.__storage.close()
+        self.__credentials.close()
+        self.__history_executor.shutdown(wait=False)
+
+
+def run_room_host(control: Connection, storage_config: dict[str, Any], loop_impl: str = "auto",
+                  handover: Optional[socket.socket] = None, federation_path: Optional[str] = None) -> None:
+    metrics.reset()
+    try:
+        run_event_loop(RoomHost(control, storage_config, handover, federation_path).serve(), loop_impl)
+    finally:
+        stop_logging()
+
+
+class RoomWorker:
+    def __init__(self, storage_config: dict[str, Any], loop_impl: str = "auto", isolated: bool = False,
+                 fd_passing: bool = False, federation_path: Optional[str] = None,
+                 on_exit: Optional[Callable[["RoomWorker"], None]] = None) -> None:
+        self.__control, child_control = _context.Pipe()
+        self.__handover, child_handover = create_handover_channel() if fd_passing else (None, None)
+        self.__process: BaseProcess = _context.Process(target=run_room_host,
+                                                       args=(child_control, storage_config, loop_impl,
+                                                             child_handover, federation_path),
+                                                       daemon=True)
+        self.__process.start()
+        child_control.close()
+        if child_handover is not None:
+            child_handover.close()
+        self.isolated: bool = isolated
+        self.rooms: set[str] = set()
+        self.health_report: dict[str, Any] = {}
+        self.__started_at: float = time.monotonic()
+        self.__on_exit: Optional[Callable[[RoomWorker], None]] = on_exit
+
+        self.__pending: dict[int, asyncio.Future] = {}
+        self.__next_request_id: int = 0
+        asyncio.get_event_loop().add_reader(self.__control.fileno(), self.__on_reply)
+        asyncio.get_event_loop().add_reader(self.__process.sentinel, self.__on_process_exit)
+
+
+    @property
+    def pid(self) -> Optional[int]:
+        return self.__process.pid
+
+
+    @property
+    def uptime(self) -> float:
+        return time.monotonic() - self.__started_at
+
+
+    @property
+    def exitcode(self) -> Optional[int]:
+        return self.__process.exitcode
+
+
+    def is_alive(self) -> bool:
+        return self.__process.is_alive()
+
+
+    def __on_process_exit(self) -> None:
+        asyncio.get_event_loop().remove_reader(self.__process.sentinel)
+        self.__process.join()
+        self.close()
+        if self.__on_exit is not None:
+            self.__on_exit(self)
+
+
+    def __on_reply(self) -> None:
+        try:
+            while self.__control.poll():
+                request_id, ok, result = self.__control.recv()
+                future = self.__pending.pop(request_id, None)
+                if future is None or future.done():
+                    continue
+                if ok:
+                    future.set_result(result)
+                else:
+                    future.set_exception(RuntimeError(result))
+        except (EOFError, OSError):
+            self.close()
+
+
+    async def request(self, command: str, *args: Any, timeout: float = 30) -> Any:
+        if not self.is_alive():
+            raise ConnectionError(f"Процесс комнат PID={self.pid} не запущен")
+        request_id = self.__next_request_id
+        self.__next_request_id += 1
+        future = asyncio.get_event_loop().create_future()
+        self.__pending[request_id] = future
+        self.__control.send((request_id, command, *args))
+        try:
+            return await asyncio.wait_for(future, timeout)
+        finally:
+            self.__pending.pop(request_id, None)
+
+
+    async def start_room(self, servername: str, host: str, port: int) -> None:
+        await self.request("start_room", servername, host, port)
+        self.rooms.add(servername)
+
+
+    async def hand_over(self, servername: str, sock: socket.socket, pending: bytes = b"") -> None:
+        if self.__handover is None:
+            raise RuntimeError(f"Процесс комнат PID={self.pid} не принимает соединения")
+        try:
+            await send_socket(self.__handover, sock, servername.encode("utf-8") + b"\0" + pending)
+        finally:
+            sock.close()
+
+
+    async def drain_room(self, servername: str, path: str, timeout: float = 60) -> int:
+        handed_over = await self.request("drain_room", servername, path, timeout, timeout=timeout + 5)
+        self.rooms.discard(servername)
+        return handed_over
+
+
+    async def receive_room(self, servername: str, host: str, port: int, path: str, timeout: float = 60) -> int:
+        received = await self.request("receive_room", servername, host, port, path, timeout, timeout=timeout + 5)
+        self.rooms.add(servername)
+        return received
+
+
+    async def stop_room(self, servername: str) -> None:
+        await self.request("stop_room", servername)
+        self.rooms.discard(servername)
+
+
+    async def metrics(self) -> list[dict[str, Any]]:
+        return await self.request("metrics")
+
+
+    async def reload_banned_words(self) -> bool:
+        return await self.request("reload_banned_words")
+
+
+    async def health(self, timeout: float = 5) -> dict[str, Any]:
+        self.health_report = await self.request("health", timeout=timeout)
+        return self.health_report
+
+
+    def close(self, force: bool = False) -> None:
+        if self.__control.closed:
+            return
+        asyncio.get_event_loop().remove_reader(self.__control.fileno())
+        self.__control.close()
+        if self.__handover is not None:
+            self.__handover.close()
+        for future in self.__pending.values():
+            if not future.done():
+                future.set_exception(ConnectionError(f"Процесс комнат PID={self.pid} завершился"))
+        self.__pending.clear()
+        if self.__process.is_alive():
+            if force:
+                self.__process.kill()
+            else:
+                self.__process.terminate()
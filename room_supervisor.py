@@ -0,0 +1,311 @@
+import asyncio
+import itertools
+import os
+import tempfile
+import time
+from room_host import *
+from typing import Any, Optional
+
+
+log = get_logger(__name__)
+
+room_restarts = metrics.counter("room_restarts_total", "Rooms restarted after their process died", ("servername",))
+room_uptime = metrics.gauge("room_uptime_seconds", "Time since the room was last started", ("servername",))
+room_process_rss = metrics.gauge("room_process_rss_bytes", "Resident memory of the process hosting the room",
+                                 ("servername",))
+room_workers_idle = metrics.gauge("room_workers_idle", "Started room processes waiting for a room")
+room_handovers = metrics.counter("room_handovers_total", "Rooms moved to a new process without dropping clients",
+                                 ("result",))
+
+
+class _Room:
+    __slots__ = ("servername", "address", "isolated", "worker", "started_at", "restarts", "backoff", "restart")
+
+    def __init__(self, servername: str, address: tuple[str, int], isolated: bool, backoff: float) -> None:
+        self.servername: str = servername
+        self.address: tuple[str, int] = address
+        self.isolated: bool = isolated
+        self.worker: Optional[RoomWorker] = None
+        self.started_at: float = time.monotonic()
+        self.restarts: int = 0
+        self.backoff: float = backoff
+        self.restart: Optional[asyncio.Task] = None
+
+
+class RoomSupervisor:
+    def __init__(self, storage_config: dict[str, Any], loop_impl: str = "auto", fd_passing: bool = False,
+                 federation_path: Optional[str] = None, room_workers: int = 1, warm_workers: int = 1,
+                 health_interval: float = 5, health_timeout: float = 5, startup_timeout: float = 30,
+                 restart_backoff: float = 0.5, max_restart_backoff: float = 30, stable_uptime: float = 60,
+                 handover_timeout: float = 60) -> None:
+        self.__storage_config: dict[str, Any] = storage_config
+        self.__loop_impl: str = loop_impl
+        self.__fd_passing: bool = fd_passing
+        self.__federation_path: Optional[str] = federation_path
+        self.__room_workers: int = room_workers
+        self.__warm_workers: int = warm_workers
+        self.__health_interval: float = health_interval
+        self.__health_timeout: float = health_timeout
+        self.__startup_timeout: float = startup_timeout
+        self.__restart_backoff: float = restart_backoff
+        self.__max_restart_backoff: float = max_restart_backoff
+        self.__stable_uptime: float = stable_uptime
+        self.__handover_timeout: float = handover_timeout
+        self.__handover_ids: itertools.count = itertools.count()
+
+        self.__idle: list[RoomWorker] = []
+        self.__shared: list[RoomWorker] = []
+        self.__rooms: dict[str, _Room] = {}
+        self.__starting: dict[str, asyncio.Task] = {}
+        self.__spawning: set[asyncio.Task] = set()
+        self.__health_task: Optional[asyncio.Task] = None
+        self.__closed: bool = False
+        room_workers_idle.labels().set_function(lambda: len(self.__idle))
+
+
+    @property
+    def workers(self) -> list[RoomWorker]:
+        workers = {room.worker for room in self.__rooms.values() if room.worker is not None}
+        return [worker for worker in workers if worker.is_alive()]
+
+
+    def worker_for(self, servername: str) -> Optional[RoomWorker]:
+        room = self.__rooms.get(servername)
+        if room is None or room.worker is None or not room.worker.is_alive():
+            return None
+        return room.worker
+
+
+    async def start(self) -> None:
+        self.__fill_pool()
+        self.__health_task = asyncio.create_task(self.__check_health())
+
+
+    def __new_worker(self) -> RoomWorker:
+        return RoomWorker(self.__storage_config, self.__loop_impl, fd_passing=self.__fd_passing,
+                          federation_path=self.__federation_path, on_exit=self.__on_worker_exit)
+
+
+    def __fill_pool(self) -> None:
+        for _ in range(self.__warm_workers - len(self.__idle) - len(self.__spawning)):
+            task = asyncio.create_task(self.__spawn())
+            self.__spawning.add(task)
+            task.add_done_callback(self.__spawning.discard)
+
+
+    async def __spawn(self) -> None:
+        backoff = self.__restart_backoff
+        while not self.__closed:
+            worker = None
+            try:
+                worker = self.__new_worker()
+                await worker.health(self.__startup_timeout)
+            except Exception as e:
+                log.warning("Не удалось подготовить резервный процесс комнат: %s", e)
+                if worker is not None:
+                    worker.close(force=True)
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, self.__max_restart_backoff)
+                continue
+            if self.__closed:
+                worker.close()
+                return
+            self.__idle.append(worker)
+            log.debug("Резервный процесс комнат PID=%s готов", worker.pid)
+            return
+
+
+    def __take_worker(self, isolated: bool) -> RoomWorker:
+        worker = None
+        while self.__idle and worker is None:
+            candidate = self.__idle.pop()
+            if candidate.is_alive():
+                worker = candidate
+        if worker is None:
+            log.warning("Нет готовых процессов комнат, запускается новый процесс")
+            worker = self.__new_worker()
+        worker.isolated = isolated
+        self.__fill_pool()
+        return worker
+
+
+    def __select_worker(self) -> RoomWorker:
+        shared = [worker for worker in self.__shared if worker.is_alive()]
+        if len(shared) < self.__room_workers:
+            worker = self.__take_worker(False)
+            self.__shared.append(worker)
+            return worker
+        return min(shared, key=lambda worker: len(worker.rooms))
+
+
+    async def run_room(self, servername: str, host: str, port: int, isolated: bool = False) -> RoomWorker:
+        starting = self.__starting.get(servername)
+        if starting is None:
+            worker = self.worker_for(servername)
+            if worker is not None:
+                return worker
+            starting = self.__starting[servername] = asyncio.create_task(
+                self.__start_room(servername, host, port, isolated))
+            starting.add_done_callback(lambda _: self.__starting.pop(servername, None))
+        return await asyncio.shield(starting)
+
+
+    async def __start_room(self, servername: str, host: str, port: int, isolated: bool) -> RoomWorker:
+        worker = self.__take_worker(True) if isolated else self.__select_worker()
+        try:
+            await worker.start_room(servername, host, port)
+        except Exception:
+            if not worker.rooms:
+                self.__retire(worker)
+            raise
+        room = self.__rooms.get(servername)
+        if room is None:
+            room = self.__rooms[servername] = _Room(servername, (host, port), isolated, self.__restart_backoff)
+            room_uptime.labels(servername).set_function(lambda: time.monotonic() - room.started_at)
+        room.address, room.isolated, room.worker = (host, port), isolated, worker
+        room.started_at = time.monotonic()
+        log.info("Сервер %s запущен на %s:%s, PID=%s", servername, host, port, worker.pid,
+                 extra={"servername": servername})
+        return worker
+
+
+    def __retire(self, worker: RoomWorker) -> None:
+        if worker in self.__shared:
+            self.__shared.remove(worker)
+        worker.close()
+
+
+    def __on_worker_exit(self, worker: RoomWorker) -> None:
+        if worker in self.__idle:
+            self.__idle.remove(worker)
+        if worker in self.__shared:
+            self.__shared.remove(worker)
+        if self.__closed:
+            return
+        for room in self.__rooms.values():
+            if room.worker is worker and room.restart is None:
+                self.__schedule_restart(room, worker.exitcode)
+        self.__fill_pool()
+
+
+    def __schedule_restart(self, room: _Room, exitcode: Optional[int]) -> None:
+        if time.monotonic() - room.started_at >= self.__stable_uptime:
+            room.backoff = self.__restart_backoff
+        delay, room.backoff = room.backoff, min(room.backoff * 2, self.__max_restart_backoff)
+        log.error("Процесс комнат сервера %s завершился (код %s), перезапуск через %.1f с", room.servername,
+                  exitcode, delay, extra={"servername": room.servername})
+        room.restart = asyncio.create_task(self.__restart(room, delay))
+
+
+    async def __restart(self, room: _Room, delay: float) -> None:
+        await asyncio.sleep(delay)
+        room.restart = None
+        if self.__closed or self.worker_for(room.servername) is not None:
+            return
+        try:
+            await self.run_room(room.servername, *room.address, room.isolated)
+        except Exception as e:
+            log.error("Не удалось перезапустить сервер %s: %s", room.servername, e,
+                      extra={"servername": room.servername})
+            self.__schedule_restart(room, None)
+            return
+        room.restarts += 1
+        room_restarts.labels(room.servername).inc()
+        log.info("Сервер %s перезапущен, PID=%s", room.servername, room.worker.pid,
+                 extra={"servername": room.servername})
+
+
+    async def __hand_over_room(self, room: _Room, old: RoomWorker, new: RoomWorker) -> RoomWorker:
+        path = os.path.join(tempfile.gettempdir(),
+                            f"simplechat-handover-{os.getpid()}-{next(self.__handover_ids)}.sock")
+        try:
+            received, _ = await asyncio.gather(
+                new.receive_room(room.servername, *room.address, path, self.__handover_timeout),
+                old.drain_room(room.servername, path, self.__handover_timeout))
+        except Exception as e:
+            room_handovers.labels("failed").inc()
+            log.error("Не удалось передать сервер %s процессу PID=%s: %s", room.servername, new.pid, e,
+                      extra={"servername": room.servername})
+            if room.servername not in new.rooms:
+                await new.start_room(room.servername, *room.address)
+            received = 0
+        else:
+            room_handovers.labels("ok").inc()
+        room.worker = new
+        log.info("Сервер %s перенесен из процесса PID=%s в PID=%s, соединений: %s", room.servername, old.pid,
+                 new.pid, received, extra={"servername": room.servername})
+        return new
+
+
+    async def hand_over_worker(self, worker: RoomWorker) -> RoomWorker:
+        replacement = self.__take_worker(worker.isolated)
+        if worker in self.__shared:
+            self.__shared[self.__shared.index(worker)] = replacement
+        try:
+            for servername in list(worker.rooms):
+                room = self.__rooms[servername]
+                handover = self.__starting[servername] = asyncio.create_task(
+                    self.__hand_over_room(room, worker, replacement))
+                handover.add_done_callback(lambda _, servername=servername: self.__starting.pop(servername, None))
+                await asyncio.shield(handover)
+        finally:
+            worker.close()
+        return replacement
+
+
+    async def rolling_restart(self) -> None:
+        for worker in self.workers:
+            try:
+                await self.hand_over_worker(worker)
+            except Exception as e:
+                log.error("Не удалось перезапустить процесс комнат PID=%s: %s", worker.pid, e)
+
+
+    async def __probe(self, worker: RoomWorker) -> None:
+        try:
+            report = await worker.health(self.__health_timeout)
+        except Exception as e:
+            if worker.is_alive():
+                log.error("Процесс комнат PID=%s не отвечает на проверку: %s", worker.pid, e)
+                worker.close(force=True)
+            return
+        for servername in report["rooms"]:
+            if report["rss"] is not None and servername in self.__rooms:
+                room_process_rss.labels(servername).set(report["rss"])
+
+
+    async def __check_health(self) -> None:
+        while True:
+            await asyncio.sleep(self.__health_interval)
+            workers = set(self.workers) | {worker for worker in self.__idle + self.__shared if worker.is_alive()}
+            await asyncio.gather(*(self.__probe(worker) for worker in workers))
+
+
+    def report(self) -> list[dict[str, Any]]:
+        now = time.monotonic()
+        rooms = []
+        for servername, room in sorted(self.__rooms.items()):
+            worker = room.worker if room.worker is not None and room.worker.is_alive() else None
+            health = worker.health_report if worker is not None else {}
+            rooms.append({"servername": servername, "address": f"{room.address[0]}:{room.address[1]}",
+                          "pid": None if worker is None else worker.pid,
+                          "uptime": None if worker is None else round(now - room.started_at, 1),
+                          "process_uptime": None if worker is None else round(worker.uptime, 1),
+                          "rss": health.get("rss"), "connections": health.get("rooms", {}).get(servername),
+                          "restarts": room.restarts, "isolated": room.isolated})
+        return rooms
+
+
+    async def close(self) -> None:
+        self.__closed = True
+        if self.__health_task is not None:
+            self.__health_task.cancel()
+        for task in list(self.__spawning) + [room.restart for room in self.__rooms.values() if room.restart]:
+            task.cancel()
+        for worker in set(self.workers) | set(self.__idle) | set(self.__shared):
+            worker.close()
+        self.__idle.clear()
+        self.__shared.clear()
+        for metric in (room_uptime, room_process_rss):
+            for servername in self.__rooms:
+                metric.remove(servername)
@@ -1,20 +1,65 @@
 import asyncio
-import asyncpg
+import json
+import os
 import socket
+import time
 from utils import *
-from database_handling.execute_requests import *
-from typing import Optional, Any, Callable
+from database_handling.storage import *
+from database_handling.message_log import *
+from database_handling.mailbox import *
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Optional, Any
+
+
+log = get_logger(__name__)
+
+WHISPER_MARK: bytes = " шепчет вам: ".encode("utf-8")
+
+connections_accepted = metrics.counter("chat_connections_accepted_total", "Accepted client connections",
+                                       ("servername",))
+connections_online = metrics.gauge("chat_connections", "Authenticated users online", ("servername",))
+auth_duration = metrics.histogram("chat_auth_duration_seconds", "Time from accept to finished authentication",
+                                  ("servername",))
+auth_failures = metrics.counter("chat_auth_failures_total", "Connections that failed to authenticate",
+                                ("servername",))
+broadcast_fanout = metrics.histogram("chat_broadcast_fanout", "Recipients of a broadcast message", ("servername",),
+                                     FANOUT_BUCKETS)
+broadcast_duration = metrics.histogram("chat_broadcast_duration_seconds", "Time to enqueue a broadcast message",
+                                       ("servername",))
+send_queue_depth = metrics.gauge("chat_send_queue_depth", "Frames waiting in send queues", ("servername",))
+send_queue_depth_max = metrics.gauge("chat_send_queue_depth_max", "Longest send queue", ("servername",),
+                                     aggregate="max")
+send_queue_evictions = metrics.counter("chat_send_queue_evictions_total", "Users evicted for slow reading",
+                                       ("servername",))
+messages_throttled = metrics.counter("chat_messages_throttled_total", "Messages delayed by the room rate limit",
+                                     ("servername",))
+messages_dropped = metrics.counter("chat_messages_dropped_total", "Messages dropped by rate limits",
+                                   ("servername", "scope"))
 
 
 class Server:
     def __init__(self, host: str, port: int, servername: str,
                  psql_host: str ="localhost", psql_port: int = 5432,
                  psql_user: str = "postgres", psql_password: str ="admin",
-                 psql_db: str = "userdata") -> None:
+                 psql_db: str = "userdata", send_queue_high_water: int = 1024,
+                 storage: Optional[Storage] = None, storage_config: Optional[dict[str, Any]] = None,
+                 credentials: Optional[CredentialVerifier] = None, metrics_port: Optional[int] = None,
+                 history_dir: str = "history", history_replay: int = 50,
+                 history_executor: Optional[ThreadPoolExecutor] = None,
+                 mailbox: Optional[OfflineMailbox] = None, federation: Optional[FederationClient] = None,
+                 presence_interval: float = 0.25, users_page_size: int = 50,
+                 auth_timeout: Optional[float] = 60, idle_timeout: Optional[float] = 1800,
+                 heartbeat_interval: Optional[float] = 30, heartbeat_timeout: float = 10,
+                 user_message_rate: float = 5, user_message_burst: float = 20,
+                 room_message_rate: float = 500, room_message_burst: float = 1000,
+                 room_max_delay: float = 1.0, sock: Optional[socket.socket] = None) -> None:
         try:
             self._addr: tuple[str, int] = host, port
-            self.__server: socket.socket = socket.socket()
-            self.__server.bind(self._addr)
+            self.__server: socket.socket = sock or socket.socket()
+            if sock is None:
+                self.__server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+                self.__server.bind(self._addr)
             self.__server.setblocking(False)
             self._servername: str = servername
         except socket.error as e:
@@ -22,11 +67,22 @@ class Server:
         except Exception as e:
             raise RuntimeError(f"Unexpected error: {e} with {servername}")
 
-        self.__connections: dict[socket.socket, str] = {}
-        self.__connection_by_username: dict[str, socket.socket] = {}
-
-
-        self.__psql_params: dict[str, Any] = {
+        self.__sessions: SessionRegistry = SessionRegistry()
+        self.__send_queue_high_water: int = send_queue_high_water
+        self.__auth_timeout: Optional[float] = auth_timeout
+        self.__idle_timeout: Optional[float] = idle_timeout
+        self.__heartbeat_interval: Optional[float] = heartbeat_interval
+        self.__heartbeat_timeout: float = heartbeat_timeout
+        self.__user_limiter: RateLimiter = RateLimiter(user_message_rate, user_message_burst)
+        self.__room_limiter: RateLimiter = RateLimiter(room_message_rate, room_message_burst)
+        self.__room_max_delay: float = room_max_delay
+        self.__presence: PresenceIndex = PresenceIndex()
+        self.__presence_notifier: PresenceNotifier = PresenceNotifier(self.__publish_presence, presence_interval)
+        self.__users_page_size: int = users_page_size
+
+
+        self.__storage_config: dict[str, Any] = storage_config or {
+            "backend": "postgres",
             "host": psql_host,
             "port": psql_port,
             "user": psql_user,
@@ -37,202 +93,600 @@ class Server:
             "timeout": 30,
             "command_timeout": 30
         }
-        self.__psql_pool: Optional[asyncpg.Pool] = None
-
-        self.__commands: dict[str, Callable] = {}
-        for obj in dir(self):
-            if callable(getattr(self, obj)) and hasattr(getattr(self, obj), "command_name"):
-                self.__commands[getattr(self, obj).command_name] = getattr(self, obj)
+        self.__storage: Storage = storage or create_storage(self.__storage_config)
+        self.__owns_storage: bool = storage is None
+        self.__credentials: CredentialVerifier = credentials or CredentialVerifier()
+        self.__owns_credentials: bool = credentials is None
+        self.__mailbox: OfflineMailbox = mailbox or OfflineMailbox(self.__storage)
+        self.__owns_mailbox: bool = mailbox is None
+        self.__federation: Optional[FederationClient] = federation
+        self.__history: MessageLog = MessageLog(os.path.join(history_dir, servername), servername,
+                                                executor=history_executor)
+        self.__history_replay: int = history_replay
+        self.__listener: Optional[asyncio.Server] = None
+        self.__metrics_port: Optional[int] = metrics_port
+        self.__metrics_endpoint: Optional[MetricsEndpoint] = None
+        self.__lag_monitor: Optional[asyncio.Task] = None
+
+        self.__connections_accepted = connections_accepted.labels(servername)
+        self.__auth_duration = auth_duration.labels(servername)
+        self.__auth_failures = auth_failures.labels(servername)
+        self.__broadcast_fanout = broadcast_fanout.labels(servername)
+        self.__broadcast_duration = broadcast_duration.labels(servername)
+        self.__send_queue_evictions = send_queue_evictions.labels(servername)
+        self.__messages_throttled = messages_throttled.labels(servername)
+        self.__user_messages_dropped = messages_dropped.labels(servername, "user")
+        self.__room_messages_dropped = messages_dropped.labels(servername, "room")
+        connections_online.labels(servername).set_function(lambda: len(self.__sessions))
+        send_queue_depth.labels(servername).set_function(
+            lambda: sum(len(session.send_queue) for session in self.__sessions))
+        send_queue_depth_max.labels(servername).set_function(
+            lambda: max((len(session.send_queue) for session in self.__sessions), default=0))
+
+        self.__router: CommandRouter = CommandRouter(self)
 
 
     @command("/help")
-    async def __help(self, connection: socket.socket) -> None:
+    async def __help(self, session: Session) -> None:
         try:
             await self.__send_message(("Список доступных команд:\n" +
-                                   ("\n".join(i for i in self.__commands.keys()))).encode("utf-8"),
-                                      connection, connection)
+                                       "\n".join(self.__router.usages)).encode("utf-8"), session, session)
         except Exception as e:
-            print(f"Произошла ошибка {e} на сервере {self._servername} "
-                  f"при попытка отослать список доступных команд пользователю {self.__connections[connection]}")
+            log.error("Произошла ошибка %s при попытке отослать список доступных команд пользователю %s", e,
+                      session.username, extra={"servername": self._servername})
 
 
-    @command("/users_online")
-    async def __users_online(self, connection: socket.socket) -> None:
+    @command("/users_online", "префикс | all", "страница", required=0)
+    async def __users_online(self, session: Session, scope: str = "", page: str = "") -> None:
         try:
-            await self.__send_message((f"Пользователи онлайн:\n" +
-                                   ("\n".join(i for i in sorted(self.__connections.values())))).encode("utf-8"),
-                                      connection, connection)
+            if scope == "all" and self.__federation is not None:
+                await self.__send_all_users_page(session, page)
+                return
+            await self.__send_users_page(session, scope, page)
         except Exception as e:
-            print(f"Произошла ошибка {e} на сервере {self._servername} "
-                  f"при попытка отослать список пользователей в сети пользователю {self.__connections[connection]}")
+            log.error("Произошла ошибка %s при попытке отослать список пользователей в сети пользователю %s", e,
+                      session.username, extra={"servername": self._servername})
+
+
+    async def __send_users_page(self, session: Session, prefix: str, page: str) -> None:
+        if prefix.isdigit() and not page:
+            prefix, page = "", prefix
+        page_number = int(page) if page.isdigit() and int(page) > 0 else 1
+        offset = (page_number - 1) * self.__users_page_size
+        usernames, total = self.__presence.page(prefix, offset, self.__users_page_size)
+        shown = f"{offset + 1}-{offset + len(usernames)}" if usernames else "0"
+        text = f"Пользователи онлайн: {shown} из {total}\n" + "\n".join(usernames)
+        if offset + len(usernames) < total:
+            text += f"\nСледующая страница: /users_online {prefix + ' ' if prefix else ''}{page_number + 1}"
+        await self.__send_message(text.encode("utf-8"), session, session)
+
+
+    async def __send_all_users_page(self, session: Session, page: str) -> None:
+        page_number = int(page) if page.isdigit() and int(page) > 0 else 1
+        offset = (page_number - 1) * self.__users_page_size
+        users, total = await self.__federation.presence(offset, self.__users_page_size)
+        rooms: dict[str, list[str]] = {}
+        for servername, username in users:
+            rooms.setdefault(servername, []).append(username)
+        shown = f"{offset + 1}-{offset + len(users)}" if users else "0"
+        text = f"Пользователи онлайн на всех серверах: {shown} из {total}\n" + "\n".join(
+            f"{servername}: {', '.join(usernames)}" for servername, usernames in rooms.items())
+        if offset + len(users) < total:
+            text += f"\nСледующая страница: /users_online all {page_number + 1}"
+        await self.__send_message(text.encode("utf-8"), session, session)
+
+
+    @staticmethod
+    def __presence_frames(title: str, names: list[str]) -> bytes:
+        prefix = title.encode("utf-8")
+        frames, chunk, size = [], [], len(prefix)
+        for name in names:
+            encoded = name.encode("utf-8")
+            if chunk and size + len(encoded) > MAX_FRAME_SIZE:
+                frames.append(encode_frame(prefix + b", ".join(chunk)))
+                chunk, size = [], len(prefix)
+            chunk.append(encoded)
+            size += len(encoded) + 2
+        if chunk:
+            frames.append(encode_frame(prefix + b", ".join(chunk)))
+        return b"".join(frames)
+
+
+    def __publish_presence(self, joined: list[str], left: list[str]) -> None:
+        left_frames = self.__presence_frames("Отключились: ", left)
+        joiner = self.__sessions.find(joined[0]) if len(joined) == 1 else None
+        self.__broadcast(self.__presence_frames("Подключились: ", joined) + left_frames, joiner)
+        if joiner is not None and left_frames:
+            joiner.send_queue.put(left_frames)
+
+
+    @command("/history", body="номер сообщения | ГГГГ-ММ-ДД ЧЧ:ММ")
+    async def __get_history(self, session: Session, before: memoryview) -> None:
+        before = str(before, "utf-8")
+        try:
+            if not before:
+                before_seq = None
+            elif before.isdigit():
+                before_seq = int(before)
+            else:
+                before_seq = await self.__history.seq_at(datetime.fromisoformat(before).timestamp())
+        except ValueError:
+            await self.__send_message("Использование: /history [номер сообщения | ГГГГ-ММ-ДД ЧЧ:ММ]".encode("utf-8"),
+                                      session, session)
+            return
+        records = await self.__history.read(before_seq, self.__history_replay)
+        if not records:
+            await self.__send_message("Более ранних сообщений нет".encode("utf-8"), session, session)
+            return
+        self.__send_history(session, records)
 
 
-    @command("/whisper")
-    async def __whisper(self, connection_sender: socket.socket, receiver_username: str, message: bytes) -> None:
-        connection_receiver = self.__connection_by_username[receiver_username]
-        await self.__send_message(f"{self.__connections[connection_sender]} шепчет вам: ".encode("utf-8") + message,
-                                  connection_sender, connection_receiver)
+    def __send_history(self, session: Session, records: list[HistoryRecord]) -> None:
+        frames = [encode_frame(f"[{seq}] {datetime.fromtimestamp(sent_at):%d.%m %H:%M:%S} {username}: "
+                               f"{message}".encode("utf-8")) for seq, sent_at, username, message in records]
+        if records[0][0] > 0:
+            frames.append(encode_frame(f"Более ранние сообщения: /history {records[0][0]}".encode("utf-8")))
+        session.send_queue.put(b"".join(frames))
 
 
-    async def __send_message(self, message: bytes, connection_sender: socket.socket,
-                             connection_receiver: Optional[socket.socket]=None) -> None:
-        loop = asyncio.get_event_loop()
-        receivers = self.__connections.items() if connection_receiver is None \
-            else {connection_receiver: self.__connections[connection_receiver]}.items()
-        for con, username in receivers:
-            if con != connection_sender or connection_receiver is not None:
-                try:
-                    asyncio.create_task(loop.sock_sendall(con, message))
-                except Exception as e:
-                    print(f"Произошла ошибка {e} при попытке отослать сообщение пользователю {self.__connections[con]} "
-                          f"на сервере {self._servername}")
-                    await self.__disconnect(con)
+    @command("/broadcast", "имя сервера | *", body="сообщение")
+    async def __broadcast_rooms(self, sender: Session, target: str, message: memoryview) -> None:
+        if self.__federation is None:
+            await self.__send_message("Сервер не подключен к другим серверам".encode("utf-8"), sender, sender)
+            return
+        text = f"[{self._servername}] {sender.username}: {banned_words.censor(str(message, 'utf-8'))}"
+        if target in (BROADCAST_ALL, self._servername):
+            await self.__send_message(text.encode("utf-8"), sender)
+        self.__federation.broadcast(self._servername, target, text)
+
+
+    @command("/whisper", "имя пользователя", body="сообщение")
+    async def __whisper(self, sender: Session, receiver_username: str, message: memoryview) -> None:
+        message = banned_words.censor_bytes(message)
+        receiver = self.__sessions.find(receiver_username)
+        if receiver is not None:
+            await self.__send_message(sender.name + WHISPER_MARK + message, sender, receiver)
+        elif self.__federation is None or \
+                not await self.__federation.whisper(sender.username, receiver_username, str(message, "utf-8")):
+            await self.__whisper_offline(sender, receiver_username, message)
+
+
+    def deliver_whisper(self, sender_username: str, receiver_username: str, message: str) -> bool:
+        receiver = self.__sessions.find(receiver_username)
+        if receiver is None:
+            return False
+        receiver.send_queue.put(encode_frame(f"{sender_username} шепчет вам: {message}".encode("utf-8")))
+        return True
 
 
-    async def __receive(self, connection: socket.socket) -> None:
-        username = self.__connections[connection]
-        loop = asyncio.get_event_loop()
+    def deliver_broadcast(self, text: str) -> None:
+        self.__broadcast(encode_frame(text.encode("utf-8")), None)
+
+
+    async def __whisper_offline(self, sender: Session, receiver_username: str, message: memoryview) -> None:
+        if await self.__storage.get_password_by_username(receiver_username) is None:
+            await self.__send_message(f"Пользователь {receiver_username} не существует".encode("utf-8"),
+                                      sender, sender)
+            return
+        self.__mailbox.put(receiver_username, sender.username, str(message, "utf-8"))
+        await self.__send_message(f"Пользователь {receiver_username} не в сети, сообщение будет доставлено "
+                                  f"при следующем входе".encode("utf-8"), sender, sender)
+
+
+    async def __deliver_whispers(self, session: Session) -> None:
+        try:
+            whispers = await self.__mailbox.take(session.username)
+        except (StorageError, ConnectionError, TimeoutError) as e:
+            log.error("Не удалось получить сообщения, отправленные пользователю %s не в сети: %s", session.username,
+                      e, extra={"servername": self._servername})
+            return
+        if not whispers or session not in self.__sessions:
+            return
+        frames = [encode_frame("Сообщения, полученные пока вас не было в сети:".encode("utf-8"))]
+        frames.extend(encode_frame(f"[{datetime.fromtimestamp(sent_at):%d.%m %H:%M:%S}] {sender} шепчет вам: "
+                                   f"{message}".encode("utf-8")) for sent_at, sender, message in whispers)
+        session.send_queue.put(b"".join(frames))
+
+
+    async def __send_message(self, message: bytes, sender: Optional[Session],
+                             receiver: Optional[Session]=None) -> None:
+        frame = encode_frame(message)
+        if receiver is not None:
+            receiver.send_queue.put(frame)
+            return
+        self.__broadcast(frame, sender)
+
+
+    def __broadcast(self, frame: bytes, sender: Optional[Session]) -> None:
+        started = time.perf_counter()
+        for session in self.__sessions:
+            if session is not sender:
+                session.send_queue.put(frame)
+        self.__broadcast_duration.observe(time.perf_counter() - started)
+        self.__broadcast_fanout.observe(len(self.__sessions) - (sender is not None and sender in self.__sessions))
+
+
+    def __evict(self, session: Session) -> None:
+        self.__send_queue_evictions.inc()
+        log.warning("Пользователь %s не успевает принимать сообщения", session.username,
+                    extra={"servername": self._servername})
+        asyncio.create_task(self.__disconnect(session))
+
+
+    def __expire(self, session: Session, reason: str) -> None:
+        log.info("Соединение с пользователем %s закрыто по таймауту (%s)", session.username, reason,
+                 extra={"servername": self._servername})
+        if reason == "idle":
+            try:
+                session.connection.write_frame("Соединение закрыто из-за долгого бездействия".encode("utf-8"))
+            except ConnectionError:
+                pass
+        asyncio.create_task(self.__disconnect(session))
+
+
+    def __drop(self, session: Session, scope: str) -> None:
+        if scope == "user":
+            self.__user_messages_dropped.inc()
+            notice = "Вы отправляете сообщения слишком часто, часть сообщений не доставлена"
+        else:
+            self.__room_messages_dropped.inc()
+            notice = "В комнате слишком много сообщений, часть сообщений не доставлена"
+        if session.throttled:
+            return
+        session.throttled = True
+        session.send_queue.put(encode_frame(notice.encode("utf-8")))
+
+
+    async def __receive(self, session: Session) -> None:
+        connection = session.connection
 
         try:
             while True:
-                message = await loop.sock_recv(connection, 1024)
-                if not message:
-                    await self.__disconnect(connection)
+                message = await connection.recv_message()
+                if message is None:
+                    await self.__disconnect(session)
                     break
-                message = message.decode("utf-8")
-                if (com := message.split()[0]) in self.__commands:
-                    try:
-                        if len(message.split(" ")) > 1:
-                            receiver = message.split(" ")[1]
-                            msg = " ".join(message.split()[2:])
-                            await self.__commands[com](connection, receiver, msg.encode("utf-8"))
-                        else:
-                            await self.__commands[com](connection)
-                    except Exception as e:
-                        print(f"Произошла ошибка {e} при попытке выполнить команду {com} на сервере {self._servername}")
-                else:
-                    asyncio.create_task(self.__send_message(f"{username}: ".encode("utf-8") +
-                                                            message.encode("utf-8"), connection))
+                if not message:
+                    continue
+                delay, session.bucket = self.__user_limiter.consume(session.bucket)
+                if delay is None:
+                    self.__drop(session, "user")
+                    continue
+                session.throttled = False
+                try:
+                    if await self.__router.dispatch(message, session):
+                        continue
+                except CommandUsageError as e:
+                    await self.__send_message(str(e).encode("utf-8"), session, session)
+                    continue
+                except Exception as e:
+                    log.error("Произошла ошибка %s при попытке выполнить команду %s", e,
+                              message.split(None, 1)[0].decode("utf-8", "replace"),
+                              extra={"servername": self._servername, "username": session.username})
+                    continue
+                delay = self.__room_limiter.reserve(None, max_delay=self.__room_max_delay)
+                if delay is None:
+                    self.__drop(session, "room")
+                    continue
+                if delay:
+                    self.__messages_throttled.inc()
+                    await asyncio.sleep(delay)
+                text = message.decode("utf-8")
+                censored = banned_words.censor(text)
+                self.__history.append(session.username, censored)
+                self.__broadcast(encode_frame(session.prefix + (message if censored is text else
+                                                                censored.encode("utf-8"))), session)
 
         except Exception as e:
-            print(f"Произошла ошибка {e} с пользователем {username}")
-            await self.__disconnect(connection)
+            log.error("Произошла ошибка %s с пользователем %s", e, session.username,
+                      extra={"servername": self._servername})
+            await self.__disconnect(session)
 
 
-    async def __disconnect(self, connection: socket.socket) -> None:
-        username = self.__connections[connection]
-        print(f"Разрыв соединения с пользователем {username}...")
-        del self.__connections[connection]
-        del self.__connection_by_username[username]
-        connection.close()
-        print(f"Соединение с пользователем {username} разорвано")
-        asyncio.create_task(self.__send_message(f"Пользователь {username} отключился".encode("utf-8"), connection))
+    async def __disconnect(self, session: Session) -> None:
+        if not self.__sessions.remove(session):
+            return
+        session.close()
+        if session.announced:
+            self.__presence.discard(session.username)
+            self.__presence_notifier.left(session.username)
+        if self.__federation is not None:
+            self.__federation.leave(self._servername, session.username)
+        log.info("Соединение с пользователем %s разорвано", session.username, extra={"servername": self._servername})
 
 
-    async def __register(self, connection: socket.socket, username: str) -> None:
-        loop = asyncio.get_event_loop()
+    async def __register(self, connection: FramedConnection, username: str) -> bool:
         try:
-            await loop.sock_sendall(connection, "Вы новенький,\nпридумайте пароль: ".encode("utf-8"))
-            received_user_password = (await loop.sock_recv(connection, 1024)).decode("utf-8")
+            await connection.send_message("Вы новенький,\nпридумайте пароль: ".encode("utf-8"))
+            received_user_password = await connection.recv_text()
             while not check_password_validity(received_user_password):
-                await loop.sock_sendall(connection, "Пароль слишком слабый либо содержит запрещенные символы,\n"
-                                                    "попробуйте еще раз: ".encode("utf-8"))
-                received_user_password = (await loop.sock_recv(connection, 1024)).decode("utf-8")
+                await connection.send_message("Пароль слишком слабый либо содержит запрещенные символы,\n"
+                                              "попробуйте еще раз: ".encode("utf-8"))
+                received_user_password = await connection.recv_text()
             try:
-                await add_user(self.__psql_pool, username, received_user_password)
-            except (asyncpg.PostgresError, ConnectionError) as e:
-                print(f"Не удалось добавить пользователя {username} на сервере {self._servername}: {e}")
-                return
+                await self.__storage.add_user(username, await self.__credentials.hash(received_user_password))
+            except (StorageError, ConnectionError) as e:
+                log.error("Не удалось добавить пользователя %s: %s", username, e,
+                          extra={"servername": self._servername})
+                return False
+            return True
 
+        except ConnectionResetError:
+            return False
         except Exception as e:
-            print(f"Произошла ошибка {e} при попытке зарегистрировать пользователя {connection} "
-                  f"на сервере {self._servername}")
+            if connection.expired is None:
+                log.error("Произошла ошибка %s при попытке зарегистрировать пользователя %s", e, connection,
+                          extra={"servername": self._servername})
+        return False
 
 
-    async def __authenticate(self, connection: socket.socket) -> bool:
-        loop = asyncio.get_event_loop()
-        await loop.sock_sendall(connection, "Введите имя пользователя: ".encode("utf-8"))
+    async def __upgrade_password(self, username: str, password: str) -> None:
         try:
-            username = (await loop.sock_recv(connection, 1024)).decode("utf-8")
+            await self.__storage.update_password(username, await self.__credentials.hash(password))
+        except (StorageError, ConnectionError, TimeoutError) as e:
+            log.warning("Не удалось обновить хеш пароля пользователя %s: %s", username, e,
+                        extra={"servername": self._servername})
+            return
+        log.info("Хеш пароля пользователя %s обновлен", username, extra={"servername": self._servername})
+
+
+    async def __authenticate(self, connection: FramedConnection) -> Optional[Session]:
+        await connection.send_message("Введите имя пользователя: ".encode("utf-8"))
+        try:
+            username = await connection.recv_text()
             while not check_username_validity(username):
-                await loop.sock_sendall(connection, "Имя пользователя некорректно,"
-                                                    "\nпопробуйте другое имя пользователя: ".encode("utf-8"))
-                username = (await loop.sock_recv(connection, 1024)).decode("utf-8")
+                await connection.send_message("Имя пользователя некорректно,"
+                                              "\nпопробуйте другое имя пользователя: ".encode("utf-8"))
+                username = await connection.recv_text()
             try:
-                database_user_password = await get_password_by_username(self.__psql_pool, username)
-            except (asyncpg.PostgresError, ConnectionError) as e:
-                print(f"Произошла ошибка {e} при попытке получить пароль пользователя на сервере {self._servername}")
-                return False
-            received_user_password = None
+                database_user_password = await self.__storage.get_password_by_username(username)
+            except (StorageError, ConnectionError) as e:
+                log.error("Произошла ошибка %s при попытке получить пароль пользователя", e,
+                          extra={"servername": self._servername})
+                return None
+        except ConnectionResetError:
+            return None
         except Exception as e:
-            print(f"Произошла ошибка {e} при попытке получить имя пользователя "
-                  f"{connection} на сервере {self._servername}")
-            return False
+            if connection.expired is None:
+                log.error("Произошла ошибка %s при попытке получить имя пользователя %s", e, connection,
+                          extra={"servername": self._servername})
+            return None
 
         try:
             if database_user_password is None:
-                await self.__register(connection, username)
+                is_authenticated = await self.__register(connection, username)
             else:
-                await loop.sock_sendall(connection, "Введите пароль: ".encode("utf-8"))
-                received_user_password = (await loop.sock_recv(connection, 1024)).decode("utf-8")
-                while received_user_password != database_user_password and received_user_password != "":
-                    await loop.sock_sendall(connection, "Вы ввели неправильный пароль,\n"
-                                                        "попробуйте еще раз: ".encode("utf-8"))
-                    received_user_password = (await loop.sock_recv(connection, 1024)).decode("utf-8")
-
-            if received_user_password == database_user_password:
-                self.__connections[connection] = username
-                self.__connection_by_username[username] = connection
-                return True
+                await connection.send_message("Введите пароль: ".encode("utf-8"))
+                received_user_password = await connection.recv_text()
+                is_authenticated = await self.__credentials.verify(username, received_user_password,
+                                                                   database_user_password)
+                while not is_authenticated:
+                    await connection.send_message("Вы ввели неправильный пароль,\n"
+                                                  "попробуйте еще раз: ".encode("utf-8"))
+                    received_user_password = await connection.recv_text()
+                    is_authenticated = await self.__credentials.verify(username, received_user_password,
+                                                                       database_user_password)
+                if is_authenticated and self.__credentials.needs_rehash(database_user_password):
+                    await self.__upgrade_password(username, received_user_password)
+
+            if is_authenticated:
+                history = await self.__history.read(limit=self.__history_replay)
+                session = self.__open_session(connection, username, time.time())
+                if history:
+                    self.__send_history(session, history)
+                return session
+        except ConnectionResetError:
+            return None
         except Exception as e:
-            print(f"С соединением {connection} произошла ошибка {e}")
-        return False
+            if connection.expired is None:
+                log.error("С соединением %s произошла ошибка %s", connection, e,
+                          extra={"servername": self._servername})
+        return None
 
 
-    async def __connect_user(self, connection: socket.socket) -> None:
-        loop = asyncio.get_event_loop()
-        connection.setblocking(False)
+    def __open_session(self, connection: FramedConnection, username: str, connected_at: float) -> Session:
+        session = Session(connection, username, connected_at)
+        session.send_queue = SendQueue(connection, self.__send_queue_high_water, lambda: self.__evict(session))
+        session.watchdog = ConnectionWatchdog(connection, self.__idle_timeout, self.__heartbeat_interval,
+                                              self.__heartbeat_timeout, lambda reason: self.__expire(session, reason))
+        self.__sessions.add(session)
+        if self.__federation is not None:
+            self.__federation.join(self._servername, username)
+        return session
+
+
+    async def __connect_user(self, connection: FramedConnection) -> None:
+        self.__connections_accepted.inc()
         try:
-            status = await self.__authenticate(connection)
-            if not status:
-                print(f"Соединение с {connection} не установлено")
+            auth_deadline = deadline(self.__auth_timeout, connection, "auth")
+            try:
+                with self.__auth_duration.time():
+                    session = await self.__authenticate(connection)
+            finally:
+                if auth_deadline is not None:
+                    auth_deadline.cancel()
+            if session is None:
+                self.__auth_failures.inc()
+                if connection.expired is not None:
+                    log.info("Соединение с %s закрыто по таймауту (%s)", connection, connection.expired,
+                             extra={"servername": self._servername})
+                else:
+                    log.info("Соединение с %s не установлено", connection, extra={"servername": self._servername})
                 connection.close()
                 return
 
-            username = self.__connections[connection]
-            print(f"Новое подключение: {username}")
-            asyncio.create_task(loop.sock_sendall(connection, f"Вы подключились к серверу {self._servername}"
-                                                              f"\nПолучить список доступных команд: "
-                                                              f"/help".encode("utf-8")))
-            send = asyncio.create_task(self.__send_message(f"Подключился пользователь: {username}".encode("utf-8"),
-                                                           connection))
-            rec = asyncio.create_task(self.__receive(connection))
+            log.info("Новое подключение: %s", session.username, extra={"servername": self._servername})
+            await self.__send_message(f"Вы подключились к серверу {self._servername}"
+                                      f"\nПолучить список доступных команд: /help".encode("utf-8"),
+                                      session, session)
+            await self.__deliver_whispers(session)
+            if session not in self.__sessions:
+                return
+            self.__presence.add(session.username)
+            self.__presence_notifier.joined(session.username)
+            session.announced = True
         except Exception as e:
-            print(f"Произошла ошибка {e} при попытке подключить пользователя {connection} "
-                  f"на сервере {self._servername}")
+            log.error("Произошла ошибка %s при попытке подключить пользователя %s", e, connection,
+                      extra={"servername": self._servername})
             return
-        await asyncio.gather(send, rec)
+        await self.__receive(session)
+
 
-    async def __create_pool(self) -> None:
+    async def __connect_handed_over_user(self, connection: FramedConnection) -> None:
         try:
-            self.__psql_pool = await asyncpg.create_pool(**self.__psql_params)
-        except (asyncpg.exceptions.PostgresError, ConnectionError, TimeoutError) as e:
-            raise RuntimeError(f"Failed to create pool: {e} at server {self._servername}")
+            await connection.send_message("connection_handed_over".encode("utf-8"), FRAME_CONTROL)
+        except Exception as e:
+            log.error("Произошла ошибка %s при попытке принять переданное соединение %s", e, connection,
+                      extra={"servername": self._servername})
+            connection.close()
+            return
+        await self.__connect_user(connection)
 
 
-    async def listen(self) -> None:
-        self.__server.listen()
-        await self.__create_pool()
+    async def adopt(self, sock: socket.socket, pending: bytes = b"") -> None:
+        loop = asyncio.get_event_loop()
+        await loop.connect_accepted_socket(lambda: FramedConnection(self.__connect_handed_over_user, pending), sock)
 
+
+    async def __resume_user(self, connection: FramedConnection, state: dict[str, Any]) -> None:
+        connection.last_message = connection.last_received - state["idle"]
+        session = self.__open_session(connection, state["username"], state["connected_at"])
+        session.bucket = None if state["bucket"] is None else tuple(state["bucket"])
+        session.throttled = state["throttled"]
+        self.__presence.add(session.username)
+        session.announced = True
+        await self.__receive(session)
+
+
+    async def adopt_session(self, sock: socket.socket, payload: bytes) -> None:
+        state, _, pending = payload.partition(b"\0")
+        state = json.loads(state)
+        loop = asyncio.get_event_loop()
+        await loop.connect_accepted_socket(
+            lambda: FramedConnection(lambda connection: self.__resume_user(connection, state), pending), sock)
+
+
+    async def __detach_session(self, session: Session) -> tuple[socket.socket, bytes]:
+        connection = session.connection
+        await session.send_queue.flush()
         while True:
-            loop = asyncio.get_event_loop()
-            connection, client_address = await loop.sock_accept(self.__server)
-            asyncio.create_task(self.__connect_user(connection))
+            await connection.flush()
+            try:
+                sock, pending = connection.detach()
+                break
+            except ConnectionError:
+                if connection.fileno() < 0:
+                    raise
+        state = {"username": session.username, "connected_at": session.connected_at, "bucket": session.bucket,
+                 "throttled": session.throttled, "idle": connection.last_received - connection.last_message}
+        payload = json.dumps(state).encode("utf-8") + b"\0" + pending
+        if len(payload) > MAX_HANDOVER_PAYLOAD:
+            sock.close()
+            raise ConnectionError(f"состояние сессии занимает {len(payload)} байт")
+        return sock, payload
+
+
+    async def drain(self, channel: socket.socket, timeout: float = 5) -> int:
+        listening = self.__server.dup()
+        if self.__listener is not None:
+            self.__listener.close()
+        sessions = list(self.__sessions)
+        for session in sessions:
+            self.__sessions.remove(session)
+            session.watchdog.cancel()
+            if session.connection.handler_task is not None:
+                session.connection.handler_task.cancel()
+        detached = await asyncio.gather(*(asyncio.wait_for(self.__detach_session(session), timeout)
+                                          for session in sessions), return_exceptions=True)
+        try:
+            await send_socket(channel, listening, b"listener")
+        finally:
+            listening.close()
+
+        handed_over = 0
+        for session, result in zip(sessions, detached):
+            session.send_queue.close()
+            if isinstance(result, BaseException):
+                log.warning("Не удалось передать соединение с пользователем %s: %s", session.username, result,
+                            extra={"servername": self._servername})
+                session.connection.abort()
+                continue
+            sock, payload = result
+            try:
+                await send_socket(channel, sock, payload)
+                handed_over += 1
+            finally:
+                sock.close()
+        await self.close()
+        return handed_over
 
 
-def create_server(host: str, port: int, servername: str) -> None:
-    server = Server(host, port, servername)
-    asyncio.run(server.listen())
+    async def __open_storage(self) -> None:
+        try:
+            await self.__storage.open()
+        except (StorageError, ConnectionError, TimeoutError) as e:
+            raise RuntimeError(f"Failed to open storage: {e} at server {self._servername}")
+
+
+    async def start(self) -> None:
+        self.__server.listen()
+        if self.__owns_storage:
+            await self.__open_storage()
+        try:
+            await self.__history.open()
+        except OSError as e:
+            raise RuntimeError(f"Failed to open message history: {e} at server {self._servername}")
+
+        loop = asyncio.get_event_loop()
+        self.__listener = await loop.create_server(lambda: FramedConnection(self.__connect_user), sock=self.__server)
+        if self.__federation is not None:
+            self.__federation.register(self._servername, self)
+
+
+    async def __render_metrics(self, path: str) -> Optional[str]:
+        return metrics.render() if path == "/metrics" else None
+
+
+    async def listen(self) -> None:
+        await self.start()
+        self.__lag_monitor = asyncio.create_task(monitor_event_loop_lag())
+        if self.__metrics_port is not None:
+            self.__metrics_endpoint = MetricsEndpoint(self.__render_metrics, self._addr[0], self.__metrics_port)
+            await self.__metrics_endpoint.start()
+        await self.__listener.serve_forever()
+
+
+    async def close(self) -> None:
+        if self.__listener is not None:
+            self.__listener.close()
+        if self.__metrics_endpoint is not None:
+            self.__metrics_endpoint.close()
+        if self.__lag_monitor is not None:
+            self.__lag_monitor.cancel()
+        for session in list(self.__sessions):
+            await self.__disconnect(session)
+        self.__presence_notifier.flush()
+        if self.__federation is not None:
+            self.__federation.unregister(self._servername)
+        await self.__history.close()
+        if self.__owns_mailbox:
+            await self.__mailbox.close()
+        if self.__owns_storage:
+            await self.__storage.close()
+        if self.__owns_credentials:
+            self.__credentials.close()
+        for metric in (connections_online, send_queue_depth, send_queue_depth_max):
+            metric.remove(self._servername)
+
+
+    def connections_count(self) -> int:
+        return len(self.__sessions)
+
+
+def create_server(host: str, port: int, servername: str, loop_impl: str = "auto",
+                  metrics_port: Optional[int] = None) -> None:
+    server = Server(host, port, servername, metrics_port=metrics_port)
+    run_event_loop(server.listen(), loop_impl)
 
 
 
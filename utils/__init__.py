@@ -1,3 +1,19 @@
+from utils.structured_logging import *
+from utils.metrics import *
 from utils.is_command_wrapper import *
+from utils.word_filter import *
 from utils.check_password_username_servername_validity import *
 from utils.check_host_port_validity import *
+from utils.framing import *
+from utils.transport import *
+from utils.send_queue import *
+from utils.presence import *
+from utils.timer_wheel import *
+from utils.heartbeat import *
+from utils.rate_limit import *
+from utils.session import *
+from utils.admission import *
+from utils.event_loop import *
+from utils.fd_passing import *
+from utils.credentials import *
+from utils.federation import *
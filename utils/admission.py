@@ -0,0 +1,38 @@
+from typing import Optional
+from utils.metrics import metrics
+from utils.rate_limit import RateLimiter
+
+
+admission_rejections = metrics.counter("admission_rejections_total", "Connections rejected by admission control",
+                                       ("reason",))
+handshakes_active = metrics.gauge("admission_handshakes_active", "Connections currently admitted for a handshake")
+
+
+class AdmissionController:
+    def __init__(self, max_handshakes: int = 1024, per_ip_rate: Optional[float] = 5, per_ip_burst: float = 20) -> None:
+        self.max_handshakes: int = max_handshakes
+        self.__active: int = 0
+        self.__per_ip: Optional[RateLimiter] = None if per_ip_rate is None else RateLimiter(per_ip_rate,
+                                                                                              per_ip_burst)
+        handshakes_active.labels().set_function(lambda: self.__active)
+
+
+    @property
+    def active(self) -> int:
+        return self.__active
+
+
+    def admit(self, ip: Optional[str]) -> Optional[str]:
+        if self.__active >= self.max_handshakes:
+            reason = "busy"
+        elif self.__per_ip is not None and ip is not None and not self.__per_ip.allow(ip):
+            reason = "rate"
+        else:
+            self.__active += 1
+            return None
+        admission_rejections.labels(reason).inc()
+        return reason
+
+
+    def release(self) -> None:
+        self.__active -= 1
@@ -1,24 +1,21 @@
-import json
+from utils.word_filter import BannedWordsFilter
 
 
-banned_symbols: set[str] = {' ', '\t', '\n', '\r', '"', "'", '`', '<',
+banned_symbols: frozenset[str] = frozenset({' ', '\t', '\n', '\r', '"', "'", '`', '<',
                      '>', '|', '\\', '/', ':', ';', '*', '?',
                      '[', ']', '{','}', '(', ')', '&', '%', '$',
-                     '#', '@', '!', '~', '=', '+', ',', '.'}
+                     '#', '@', '!', '~', '=', '+', ',', '.'})
 
 
-with open("dictionaries/banned_words.json", "r") as file:
-    data = json.load(file)
-    banned_words: tuple[str] = tuple(data["banned_words"])
+banned_words: BannedWordsFilter = BannedWordsFilter("dictionaries/banned_words.json")
 
 
 def check_password_validity(password: str) -> bool:
     if len(password) < 6 or len(password) > 64:
         return False
 
-    for char in password:
-        if char in banned_symbols:
-            return False
+    if not banned_symbols.isdisjoint(password):
+        return False
 
     return True
 
@@ -27,13 +24,11 @@ def check_username_validity(username: str) -> bool:
     if len(username) < 3 or len(username) > 64:
         return False
 
-    for char in username:
-        if char in banned_symbols:
-            return False
+    if not banned_symbols.isdisjoint(username):
+        return False
 
-    for word in banned_words:
-        if word in username.lower():
-            return False
+    if banned_words.contains(username):
+        return False
 
     return True
 
@@ -42,8 +37,7 @@ def check_servername_validity(servername: str) -> bool:
     if len(servername) < 3 or len(servername) > 128:
         return False
 
-    for char in servername:
-        if char in banned_symbols:
-            return False
+    if not banned_symbols.isdisjoint(servername):
+        return False
 
     return True
@@ -0,0 +1,95 @@
+import asyncio
+import hashlib
+import hmac
+import os
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+
+PASSWORD_HASH_ALGORITHM: str = "pbkdf2_sha256"
+PASSWORD_HASH_ITERATIONS: int = 200_000
+
+
+def hash_password(password: str, iterations: int = PASSWORD_HASH_ITERATIONS, salt: Optional[bytes] = None) -> str:
+    salt = salt or os.urandom(16)
+    digest = hashlib.pbkdf2_hmac("sha256", password.encode("utf-8"), salt, iterations)
+    return f"{PASSWORD_HASH_ALGORITHM}${iterations}${salt.hex()}${digest.hex()}"
+
+
+def verify_password(password: str, password_hash: str) -> bool:
+    if not password_hash.startswith(PASSWORD_HASH_ALGORITHM + "$"):
+        return hmac.compare_digest(password.encode("utf-8"), password_hash.encode("utf-8"))
+    try:
+        _, iterations, salt, digest = password_hash.split("$")
+        received_digest = hashlib.pbkdf2_hmac("sha256", password.encode("utf-8"), bytes.fromhex(salt),
+                                              int(iterations))
+    except ValueError:
+        return False
+    return hmac.compare_digest(received_digest.hex(), digest)
+
+
+class CredentialVerifier:
+    def __init__(self, max_workers: int = 2, max_concurrent: int = 8,
+                 cache_ttl: float = 300, cache_size: int = 10000,
+                 iterations: int = PASSWORD_HASH_ITERATIONS) -> None:
+        self.__executor: ThreadPoolExecutor = ThreadPoolExecutor(max_workers=max_workers,
+                                                                 thread_name_prefix="credentials")
+        self.__semaphore: asyncio.Semaphore = asyncio.Semaphore(max_concurrent)
+        self.__cache: OrderedDict[str, tuple[str, bytes, float]] = OrderedDict()
+        self.__cache_ttl: float = cache_ttl
+        self.__cache_size: int = cache_size
+        self.__cache_key: bytes = os.urandom(32)
+        self.__iterations: int = iterations
+
+
+    def __fingerprint(self, password: str) -> bytes:
+        return hmac.digest(self.__cache_key, password.encode("utf-8"), "sha256")
+
+
+    def __cached(self, username: str, password: str, password_hash: str) -> bool:
+        entry = self.__cache.get(username)
+        if entry is None:
+            return False
+        cached_hash, fingerprint, expires_at = entry
+        if expires_at < time.monotonic() or cached_hash != password_hash:
+            del self.__cache[username]
+            return False
+        return hmac.compare_digest(fingerprint, self.__fingerprint(password))
+
+
+    def __remember(self, username: str, password: str, password_hash: str) -> None:
+        now = time.monotonic()
+        self.__cache[username] = (password_hash, self.__fingerprint(password), now + self.__cache_ttl)
+        self.__cache.move_to_end(username)
+        while len(self.__cache) > self.__cache_size:
+            self.__cache.popitem(last=False)
+        while self.__cache and next(iter(self.__cache.values()))[2] < now:
+            self.__cache.popitem(last=False)
+
+
+    async def hash(self, password: str) -> str:
+        loop = asyncio.get_event_loop()
+        async with self.__semaphore:
+            return await loop.run_in_executor(self.__executor, hash_password, password, self.__iterations)
+
+
+    async def verify(self, username: str, password: str, password_hash: str) -> bool:
+        if self.__cached(username, password, password_hash):
+            return True
+        loop = asyncio.get_event_loop()
+        async with self.__semaphore:
+            verified = await loop.run_in_executor(self.__executor, verify_password, password, password_hash)
+        if verified:
+            self.__remember(username, password, password_hash)
+        return verified
+
+
+    def needs_rehash(self, password_hash: str) -> bool:
+        algorithm, _, rest = password_hash.partition("$")
+        return algorithm != PASSWORD_HASH_ALGORITHM or rest.split("$")[0] != str(self.__iterations)
+
+
+    def close(self) -> None:
+        self.__executor.shutdown(wait=False)
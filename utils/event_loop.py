@@ -0,0 +1,26 @@
+import asyncio
+from typing import Any, Coroutine
+
+
+EVENT_LOOP_IMPLEMENTATIONS: tuple[str, ...] = ("auto", "asyncio", "uvloop")
+
+
+def install_event_loop(loop_impl: str = "auto") -> str:
+    if loop_impl not in EVENT_LOOP_IMPLEMENTATIONS:
+        raise ValueError(f"unknown event loop implementation: {loop_impl}")
+    if loop_impl == "asyncio":
+        asyncio.set_event_loop_policy(asyncio.DefaultEventLoopPolicy())
+        return "asyncio"
+    try:
+        import uvloop
+    except ImportError:
+        if loop_impl == "uvloop":
+            raise RuntimeError("uvloop is not installed")
+        return "asyncio"
+    asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    return "uvloop"
+
+
+def run_event_loop(main: Coroutine[Any, Any, Any], loop_impl: str = "auto") -> Any:
+    install_event_loop(loop_impl)
+    return asyncio.run(main)
@@ -0,0 +1,57 @@
+import asyncio
+import socket
+
+
+MAX_HANDOVER_PAYLOAD: int = 1 << 16
+
+
+def create_handover_channel() -> tuple[socket.socket, socket.socket]:
+    parent, child = socket.socketpair(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+    parent.setblocking(False)
+    return parent, child
+
+
+async def send_socket(channel: socket.socket, sock: socket.socket, payload: bytes) -> None:
+    loop = asyncio.get_event_loop()
+    while True:
+        try:
+            socket.send_fds(channel, [payload], [sock.fileno()])
+            return
+        except (BlockingIOError, InterruptedError):
+            writable = loop.create_future()
+            loop.add_writer(channel.fileno(), lambda: writable.done() or writable.set_result(None))
+            try:
+                await writable
+            finally:
+                loop.remove_writer(channel.fileno())
+
+
+async def receive_all_sockets(channel: socket.socket) -> list[tuple[socket.socket, bytes]]:
+    loop = asyncio.get_event_loop()
+    received: list[tuple[socket.socket, bytes]] = []
+    while True:
+        readable = loop.create_future()
+        loop.add_reader(channel.fileno(), lambda: readable.done() or readable.set_result(None))
+        try:
+            await readable
+        finally:
+            loop.remove_reader(channel.fileno())
+        try:
+            received.extend(receive_sockets(channel))
+        except EOFError:
+            return received
+
+
+def receive_sockets(channel: socket.socket) -> list[tuple[socket.socket, bytes]]:
+    received: list[tuple[socket.socket, bytes]] = []
+    while True:
+        try:
+            payload, fds, _, _ = socket.recv_fds(channel, MAX_HANDOVER_PAYLOAD, 1)
+        except (BlockingIOError, InterruptedError):
+            return received
+        if not payload and not fds:
+            if received:
+                return received
+            raise EOFError("handover channel is closed")
+        for fd in fds:
+            received.append((socket.socket(fileno=fd), payload))
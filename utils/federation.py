@@ -0,0 +1,292 @@
+import asyncio
+import json
+import os
+import tempfile
+from typing import Any, Optional
+from utils.metrics import metrics
+from utils.presence import PresenceIndex
+from utils.structured_logging import get_logger
+from utils.transport import FrameBatcher, FramedConnection
+
+
+log = get_logger(__name__)
+
+federation_messages = metrics.counter("federation_messages_total", "Messages handled by the federation hub",
+                                      ("kind",))
+federation_frames = metrics.counter("federation_frames_total", "Batched frames received by the federation hub")
+
+BROADCAST_ALL: str = "*"
+
+
+def default_federation_path() -> str:
+    return os.path.join(tempfile.gettempdir(), f"simplechat-federation-{os.getpid()}.sock")
+
+
+class FederationHub:
+    def __init__(self, path: Optional[str] = None) -> None:
+        self.path: str = path or default_federation_path()
+        self.__server: Optional[asyncio.AbstractServer] = None
+        self.__hosts: set[FrameBatcher] = set()
+        self.__rooms: dict[str, FrameBatcher] = {}
+        self.__room_users: dict[str, set[str]] = {}
+        self.__users: dict[str, str] = {}
+        self.__user_index: PresenceIndex = PresenceIndex()
+
+
+    def __open_room(self, host: FrameBatcher, servername: str) -> None:
+        self.__close_room(servername)
+        self.__rooms[servername] = host
+        self.__room_users[servername] = set()
+
+
+    def __close_room(self, servername: str) -> None:
+        self.__rooms.pop(servername, None)
+        for username in self.__room_users.pop(servername, ()):
+            if self.__users.get(username) == servername:
+                self.__forget_user(username)
+
+
+    def __join(self, servername: str, username: str) -> None:
+        if servername in self.__room_users:
+            self.__room_users[servername].add(username)
+            if username in self.__users:
+                self.__forget_user(username)
+            self.__users[username] = servername
+            self.__user_index.add(f"{servername}\0{username}")
+
+
+    def __leave(self, servername: str, username: str) -> None:
+        self.__room_users.get(servername, set()).discard(username)
+        if self.__users.get(username) == servername:
+            self.__forget_user(username)
+
+
+    def __forget_user(self, username: str) -> None:
+        self.__user_index.discard(f"{self.__users.pop(username)}\0{username}")
+
+
+    def __whisper(self, host: FrameBatcher, request_id: int, sender: str, receiver: str, message: str) -> None:
+        target = self.__rooms.get(self.__users.get(receiver, ""))
+        if target is not None:
+            target.add(["whisper", sender, receiver, message])
+        host.add(["reply", request_id, target is not None])
+
+
+    def __broadcast(self, host: FrameBatcher, origin: str, target: str, text: str) -> None:
+        if target == BROADCAST_ALL:
+            targets = self.__hosts - {host}
+        else:
+            targets = {self.__rooms[target]} - {host} if target in self.__rooms else set()
+        for batcher in targets:
+            batcher.add(["broadcast", origin, target, text])
+
+
+    def __presence(self, host: FrameBatcher, request_id: int, offset: int, limit: int) -> None:
+        keys, total = self.__user_index.page("", offset, limit)
+        host.add(["reply", request_id, [[key.split("\0", 1) for key in keys], total]])
+
+
+    def __dispatch(self, host: FrameBatcher, rooms: set[str], kind: str, *args: Any) -> None:
+        federation_messages.labels(kind).inc()
+        if kind == "room":
+            rooms.add(args[0])
+            self.__open_room(host, args[0])
+        elif kind == "room_closed":
+            rooms.discard(args[0])
+            if self.__rooms.get(args[0]) is host:
+                self.__close_room(args[0])
+        elif kind == "join":
+            self.__join(*args)
+        elif kind == "leave":
+            self.__leave(*args)
+        elif kind == "whisper":
+            self.__whisper(host, *args)
+        elif kind == "broadcast":
+            self.__broadcast(host, *args)
+        elif kind == "presence":
+            self.__presence(host, *args)
+        else:
+            log.warning("Неизвестное сообщение шины серверов: %s", kind)
+
+
+    async def __serve_connection(self, connection: FramedConnection) -> None:
+        host = FrameBatcher(connection)
+        rooms: set[str] = set()
+        self.__hosts.add(host)
+        try:
+            while (frame := await connection.recv_frame()) is not None:
+                federation_frames.inc()
+                try:
+                    for message in json.loads(frame[1]):
+                        self.__dispatch(host, rooms, *message)
+                except (ValueError, TypeError) as e:
+                    log.error("Некорректный пакет шины серверов: %s", e)
+                    connection.close()
+                    break
+        finally:
+            self.__hosts.discard(host)
+            for servername in rooms:
+                if self.__rooms.get(servername) is host:
+                    self.__close_room(servername)
+
+
+    async def start(self) -> None:
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        loop = asyncio.get_event_loop()
+        self.__server = await loop.create_unix_server(lambda: FramedConnection(self.__serve_connection), self.path)
+
+
+    async def close(self) -> None:
+        if self.__server is not None:
+            self.__server.close()
+            await self.__server.wait_closed()
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+
+class FederationClient:
+    def __init__(self, path: str, timeout: float = 5, reconnect_interval: float = 1) -> None:
+        self.__path: str = path
+        self.__timeout: float = timeout
+        self.__reconnect_interval: float = reconnect_interval
+        self.__rooms: dict[str, Any] = {}
+        self.__users: dict[str, str] = {}
+        self.__connection: Optional[FramedConnection] = None
+        self.__batcher: Optional[FrameBatcher] = None
+        self.__reconnect_task: Optional[asyncio.Task] = None
+        self.__pending: dict[int, asyncio.Future] = {}
+        self.__next_request_id: int = 0
+        self.__closed: bool = False
+
+
+    async def __connect(self) -> bool:
+        loop = asyncio.get_event_loop()
+        try:
+            _, connection = await loop.create_unix_connection(FramedConnection, self.__path)
+        except OSError as e:
+            log.warning("Не удалось подключиться к шине серверов %s: %s", self.__path, e)
+            return False
+        self.__connection = connection
+        self.__batcher = FrameBatcher(connection)
+        for servername in self.__rooms:
+            self.__batcher.add(["room", servername])
+        for username, servername in self.__users.items():
+            self.__batcher.add(["join", servername, username])
+        asyncio.create_task(self.__read(connection))
+        return True
+
+
+    async def __reconnect(self) -> None:
+        while not self.__closed and not await self.__connect():
+            await asyncio.sleep(self.__reconnect_interval)
+
+
+    async def __read(self, connection: FramedConnection) -> None:
+        while (frame := await connection.recv_frame()) is not None:
+            for kind, *args in json.loads(frame[1]):
+                if kind == "reply":
+                    future = self.__pending.pop(args[0], None)
+                    if future is not None and not future.done():
+                        future.set_result(args[1])
+                elif kind == "whisper":
+                    self.__deliver_whisper(*args)
+                elif kind == "broadcast":
+                    self.__deliver_broadcast(*args)
+        self.__connection = self.__batcher = None
+        for future in self.__pending.values():
+            if not future.done():
+                future.set_exception(ConnectionError("Соединение с шиной серверов разорвано"))
+        self.__pending.clear()
+        if not self.__closed:
+            self.__reconnect_task = asyncio.create_task(self.__reconnect())
+
+
+    def __send(self, message: list[Any]) -> None:
+        if self.__batcher is not None:
+            self.__batcher.add(message)
+
+
+    async def __request(self, kind: str, *args: Any) -> Any:
+        if self.__batcher is None:
+            raise ConnectionError("Нет соединения с шиной серверов")
+        request_id = self.__next_request_id
+        self.__next_request_id += 1
+        future = asyncio.get_event_loop().create_future()
+        self.__pending[request_id] = future
+        self.__batcher.add([kind, request_id, *args])
+        try:
+            return await asyncio.wait_for(future, self.__timeout)
+        finally:
+            self.__pending.pop(request_id, None)
+
+
+    def __deliver_whisper(self, sender: str, receiver: str, message: str) -> bool:
+        room = self.__rooms.get(self.__users.get(receiver, ""))
+        return room is not None and room.deliver_whisper(sender, receiver, message)
+
+
+    def __deliver_broadcast(self, origin: str, target: str, text: str) -> None:
+        for servername, room in self.__rooms.items():
+            if servername != origin and target in (BROADCAST_ALL, servername):
+                room.deliver_broadcast(text)
+
+
+    def register(self, servername: str, room: Any) -> None:
+        self.__rooms[servername] = room
+        self.__send(["room", servername])
+
+
+    def unregister(self, servername: str) -> None:
+        self.__rooms.pop(servername, None)
+        for username in [username for username, room in self.__users.items() if room == servername]:
+            del self.__users[username]
+        self.__send(["room_closed", servername])
+
+
+    def join(self, servername: str, username: str) -> None:
+        self.__users[username] = servername
+        self.__send(["join", servername, username])
+
+
+    def leave(self, servername: str, username: str) -> None:
+        if self.__users.get(username) == servername:
+            del self.__users[username]
+        self.__send(["leave", servername, username])
+
+
+    async def whisper(self, sender: str, receiver: str, message: str) -> bool:
+        if receiver in self.__users:
+            return self.__deliver_whisper(sender, receiver, message)
+        try:
+            return await self.__request("whisper", sender, receiver, message)
+        except (ConnectionError, TimeoutError):
+            return False
+
+
+    def broadcast(self, origin: str, target: str, text: str) -> None:
+        self.__deliver_broadcast(origin, target, text)
+        if target == BROADCAST_ALL or target not in self.__rooms:
+            self.__send(["broadcast", origin, target, text])
+
+
+    async def presence(self, offset: int, limit: int) -> tuple[list[tuple[str, str]], int]:
+        try:
+            users, total = await self.__request("presence", offset, limit)
+        except (ConnectionError, TimeoutError):
+            users = sorted((servername, username) for username, servername in self.__users.items())
+            users, total = users[offset:offset + limit], len(users)
+        return [(servername, username) for servername, username in users], total
+
+
+    async def open(self) -> None:
+        if not await self.__connect():
+            self.__reconnect_task = asyncio.create_task(self.__reconnect())
+
+
+    async def close(self) -> None:
+        self.__closed = True
+        if self.__reconnect_task is not None:
+            self.__reconnect_task.cancel()
+        if self.__connection is not None:
+            self.__connection.close()
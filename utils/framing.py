@@ -0,0 +1,86 @@
+import struct
+
+
+PROTOCOL_VERSION: int = 1
+
+FRAME_TEXT: int = 1
+FRAME_CONTROL: int = 2
+FRAME_PING: int = 3
+FRAME_PONG: int = 4
+
+FRAME_HEADER: struct.Struct = struct.Struct("!BBI")
+MAX_FRAME_SIZE: int = 1 << 20
+
+
+class FrameError(ValueError):
+    pass
+
+
+def encode_frame(payload: bytes, frame_type: int = FRAME_TEXT) -> bytes:
+    if len(payload) > MAX_FRAME_SIZE:
+        raise FrameError(f"frame is too large: {len(payload)} > {MAX_FRAME_SIZE}")
+    return FRAME_HEADER.pack(PROTOCOL_VERSION, frame_type, len(payload)) + payload
+
+
+class FrameParser:
+    def __init__(self, initial_size: int = 4096, max_frame_size: int = MAX_FRAME_SIZE) -> None:
+        self.__initial_size: int = initial_size
+        self.__max_frame_size: int = max_frame_size
+        self.__buffer: bytearray = bytearray(initial_size)
+        self.__start: int = 0
+        self.__end: int = 0
+
+
+    def __pending_frame_size(self) -> int:
+        if self.__end - self.__start < FRAME_HEADER.size:
+            return FRAME_HEADER.size
+        _, _, length = FRAME_HEADER.unpack_from(self.__buffer, self.__start)
+        return FRAME_HEADER.size + length
+
+
+    def __reserve(self, size: int) -> None:
+        if len(self.__buffer) - self.__end >= size:
+            return
+        pending = self.__end - self.__start
+        if self.__start:
+            self.__buffer[:pending] = self.__buffer[self.__start:self.__end]
+            self.__start, self.__end = 0, pending
+        if len(self.__buffer) - self.__end < size:
+            self.__buffer.extend(bytes(max(pending + size, 2 * len(self.__buffer)) - len(self.__buffer)))
+
+
+    def get_buffer(self, size_hint: int = -1) -> memoryview:
+        missing = self.__pending_frame_size() - (self.__end - self.__start)
+        self.__reserve(max(size_hint, missing, self.__initial_size // 4))
+        return memoryview(self.__buffer)[self.__end:]
+
+
+    def buffer_updated(self, nbytes: int) -> list[tuple[int, bytes]]:
+        self.__end += nbytes
+        frames: list[tuple[int, bytes]] = []
+        while self.__end - self.__start >= FRAME_HEADER.size:
+            version, frame_type, length = FRAME_HEADER.unpack_from(self.__buffer, self.__start)
+            if version != PROTOCOL_VERSION:
+                raise FrameError(f"unsupported protocol version: {version}")
+            if length > self.__max_frame_size:
+                raise FrameError(f"frame is too large: {length} > {self.__max_frame_size}")
+            frame_end = self.__start + FRAME_HEADER.size + length
+            if frame_end > self.__end:
+                break
+            frames.append((frame_type, bytes(self.__buffer[self.__start + FRAME_HEADER.size:frame_end])))
+            self.__start = frame_end
+
+        if self.__start == self.__end:
+            self.__start = self.__end = 0
+            if len(self.__buffer) > 4 * self.__initial_size:
+                self.__buffer = bytearray(self.__initial_size)
+        return frames
+
+
+    def unconsumed(self) -> bytes:
+        return bytes(self.__buffer[self.__start:self.__end])
+
+
+    def feed(self, data: bytes) -> list[tuple[int, bytes]]:
+        self.get_buffer(len(data))[:len(data)] = data
+        return self.buffer_updated(len(data))
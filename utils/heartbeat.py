@@ -0,0 +1,76 @@
+import asyncio
+from typing import Callable, Optional
+from utils.metrics import metrics
+from utils.timer_wheel import Timer, TimerWheel, get_timer_wheel
+from utils.transport import FramedConnection
+
+
+connection_timeouts = metrics.counter("connection_timeouts_total", "Connections closed by a deadline", ("reason",))
+
+
+def deadline(timeout: Optional[float], connection: FramedConnection, reason: str,
+             wheel: Optional[TimerWheel] = None) -> Optional[Timer]:
+    if timeout is None:
+        return None
+
+    def expire() -> None:
+        connection_timeouts.labels(reason).inc()
+        connection.abort(reason)
+
+    return (wheel or get_timer_wheel()).schedule(timeout, expire)
+
+
+class ConnectionWatchdog:
+    def __init__(self, connection: FramedConnection, idle_timeout: Optional[float] = None,
+                 heartbeat_interval: Optional[float] = None, heartbeat_timeout: float = 10,
+                 on_expire: Optional[Callable[[str], None]] = None, wheel: Optional[TimerWheel] = None) -> None:
+        self.__connection: FramedConnection = connection
+        self.__idle_timeout: Optional[float] = idle_timeout
+        self.__heartbeat_interval: Optional[float] = heartbeat_interval
+        self.__heartbeat_timeout: float = heartbeat_timeout
+        self.__on_expire: Callable[[str], None] = on_expire or connection.abort
+        self.__wheel: TimerWheel = wheel or get_timer_wheel()
+        self.__loop: asyncio.AbstractEventLoop = asyncio.get_event_loop()
+        self.__timer: Optional[Timer] = None
+        self.__ping_sent_at: Optional[float] = None
+        self.__check()
+
+
+    def __check(self) -> None:
+        now = self.__loop.time()
+        delays: list[float] = []
+        if self.__idle_timeout is not None:
+            idle = now - self.__connection.last_message
+            if idle >= self.__idle_timeout:
+                self.__expire("idle")
+                return
+            delays.append(self.__idle_timeout - idle)
+        if self.__heartbeat_interval is not None:
+            if self.__ping_sent_at is not None and self.__connection.last_received > self.__ping_sent_at:
+                self.__ping_sent_at = None
+            silent = now - self.__connection.last_received
+            if silent < self.__heartbeat_interval:
+                delays.append(self.__heartbeat_interval - silent)
+            elif self.__ping_sent_at is None:
+                self.__ping_sent_at = now
+                self.__connection.ping()
+                delays.append(self.__heartbeat_timeout)
+            elif now - self.__ping_sent_at >= self.__heartbeat_timeout:
+                self.__expire("heartbeat")
+                return
+            else:
+                delays.append(self.__ping_sent_at + self.__heartbeat_timeout - now)
+        if delays:
+            self.__timer = self.__wheel.schedule(min(delays), self.__check)
+
+
+    def __expire(self, reason: str) -> None:
+        self.__timer = None
+        connection_timeouts.labels(reason).inc()
+        self.__on_expire(reason)
+
+
+    def cancel(self) -> None:
+        if self.__timer is not None:
+            self.__timer.cancel()
+            self.__timer = None
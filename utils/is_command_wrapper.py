@@ -1,12 +1,100 @@
-from functools import wraps
-from typing import Callable, Any
+import re
+import time
+from typing import Any, Awaitable, Callable, Optional
+from utils.metrics import metrics
 
 
-def command(command_name: str) -> Callable:
+command_duration = metrics.histogram("chat_command_duration_seconds", "Time spent in @command handlers",
+                                     ("command",))
+
+_TOKEN = re.compile(rb"\S+")
+_SPACE = re.compile(rb"\s*")
+_WHITESPACE = frozenset(b" \t\r\n\x0b\x0c")
+_SLASH = ord("/")
+
+
+class CommandSpec:
+    __slots__ = ("name", "args", "required", "body")
+
+    def __init__(self, name: str, args: tuple[str, ...], required: int, body: Optional[str]) -> None:
+        self.name: str = name
+        self.args: tuple[str, ...] = args
+        self.required: int = required
+        self.body: Optional[str] = body
+
+
+    @property
+    def usage(self) -> str:
+        parts = [self.name] + [f"<{arg}>" if index < self.required else f"[{arg}]"
+                               for index, arg in enumerate(self.args)]
+        if self.body is not None:
+            parts.append(f"<{self.body}>")
+        return " ".join(parts)
+
+
+class CommandUsageError(ValueError):
+    def __init__(self, spec: CommandSpec) -> None:
+        super().__init__(f"Использование: {spec.usage}")
+        self.spec: CommandSpec = spec
+
+
+def command(command_name: str, *args: str, required: Optional[int] = None, body: Optional[str] = None) -> Callable:
+    if body is not None and required not in (None, len(args)):
+        raise ValueError(f"Command {command_name} with a body cannot have optional arguments")
+
     def decorator(func: Callable) -> Callable:
-        func.command_name = command_name
-        @wraps(func)
-        def wrapper(*args: Any, **kwargs: Any) -> Any:
-            return func(*args, **kwargs)
-        return wrapper
+        func.command_spec = CommandSpec(command_name, args, len(args) if required is None else required, body)
+        return func
     return decorator
+
+
+class CommandRouter:
+    def __init__(self, owner: object) -> None:
+        self.__routes: dict[bytes, tuple[CommandSpec, Callable[..., Awaitable[Any]], Any]] = {}
+        for attribute in dir(owner):
+            handler = getattr(owner, attribute)
+            spec = getattr(handler, "command_spec", None)
+            if isinstance(spec, CommandSpec):
+                self.__routes[spec.name.encode("utf-8")] = spec, handler, command_duration.labels(spec.name)
+
+
+    @property
+    def usages(self) -> list[str]:
+        return [spec.usage for spec, _, _ in self.__routes.values()]
+
+
+    async def dispatch(self, frame: bytes, *context: Any) -> bool:
+        token = _TOKEN.search(frame)
+        if token is None or frame[token.start()] != _SLASH:
+            return False
+        view = memoryview(frame)
+        route = self.__routes.get(view[token.start():token.end()])
+        if route is None:
+            return False
+        spec, handler, duration = route
+
+        args: list[Any] = []
+        position = token.end()
+        for _ in spec.args:
+            token = _TOKEN.search(frame, position)
+            if token is None:
+                break
+            try:
+                args.append(str(view[token.start():token.end()], "utf-8"))
+            except UnicodeDecodeError:
+                raise CommandUsageError(spec)
+            position = token.end()
+        start, end = _SPACE.match(frame, position).end(), len(frame)
+        while end > start and frame[end - 1] in _WHITESPACE:
+            end -= 1
+        if len(args) < spec.required or (spec.body is None and start < end):
+            raise CommandUsageError(spec)
+        if spec.body is not None:
+            args.append(view[start:end])
+
+        started = time.perf_counter()
+        try:
+            await handler(*context, *args)
+        finally:
+            duration.observe(time.perf_counter() - started)
+        return True
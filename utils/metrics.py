@@ -0,0 +1,360 @@
+import asyncio
+import time
+from abc import ABC, abstractmethod
+from bisect import bisect_left
+from typing import Any, Awaitable, Callable, Optional
+from utils.structured_logging import get_logger
+
+
+log = get_logger(__name__)
+
+
+DEFAULT_BUCKETS: tuple[float, ...] = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                                      0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+FANOUT_BUCKETS: tuple[float, ...] = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+
+class _Timer:
+    def __init__(self, histogram: "_HistogramChild") -> None:
+        self.__histogram: _HistogramChild = histogram
+        self.__started: float = 0.0
+
+
+    def __enter__(self) -> "_Timer":
+        self.__started = time.perf_counter()
+        return self
+
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.__histogram.observe(time.perf_counter() - self.__started)
+
+
+class _CounterChild:
+    def __init__(self) -> None:
+        self.value: float = 0
+
+
+    def inc(self, amount: float = 1) -> None:
+        self.value += amount
+
+
+    def collect(self) -> float:
+        return self.value
+
+
+class _GaugeChild:
+    def __init__(self) -> None:
+        self.value: float = 0
+        self.__function: Optional[Callable[[], float]] = None
+
+
+    def set(self, value: float) -> None:
+        self.value = value
+
+
+    def inc(self, amount: float = 1) -> None:
+        self.value += amount
+
+
+    def dec(self, amount: float = 1) -> None:
+        self.value -= amount
+
+
+    def set_function(self, function: Callable[[], float]) -> None:
+        self.__function = function
+
+
+    def collect(self) -> float:
+        return self.value if self.__function is None else self.__function()
+
+
+class _HistogramChild:
+    def __init__(self, buckets: tuple[float, ...]) -> None:
+        self.__buckets: tuple[float, ...] = buckets
+        self.counts: list[int] = [0] * (len(buckets) + 1)
+        self.sum: float = 0.0
+
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.__buckets, value)] += 1
+        self.sum += value
+
+
+    def time(self) -> _Timer:
+        return _Timer(self)
+
+
+    def collect(self) -> dict[str, Any]:
+        return {"counts": list(self.counts), "sum": self.sum}
+
+
+class Metric(ABC):
+    kind: str = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = (),
+                 aggregate: str = "sum") -> None:
+        self.name: str = name
+        self.documentation: str = documentation
+        self.labelnames: tuple[str, ...] = labelnames
+        self.aggregate: str = aggregate
+        self.__children: dict[tuple[str, ...], Any] = {}
+
+
+    @abstractmethod
+    def _new_child(self) -> Any:
+        pass
+
+
+    def labels(self, *labelvalues: Any) -> Any:
+        if len(labelvalues) != len(self.labelnames):
+            raise ValueError(f"metric {self.name} expects labels {self.labelnames}")
+        key = tuple(str(value) for value in labelvalues)
+        child = self.__children.get(key)
+        if child is None:
+            child = self.__children[key] = self._new_child()
+        return child
+
+
+    def remove(self, *labelvalues: Any) -> None:
+        self.__children.pop(tuple(str(value) for value in labelvalues), None)
+
+
+    def clear(self) -> None:
+        self.__children.clear()
+
+
+    def snapshot(self) -> dict[str, Any]:
+        return {
+            "name": self.name,
+            "kind": self.kind,
+            "documentation": self.documentation,
+            "labelnames": list(self.labelnames),
+            "aggregate": self.aggregate,
+            "samples": [[list(key), child.collect()] for key, child in list(self.__children.items())]
+        }
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def _new_child(self) -> _CounterChild:
+        return _CounterChild()
+
+
+    def inc(self, amount: float = 1) -> None:
+        self.labels().inc(amount)
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def _new_child(self) -> _GaugeChild:
+        return _GaugeChild()
+
+
+    def set(self, value: float) -> None:
+        self.labels().set(value)
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = (),
+                 buckets: tuple[float, ...] = DEFAULT_BUCKETS) -> None:
+        super().__init__(name, documentation, labelnames)
+        self.buckets: tuple[float, ...] = tuple(sorted(buckets))
+
+
+    def _new_child(self) -> _HistogramChild:
+        return _HistogramChild(self.buckets)
+
+
+    def observe(self, value: float) -> None:
+        self.labels().observe(value)
+
+
+    def snapshot(self) -> dict[str, Any]:
+        return super().snapshot() | {"buckets": list(self.buckets)}
+
+
+class MetricsRegistry:
+    def __init__(self) -> None:
+        self.__metrics: dict[str, Metric] = {}
+
+
+    def __register(self, metric: Metric) -> Any:
+        existing = self.__metrics.get(metric.name)
+        if existing is not None:
+            if existing.kind != metric.kind or existing.labelnames != metric.labelnames:
+                raise ValueError(f"metric {metric.name} is already registered with another type or labels")
+            return existing
+        self.__metrics[metric.name] = metric
+        return metric
+
+
+    def counter(self, name: str, documentation: str, labelnames: tuple[str, ...] = ()) -> Counter:
+        return self.__register(Counter(name, documentation, labelnames))
+
+
+    def gauge(self, name: str, documentation: str, labelnames: tuple[str, ...] = (),
+              aggregate: str = "sum") -> Gauge:
+        return self.__register(Gauge(name, documentation, labelnames, aggregate))
+
+
+    def histogram(self, name: str, documentation: str, labelnames: tuple[str, ...] = (),
+                  buckets: tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+        return self.__register(Histogram(name, documentation, labelnames, buckets))
+
+
+    def snapshot(self) -> list[dict[str, Any]]:
+        return [metric.snapshot() for metric in self.__metrics.values()]
+
+
+    def render(self) -> str:
+        return render_metrics(self.snapshot())
+
+
+    def reset(self) -> None:
+        for metric in self.__metrics.values():
+            metric.clear()
+
+
+metrics: MetricsRegistry = MetricsRegistry()
+
+
+def label_snapshot(snapshot: list[dict[str, Any]], labelname: str, labelvalue: str) -> list[dict[str, Any]]:
+    return [metric | {"labelnames": [labelname] + metric["labelnames"],
+                      "samples": [[[labelvalue] + key, value] for key, value in metric["samples"]]}
+            for metric in snapshot]
+
+
+def merge_snapshots(snapshots: list[list[dict[str, Any]]]) -> list[dict[str, Any]]:
+    merged: dict[str, dict[str, Any]] = {}
+    samples: dict[str, dict[tuple[str, ...], Any]] = {}
+    for snapshot in snapshots:
+        for metric in snapshot:
+            name = metric["name"]
+            if name not in merged:
+                merged[name] = metric
+                samples[name] = {}
+            elif merged[name]["labelnames"] != metric["labelnames"]:
+                continue
+            series = samples[name]
+            for key, value in metric["samples"]:
+                key = tuple(key)
+                previous = series.get(key)
+                if previous is None:
+                    series[key] = value
+                elif metric["kind"] == "histogram":
+                    series[key] = {"counts": [a + b for a, b in zip(previous["counts"], value["counts"])],
+                                   "sum": previous["sum"] + value["sum"]}
+                elif metric["aggregate"] == "max":
+                    series[key] = max(previous, value)
+                else:
+                    series[key] = previous + value
+    return [metric | {"samples": [[list(key), value] for key, value in samples[name].items()]}
+            for name, metric in merged.items()]
+
+
+def _escape_label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labelnames: list[str], labelvalues: list[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape_label(value)}"' for name, value in zip(labelnames, labelvalues)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render_metrics(snapshot: list[dict[str, Any]]) -> str:
+    lines: list[str] = []
+    for metric in snapshot:
+        name = metric["name"]
+        lines.append(f"# HELP {name} {metric['documentation']}")
+        lines.append(f"# TYPE {name} {metric['kind']}")
+        for labelvalues, value in metric["samples"]:
+            if metric["kind"] != "histogram":
+                lines.append(f"{name}{_format_labels(metric['labelnames'], labelvalues)} {_format_value(value)}")
+                continue
+            cumulative = 0
+            for bound, count in zip(metric["buckets"] + [float("inf")], value["counts"]):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{name}_bucket{_format_labels(metric['labelnames'], labelvalues, le)} {cumulative}")
+            labels = _format_labels(metric["labelnames"], labelvalues)
+            lines.append(f"{name}_sum{labels} {_format_value(value['sum'])}")
+            lines.append(f"{name}_count{labels} {cumulative}")
+    return "\n".join(lines) + "\n"
+
+
+event_loop_lag = metrics.histogram("event_loop_lag_seconds", "Delay of event loop callbacks behind schedule")
+event_loop_lag_max = metrics.gauge("event_loop_lag_max_seconds",
+                                   "Largest event loop lag seen during the last interval", aggregate="max")
+
+
+async def monitor_event_loop_lag(interval: float = 0.5) -> None:
+    loop = asyncio.get_event_loop()
+    window_started, window_max = loop.time(), 0.0
+    while True:
+        scheduled = loop.time() + interval
+        await asyncio.sleep(interval)
+        lag = max(0.0, loop.time() - scheduled)
+        event_loop_lag.observe(lag)
+        window_max = max(window_max, lag)
+        if loop.time() - window_started >= 10 * interval:
+            event_loop_lag_max.set(window_max)
+            window_started, window_max = loop.time(), 0.0
+
+
+class MetricsEndpoint:
+    def __init__(self, render: Callable[[str], Awaitable[Optional[str]]], host: str = "127.0.0.1",
+                 port: int = 9090) -> None:
+        self.__render: Callable[[str], Awaitable[Optional[str]]] = render
+        self._addr: tuple[str, int] = host, port
+        self.__server: Optional[asyncio.Server] = None
+
+
+    @property
+    def port(self) -> Optional[int]:
+        if self.__server is None or not self.__server.sockets:
+            return None
+        return self.__server.sockets[0].getsockname()[1]
+
+
+    async def __handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            request_line = (await asyncio.wait_for(reader.readline(), 5)).decode("latin-1").split()
+            while (await asyncio.wait_for(reader.readline(), 5)) not in (b"\r\n", b"\n", b""):
+                pass
+            body = None
+            if len(request_line) >= 2 and request_line[0] == "GET":
+                body = await self.__render(request_line[1].split("?")[0])
+            if body is None:
+                status, payload = "404 Not Found", b"not found\n"
+            else:
+                status, payload = "200 OK", body.encode("utf-8")
+            writer.write(f"HTTP/1.1 {status}\r\n"
+                         f"Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+                         f"Content-Length: {len(payload)}\r\n"
+                         f"Connection: close\r\n\r\n".encode("latin-1") + payload)
+            await writer.drain()
+        except Exception as e:
+            log.warning("Произошла ошибка %s при попытке отдать метрики", e)
+        finally:
+            writer.close()
+
+
+    async def start(self) -> None:
+        self.__server = await asyncio.start_server(self.__handle, *self._addr)
+
+
+    def close(self) -> None:
+        if self.__server is not None:
+            self.__server.close()
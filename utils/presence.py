@@ -0,0 +1,76 @@
+import asyncio
+from bisect import bisect_left
+from typing import Callable, Optional
+
+
+class PresenceIndex:
+    def __init__(self) -> None:
+        self.__names: list[str] = []
+
+
+    def __len__(self) -> int:
+        return len(self.__names)
+
+
+    def __contains__(self, name: str) -> bool:
+        index = bisect_left(self.__names, name)
+        return index < len(self.__names) and self.__names[index] == name
+
+
+    def add(self, name: str) -> None:
+        index = bisect_left(self.__names, name)
+        if index == len(self.__names) or self.__names[index] != name:
+            self.__names.insert(index, name)
+
+
+    def discard(self, name: str) -> None:
+        index = bisect_left(self.__names, name)
+        if index < len(self.__names) and self.__names[index] == name:
+            del self.__names[index]
+
+
+    def page(self, prefix: str = "", offset: int = 0, limit: int = 50) -> tuple[list[str], int]:
+        start = bisect_left(self.__names, prefix)
+        end = bisect_left(self.__names, prefix + "\U0010ffff", start) if prefix else len(self.__names)
+        return self.__names[start + offset:min(end, start + offset + limit)], end - start
+
+
+class PresenceNotifier:
+    def __init__(self, publish: Callable[[list[str], list[str]], None], interval: float = 0.25) -> None:
+        self.__publish: Callable[[list[str], list[str]], None] = publish
+        self.__interval: float = interval
+        self.__joined: dict[str, None] = {}
+        self.__left: dict[str, None] = {}
+        self.__flush_handle: Optional[asyncio.TimerHandle] = None
+
+
+    def __schedule(self) -> None:
+        if self.__flush_handle is None:
+            self.__flush_handle = asyncio.get_event_loop().call_later(self.__interval, self.flush)
+
+
+    def joined(self, name: str) -> None:
+        if name in self.__left:
+            del self.__left[name]
+            return
+        self.__joined[name] = None
+        self.__schedule()
+
+
+    def left(self, name: str) -> None:
+        if name in self.__joined:
+            del self.__joined[name]
+            return
+        self.__left[name] = None
+        self.__schedule()
+
+
+    def flush(self) -> None:
+        if self.__flush_handle is not None:
+            self.__flush_handle.cancel()
+            self.__flush_handle = None
+        joined, left = list(self.__joined), list(self.__left)
+        self.__joined.clear()
+        self.__left.clear()
+        if joined or left:
+            self.__publish(joined, left)
@@ -0,0 +1,50 @@
+import time
+from typing import Hashable, Optional
+
+
+class RateLimiter:
+    def __init__(self, rate: float, burst: float, max_keys: int = 65536) -> None:
+        self.rate: float = rate
+        self.burst: float = burst
+        self.__max_keys: int = max_keys
+        self.__buckets: dict[Hashable, tuple[float, float]] = {}
+
+
+    def __len__(self) -> int:
+        return len(self.__buckets)
+
+
+    def __prune(self, now: float) -> None:
+        refill = self.burst / self.rate
+        excess = len(self.__buckets) - self.__max_keys + 1
+        expired = []
+        for key, (_, updated) in self.__buckets.items():
+            if len(expired) >= excess and now - updated < refill:
+                break
+            expired.append(key)
+        for key in expired:
+            del self.__buckets[key]
+
+
+    def allow(self, key: Hashable, cost: float = 1.0, now: Optional[float] = None) -> bool:
+        return self.reserve(key, cost, 0.0, now) is not None
+
+
+    def reserve(self, key: Hashable, cost: float = 1.0, max_delay: float = 0.0,
+                now: Optional[float] = None) -> Optional[float]:
+        now = time.monotonic() if now is None else now
+        bucket = self.__buckets.pop(key, None)
+        if bucket is None and len(self.__buckets) >= self.__max_keys:
+            self.__prune(now)
+        delay, self.__buckets[key] = self.consume(bucket, cost, max_delay, now)
+        return delay
+
+
+    def consume(self, bucket: Optional[tuple[float, float]], cost: float = 1.0, max_delay: float = 0.0,
+                now: Optional[float] = None) -> tuple[Optional[float], tuple[float, float]]:
+        now = time.monotonic() if now is None else now
+        tokens = self.burst if bucket is None else min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+        delay = max(0.0, (cost - tokens) / self.rate)
+        if delay > max_delay:
+            return None, (tokens, now)
+        return delay, (tokens - cost, now)
@@ -0,0 +1,68 @@
+import asyncio
+from collections import deque
+from typing import Callable
+from utils.transport import FramedConnection
+
+
+MAX_FRAMES_PER_WRITE: int = 512
+
+
+class SendQueue:
+    def __init__(self, connection: FramedConnection, high_water: int, on_evict: Callable[[], None]) -> None:
+        self.__connection: FramedConnection = connection
+        self.__high_water: int = high_water
+        self.__on_evict: Callable[[], None] = on_evict
+        self.__frames: deque[bytes] = deque()
+        self.__wakeup: asyncio.Event = asyncio.Event()
+        self.__flushed: asyncio.Event = asyncio.Event()
+        self.__flushed.set()
+        self.__closed: bool = False
+        self.__writer_task: asyncio.Task = asyncio.create_task(self.__writer())
+
+
+    def __len__(self) -> int:
+        return len(self.__frames)
+
+
+    def put(self, frame: bytes) -> bool:
+        if self.__closed:
+            return False
+        if len(self.__frames) >= self.__high_water:
+            self.__evict()
+            return False
+        self.__frames.append(frame)
+        self.__flushed.clear()
+        self.__wakeup.set()
+        return True
+
+
+    async def __writer(self) -> None:
+        while not self.__closed:
+            await self.__wakeup.wait()
+            self.__wakeup.clear()
+            while self.__frames:
+                batch = [self.__frames.popleft() for _ in range(min(len(self.__frames), MAX_FRAMES_PER_WRITE))]
+                try:
+                    await self.__connection.send_frames(batch)
+                except Exception:
+                    self.__evict()
+                    return
+            self.__flushed.set()
+
+
+    def __evict(self) -> None:
+        if not self.__closed:
+            self.close()
+            self.__on_evict()
+
+
+    async def flush(self) -> None:
+        await self.__flushed.wait()
+
+
+    def close(self) -> None:
+        self.__closed = True
+        self.__frames.clear()
+        self.__flushed.set()
+        if self.__writer_task is not asyncio.current_task():
+            self.__writer_task.cancel()
@@ -0,0 +1,70 @@
+import sys
+from typing import Iterator, Optional
+from utils.heartbeat import ConnectionWatchdog
+from utils.send_queue import SendQueue
+from utils.transport import FramedConnection
+
+
+class Session:
+    __slots__ = ("connection", "username", "name", "prefix", "send_queue", "watchdog", "bucket", "throttled",
+                 "connected_at", "announced")
+
+    def __init__(self, connection: FramedConnection, username: str, connected_at: float) -> None:
+        self.connection: FramedConnection = connection
+        self.username: str = sys.intern(username)
+        self.name: bytes = username.encode("utf-8")
+        self.prefix: bytes = self.name + b": "
+        self.send_queue: Optional[SendQueue] = None
+        self.watchdog: Optional[ConnectionWatchdog] = None
+        self.bucket: Optional[tuple[float, float]] = None
+        self.throttled: bool = False
+        self.connected_at: float = connected_at
+        self.announced: bool = False
+
+
+    def close(self) -> None:
+        if self.send_queue is not None:
+            self.send_queue.close()
+        if self.watchdog is not None:
+            self.watchdog.cancel()
+        self.connection.close()
+
+
+class SessionRegistry:
+    def __init__(self) -> None:
+        self.__sessions: dict[FramedConnection, Session] = {}
+        self.__by_username: dict[str, Session] = {}
+
+
+    def __len__(self) -> int:
+        return len(self.__sessions)
+
+
+    def __iter__(self) -> Iterator[Session]:
+        return iter(self.__sessions.values())
+
+
+    def __contains__(self, session: Session) -> bool:
+        return self.__sessions.get(session.connection) is session
+
+
+    def get(self, connection: FramedConnection) -> Optional[Session]:
+        return self.__sessions.get(connection)
+
+
+    def find(self, username: str) -> Optional[Session]:
+        return self.__by_username.get(username)
+
+
+    def add(self, session: Session) -> None:
+        self.__sessions[session.connection] = session
+        self.__by_username[session.username] = session
+
+
+    def remove(self, session: Session) -> bool:
+        if self.__sessions.get(session.connection) is not session:
+            return False
+        del self.__sessions[session.connection]
+        if self.__by_username.get(session.username) is session:
+            del self.__by_username[session.username]
+        return True
@@ -0,0 +1,132 @@
+import atexit
+import json
+import logging
+import os
+import queue
+import sys
+import time
+from logging.handlers import QueueHandler, QueueListener
+from typing import Any, Optional, TextIO
+
+
+_RECORD_ATTRIBUTES: frozenset[str] = frozenset(vars(logging.makeLogRecord({}))) | {"message", "asctime",
+                                                                                    "taskName"}
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry: dict[str, Any] = {
+            "ts": round(record.created, 6),
+            "level": record.levelname,
+            "logger": record.name,
+            "pid": record.process,
+            "msg": record.getMessage()
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES:
+                entry[key] = value if isinstance(value, (str, int, float, bool, type(None))) else str(value)
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class TextFormatter(logging.Formatter):
+    def __init__(self) -> None:
+        super().__init__("%(asctime)s %(levelname)s %(name)s[%(process)d]: %(message)s")
+
+
+    def format(self, record: logging.LogRecord) -> str:
+        line = super().format(record)
+        extra = {key: value for key, value in vars(record).items() if key not in _RECORD_ATTRIBUTES}
+        if extra:
+            line += " " + " ".join(f"{key}={value}" for key, value in extra.items())
+        return line
+
+
+class SamplingFilter(logging.Filter):
+    def __init__(self, window: float = 10.0, burst: int = 5, min_level: int = logging.WARNING) -> None:
+        super().__init__()
+        self.__window: float = window
+        self.__burst: int = burst
+        self.__min_level: int = min_level
+        self.__seen: dict[tuple[str, int, Any], list[float]] = {}
+
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno < self.__min_level:
+            return True
+        key = (record.name, record.levelno, record.msg)
+        now = time.monotonic()
+        state = self.__seen.get(key)
+        if state is None or now - state[0] >= self.__window:
+            if len(self.__seen) > 10000:
+                self.__seen.clear()
+            suppressed = 0 if state is None else int(state[2])
+            self.__seen[key] = [now, 1, 0]
+            if suppressed:
+                record.suppressed = suppressed
+            return True
+        state[1] += 1
+        if state[1] <= self.__burst:
+            return True
+        state[2] += 1
+        return False
+
+
+class _DeferredQueueHandler(QueueHandler):
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+class _LoggingState:
+    def __init__(self) -> None:
+        self.listener: Optional[QueueListener] = None
+        self.handler: Optional[QueueHandler] = None
+        self.stream_handler: Optional[logging.Handler] = None
+
+
+_state: _LoggingState = _LoggingState()
+
+
+def _start_listener() -> None:
+    records: queue.SimpleQueue = queue.SimpleQueue()
+    _state.handler.queue = records
+    _state.listener = QueueListener(records, _state.stream_handler, respect_handler_level=True)
+    _state.listener.start()
+
+
+def _restart_after_fork() -> None:
+    if _state.listener is not None:
+        _start_listener()
+
+
+def setup_logging(level: int | str = logging.INFO, json_output: bool = True, stream: TextIO = sys.stderr,
+                  sample_window: float = 10.0, sample_burst: int = 5) -> None:
+    stop_logging()
+    _state.stream_handler = logging.StreamHandler(stream)
+    _state.stream_handler.setFormatter(JsonFormatter() if json_output else TextFormatter())
+    _state.handler = _DeferredQueueHandler(queue.SimpleQueue())
+    _state.handler.addFilter(SamplingFilter(sample_window, sample_burst))
+    _start_listener()
+
+    root = logging.getLogger()
+    root.addHandler(_state.handler)
+    root.setLevel(level)
+
+
+def stop_logging() -> None:
+    if _state.listener is None:
+        return
+    logging.getLogger().removeHandler(_state.handler)
+    _state.listener.stop()
+    _state.listener = None
+
+
+def get_logger(name: str) -> logging.Logger:
+    if _state.listener is None and not logging.getLogger().handlers:
+        setup_logging()
+    return logging.getLogger(name)
+
+
+os.register_at_fork(after_in_child=_restart_after_fork)
+atexit.register(stop_logging)
@@ -0,0 +1,87 @@
+import asyncio
+import math
+from typing import Callable, Optional
+from utils.structured_logging import get_logger
+
+
+log = get_logger(__name__)
+
+
+class Timer:
+    __slots__ = ("wheel", "callback", "slot", "rounds")
+
+    def __init__(self, wheel: "TimerWheel", callback: Callable[[], None], slot: int, rounds: int) -> None:
+        self.wheel: Optional[TimerWheel] = wheel
+        self.callback: Callable[[], None] = callback
+        self.slot: int = slot
+        self.rounds: int = rounds
+
+
+    def cancel(self) -> None:
+        if self.wheel is not None:
+            self.wheel.cancel(self)
+
+
+class TimerWheel:
+    def __init__(self, tick: float = 0.1, slots: int = 512) -> None:
+        self.__loop: asyncio.AbstractEventLoop = asyncio.get_event_loop()
+        self.__tick: float = tick
+        self.__slots: list[set[Timer]] = [set() for _ in range(slots)]
+        self.__cursor: int = 0
+        self.__count: int = 0
+        self.__next_tick_at: float = 0.0
+        self.__handle: Optional[asyncio.TimerHandle] = None
+
+
+    def __len__(self) -> int:
+        return self.__count
+
+
+    def schedule(self, delay: float, callback: Callable[[], None]) -> Timer:
+        if self.__handle is None:
+            self.__next_tick_at = self.__loop.time() + self.__tick
+            self.__handle = self.__loop.call_at(self.__next_tick_at, self.__advance)
+        ticks = max(1, math.ceil(delay / self.__tick))
+        timer = Timer(self, callback, (self.__cursor + ticks) % len(self.__slots), (ticks - 1) // len(self.__slots))
+        self.__slots[timer.slot].add(timer)
+        self.__count += 1
+        return timer
+
+
+    def cancel(self, timer: Timer) -> None:
+        if timer.wheel is self:
+            self.__slots[timer.slot].discard(timer)
+            self.__count -= 1
+            timer.wheel = None
+
+
+    def __advance(self) -> None:
+        now = self.__loop.time()
+        while self.__next_tick_at <= now:
+            self.__cursor = (self.__cursor + 1) % len(self.__slots)
+            self.__next_tick_at += self.__tick
+            for timer in list(self.__slots[self.__cursor]):
+                if timer.wheel is not self:
+                    continue
+                if timer.rounds:
+                    timer.rounds -= 1
+                    continue
+                self.cancel(timer)
+                try:
+                    timer.callback()
+                except Exception as e:
+                    log.error("Произошла ошибка %s в обработчике таймера %s", e, timer.callback)
+        self.__handle = self.__loop.call_at(self.__next_tick_at, self.__advance) if self.__count else None
+
+
+_wheels: dict[asyncio.AbstractEventLoop, TimerWheel] = {}
+
+
+def get_timer_wheel() -> TimerWheel:
+    loop = asyncio.get_event_loop()
+    wheel = _wheels.get(loop)
+    if wheel is None:
+        for closed in [loop for loop in _wheels if loop.is_closed()]:
+            del _wheels[closed]
+        wheel = _wheels[loop] = TimerWheel()
+    return wheel
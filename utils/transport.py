@@ -0,0 +1,244 @@
+import asyncio
+import json
+import os
+import socket
+from collections import deque
+from typing import Any, Awaitable, Callable, Optional
+from utils.framing import (FRAME_CONTROL, FRAME_PING, FRAME_PONG, FRAME_TEXT, MAX_FRAME_SIZE, FrameError, FrameParser,
+                           encode_frame)
+
+
+MAX_PENDING_FRAMES: int = 256
+
+
+class FramedConnection(asyncio.BufferedProtocol):
+    def __init__(self, on_connected: Optional[Callable[["FramedConnection"], Awaitable[None]]] = None,
+                 initial_data: bytes = b"", admit: Optional[Callable[["FramedConnection"], bool]] = None) -> None:
+        self.__on_connected: Optional[Callable[["FramedConnection"], Awaitable[None]]] = on_connected
+        self.__admit: Optional[Callable[["FramedConnection"], bool]] = admit
+        self.__transport: Optional[asyncio.Transport] = None
+        self.__parser: FrameParser = FrameParser()
+        self.__frames: deque[tuple[int, bytes]] = deque()
+        self.__frame_waiter: Optional[asyncio.Future] = None
+        self.__drain_waiter: Optional[asyncio.Future] = None
+        self.__reading_paused: bool = False
+        self.__writing_paused: bool = False
+        self.__closed: bool = False
+        self.__initial_data: bytes = initial_data
+        self.__loop: Optional[asyncio.AbstractEventLoop] = None
+        self.handler_task: Optional[asyncio.Task] = None
+        self.expired: Optional[str] = None
+        self.last_received: float = 0.0
+        self.last_message: float = 0.0
+
+
+    def connection_made(self, transport: asyncio.BaseTransport) -> None:
+        self.__transport = transport
+        self.__loop = asyncio.get_event_loop()
+        self.last_received = self.last_message = self.__loop.time()
+        if self.__admit is not None and not self.__admit(self):
+            return
+        if self.__initial_data:
+            self.__accept_frames(self.__parser.feed(self.__initial_data))
+            self.__initial_data = b""
+        if self.__on_connected is not None:
+            self.handler_task = asyncio.create_task(self.__on_connected(self))
+
+
+    def get_buffer(self, sizehint: int) -> memoryview:
+        return self.__parser.get_buffer()
+
+
+    def __accept_frames(self, frames: list[tuple[int, bytes]]) -> bool:
+        accepted = False
+        for frame in frames:
+            if frame[0] == FRAME_PING:
+                self.__transport.write(encode_frame(frame[1], FRAME_PONG))
+            elif frame[0] != FRAME_PONG:
+                self.__frames.append(frame)
+                accepted = True
+        if accepted:
+            self.last_message = self.last_received
+        return accepted
+
+
+    def buffer_updated(self, nbytes: int) -> None:
+        self.last_received = self.__loop.time()
+        try:
+            frames = self.__parser.buffer_updated(nbytes)
+        except FrameError:
+            self.__transport.abort()
+            return
+        if not self.__accept_frames(frames):
+            return
+        if len(self.__frames) >= MAX_PENDING_FRAMES and not self.__reading_paused:
+            self.__reading_paused = True
+            self.__transport.pause_reading()
+        self.__wake(self.__frame_waiter)
+
+
+    def eof_received(self) -> bool:
+        return False
+
+
+    def connection_lost(self, exc: Optional[Exception]) -> None:
+        self.__closed = True
+        self.__wake(self.__frame_waiter)
+        self.__wake(self.__drain_waiter)
+
+
+    def pause_writing(self) -> None:
+        self.__writing_paused = True
+
+
+    def resume_writing(self) -> None:
+        self.__writing_paused = False
+        self.__wake(self.__drain_waiter)
+
+
+    @staticmethod
+    def __wake(waiter: Optional[asyncio.Future]) -> None:
+        if waiter is not None and not waiter.done():
+            waiter.set_result(None)
+
+
+    async def recv_frame(self) -> Optional[tuple[int, bytes]]:
+        while not self.__frames:
+            if self.__closed:
+                return None
+            self.__frame_waiter = asyncio.get_event_loop().create_future()
+            await self.__frame_waiter
+        if self.__reading_paused and len(self.__frames) <= MAX_PENDING_FRAMES // 2:
+            self.__reading_paused = False
+            self.__transport.resume_reading()
+        return self.__frames.popleft()
+
+
+    async def recv_message(self) -> Optional[bytes]:
+        frame = await self.recv_frame()
+        return None if frame is None else frame[1]
+
+
+    async def recv_text(self) -> str:
+        message = await self.recv_message()
+        if message is None:
+            raise ConnectionResetError("Connection lost")
+        return message.decode("utf-8")
+
+
+    async def drain(self) -> None:
+        if self.__closed:
+            raise ConnectionResetError("Connection lost")
+        while self.__writing_paused and not self.__closed:
+            self.__drain_waiter = asyncio.get_event_loop().create_future()
+            await self.__drain_waiter
+
+
+    async def send_message(self, payload: bytes, frame_type: int = FRAME_TEXT) -> None:
+        if self.__closed:
+            raise ConnectionResetError("Connection lost")
+        self.__transport.write(encode_frame(payload, frame_type))
+        await self.drain()
+
+
+    def write_frame(self, payload: bytes, frame_type: int = FRAME_TEXT) -> None:
+        if self.__closed:
+            raise ConnectionResetError("Connection lost")
+        self.__transport.write(encode_frame(payload, frame_type))
+
+
+    async def flush(self) -> None:
+        if self.__closed:
+            raise ConnectionResetError("Connection lost")
+        self.__transport.set_write_buffer_limits(0)
+        await self.drain()
+        if self.__closed:
+            raise ConnectionResetError("Connection lost")
+
+
+    async def send_frames(self, frames: list[bytes]) -> None:
+        if self.__closed:
+            raise ConnectionResetError("Connection lost")
+        self.__transport.writelines(frames)
+        await self.drain()
+
+
+    def ping(self) -> None:
+        if not self.__closed:
+            self.__transport.write(encode_frame(b"", FRAME_PING))
+
+
+    def peer_host(self) -> Optional[str]:
+        peer = None if self.__transport is None else self.__transport.get_extra_info("peername")
+        return peer[0] if isinstance(peer, tuple) else None
+
+
+    def fileno(self) -> int:
+        if self.__closed or self.__transport is None or self.__transport.is_closing():
+            return -1
+        sock = self.__transport.get_extra_info("socket")
+        return -1 if sock is None else sock.fileno()
+
+
+    def detach(self) -> tuple[socket.socket, bytes]:
+        if self.__closed or self.__transport.get_write_buffer_size():
+            raise ConnectionError("Connection can not be detached")
+        self.__transport.pause_reading()
+        sock = socket.socket(fileno=os.dup(self.__transport.get_extra_info("socket").fileno()))
+        pending = b"".join(encode_frame(payload, frame_type) for frame_type, payload in self.__frames)
+        pending += self.__parser.unconsumed()
+        self.__frames.clear()
+        self.__closed = True
+        self.__transport.abort()
+        return sock, pending
+
+
+    def close(self) -> None:
+        if self.__transport is not None:
+            self.__transport.close()
+
+
+    def abort(self, reason: Optional[str] = None) -> None:
+        if self.expired is None:
+            self.expired = reason
+        if self.__transport is not None:
+            self.__transport.abort()
+
+
+    def __repr__(self) -> str:
+        peer = None if self.__transport is None else self.__transport.get_extra_info("peername")
+        return f"FramedConnection({peer})"
+
+
+class FrameBatcher:
+    def __init__(self, connection: FramedConnection, max_frame_size: int = MAX_FRAME_SIZE) -> None:
+        self.__connection: FramedConnection = connection
+        self.__max_frame_size: int = max_frame_size
+        self.__items: list[bytes] = []
+
+
+    def add(self, item: Any) -> None:
+        encoded = json.dumps(item).encode("utf-8")
+        if len(encoded) + 2 > self.__max_frame_size:
+            raise FrameError(f"item is too large: {len(encoded)} > {self.__max_frame_size - 2}")
+        if not self.__items:
+            asyncio.get_event_loop().call_soon(self.__flush)
+        self.__items.append(encoded)
+
+
+    def __flush(self) -> None:
+        items, self.__items = self.__items, []
+        start, size = 0, 1
+        try:
+            for index, item in enumerate(items):
+                if size + len(item) + 1 > self.__max_frame_size:
+                    self.__write(items[start:index])
+                    start, size = index, 1
+                size += len(item) + 1
+            self.__write(items[start:])
+        except ConnectionError:
+            pass
+
+
+    def __write(self, items: list[bytes]) -> None:
+        self.__connection.write_frame(b"[" + b",".join(items) + b"]", FRAME_CONTROL)
@@ -0,0 +1,144 @@
+import json
+import os
+import time
+from collections import deque
+from typing import Iterable, Union
+from utils.structured_logging import get_logger
+
+
+log = get_logger(__name__)
+
+
+class WordFilter:
+    def __init__(self, words: Iterable[str]) -> None:
+        self.words: tuple[str, ...] = tuple(sorted({word.lower() for word in words if word}))
+        self.__goto: list[dict[str, int]] = [{}]
+        self.__fail: list[int] = [0]
+        self.__match_length: list[int] = [0]
+        for word in self.words:
+            self.__add(word)
+        self.__link()
+
+
+    def __add(self, word: str) -> None:
+        state = 0
+        for char in word:
+            next_state = self.__goto[state].get(char)
+            if next_state is None:
+                next_state = len(self.__goto)
+                self.__goto[state][char] = next_state
+                self.__goto.append({})
+                self.__fail.append(0)
+                self.__match_length.append(0)
+            state = next_state
+        self.__match_length[state] = len(word)
+
+
+    def __link(self) -> None:
+        queue = deque(self.__goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self.__goto[state].items():
+                queue.append(next_state)
+                fail = self.__fail[state]
+                while fail and char not in self.__goto[fail]:
+                    fail = self.__fail[fail]
+                self.__fail[next_state] = self.__goto[fail].get(char, 0)
+                self.__match_length[next_state] = max(self.__match_length[next_state],
+                                                      self.__match_length[self.__fail[next_state]])
+
+
+    @staticmethod
+    def __normalize(text: str) -> str:
+        lowered = text.lower()
+        if len(lowered) == len(text):
+            return lowered
+        return "".join(char.lower()[:1] for char in text)
+
+
+    def __scan(self, text: str) -> Iterable[tuple[int, int]]:
+        goto, fail, match_length = self.__goto, self.__fail, self.__match_length
+        state = 0
+        for end, char in enumerate(self.__normalize(text), 1):
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            if match_length[state]:
+                yield end - match_length[state], end
+
+
+    def contains(self, text: str) -> bool:
+        for _ in self.__scan(text):
+            return True
+        return False
+
+
+    def censor(self, text: str, mask: str = "*") -> str:
+        censored = None
+        for start, end in self.__scan(text):
+            if censored is None:
+                censored = list(text)
+            censored[start:end] = mask * (end - start)
+        return text if censored is None else "".join(censored)
+
+
+    def censor_bytes(self, data: Union[bytes, memoryview], mask: str = "*") -> Union[bytes, memoryview]:
+        text = str(data, "utf-8")
+        censored = self.censor(text, mask)
+        return data if censored is text else censored.encode("utf-8")
+
+
+    def __len__(self) -> int:
+        return len(self.words)
+
+
+class BannedWordsFilter:
+    def __init__(self, path: str, check_interval: float = 1.0) -> None:
+        self.path: str = path
+        self.__check_interval: float = check_interval
+        self.__checked_at: float = 0
+        self.__mtime: float = 0
+        self.__filter: WordFilter = WordFilter(())
+        self.reload()
+
+
+    def reload(self) -> bool:
+        try:
+            mtime = os.stat(self.path).st_mtime
+            with open(self.path, "r") as file:
+                word_filter = WordFilter(json.load(file)["banned_words"])
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            log.error("Не удалось загрузить словарь запрещенных слов %s: %s", self.path, e)
+            return False
+        self.__filter, self.__mtime = word_filter, mtime
+        self.__checked_at = time.monotonic()
+        return True
+
+
+    def __current(self) -> WordFilter:
+        now = time.monotonic()
+        if now - self.__checked_at >= self.__check_interval:
+            self.__checked_at = now
+            try:
+                if os.stat(self.path).st_mtime != self.__mtime:
+                    self.reload()
+            except OSError:
+                pass
+        return self.__filter
+
+
+    @property
+    def words(self) -> tuple[str, ...]:
+        return self.__current().words
+
+
+    def contains(self, text: str) -> bool:
+        return self.__current().contains(text)
+
+
+    def censor(self, text: str, mask: str = "*") -> str:
+        return self.__current().censor(text, mask)
+
+
+    def censor_bytes(self, data: Union[bytes, memoryview], mask: str = "*") -> Union[bytes, memoryview]:
+        return self.__current().censor_bytes(data, mask)